@@ -1,21 +1,29 @@
+import copy
+import multiprocessing
+import sys
 import time
 import traceback
 from typing import Optional
 
-if __name__ == '__main__':
+if __name__ in ('__main__', '__mp_main__'):  # __mp_main__: imported by the packaging processes
 	from utils import utils, constant
 	from utils.logger import Logger
 	from utils.recorder import Recorder
+	from utils.replay_packager import ReplayPackager
+	from utils.supervisor import Supervisor
 	from utils.config import Config
 	from utils.pycraft.exceptions import YggdrasilError
 else:	
 	from .utils import utils, constant
 	from .utils.logger import Logger
 	from .utils.recorder import Recorder
+	from .utils.replay_packager import ReplayPackager
+	from .utils.supervisor import Supervisor
 	from .utils.config import Config
 	from .utils.pycraft.exceptions import YggdrasilError
 
 recorder: Optional[Recorder] = None
+packager: Optional[ReplayPackager] = None
 logger = Logger(name='PCRC')
 ConfigFile = utils.get_path('config.json')
 TranslationFolder = utils.get_path('lang/')
@@ -29,15 +37,29 @@ def on_start_up():
 	logger.log('Enter "start" to start PCRC')
 
 
+# shared by the recorders created in this run
+def get_packager():
+	global packager, logger
+	if packager is None:
+		packager_logger = copy.deepcopy(logger)
+		packager_logger.thread = 'Packager'
+		packager = ReplayPackager(packager_logger)
+		packager.start()
+	return packager
+
+
 def start():
 	global recorder, logger, ConfigFile
 	if recorder is None or recorder.is_stopped():
 		logger.log('Creating new PCRC recorder')
 		try:
-			recorder = Recorder(ConfigFile, TranslationFolder)
+			recorder = Recorder(ConfigFile, TranslationFolder, packager=get_packager())
 		except YggdrasilError as e:
 			logger.error(e)
 			return
+		count = get_packager().recover(compression_level=recorder.config.get('mcpr_compression_level'))
+		if count > 0:
+			logger.log('Packaging {} segment(s) left by crashed or exited recorders'.format(count))
 		ret = recorder.start()
 		logger.log('Recorder started, success = {}'.format(ret))
 	else:
@@ -183,9 +205,77 @@ def main():
 	except Exception:
 		logger.error(traceback.format_exc())
 
+	if packager is not None and packager.pending_count > 0:
+		logger.log('Waiting for {} segment(s) being packaged'.format(packager.pending_count))
+		packager.wait()
+	logger.log('Exited')
+
+
+# Records every server listed in the profile file, see Supervisor
+def supervisor_main(profile_file):
+	global logger
+	try:
+		supervisor = Supervisor(profile_file, TranslationFolder)
+	except Exception:
+		logger.error('Fail to load server profiles from "{}"'.format(profile_file))
+		logger.error(traceback.format_exc())
+		return
+	logger.log('Enter "start [server]", "stop [server]", "restart [server]", "status", "say <server> <text>" or "exit"')
+	while True:
+		try:
+			text = input()
+			if text != '':
+				logger.log('Processing command "{}"'.format(text))
+				cmd = text.split(' ')
+				name = cmd[1] if len(cmd) >= 2 else None
+				if cmd[0] == 'start':
+					supervisor.start(name)
+				elif cmd[0] == 'stop':
+					supervisor.stop(name)
+				elif cmd[0] == 'restart':
+					supervisor.restart(name)
+				elif text == 'status':
+					for line in supervisor.format_status():
+						logger.log(line)
+				elif text == 'exit':
+					break
+				elif cmd[0] == 'say' and len(cmd) >= 3:
+					recorder = supervisor.get_recorder(name)
+					if recorder is not None and recorder.is_online():
+						recorder.chat(' '.join(cmd[2:]))
+					else:
+						logger.warn('Recorder of "{}" is not online'.format(name))
+				else:
+					logger.error('Command not found!')
+			else:
+				logger.error("Please enter the command!")
+		except (KeyboardInterrupt, SystemExit):
+			break
+		except Exception:
+			logger.error(traceback.format_exc())
+	try:
+		if supervisor.is_working():
+			logger.log('Stopping recorders before exit')
+			supervisor.stop()
+		else:
+			logger.log('Waiting for recorders to stop before exit')
+			supervisor.wait_stopped()
+	except (KeyboardInterrupt, SystemExit):
+		logger.log('Forced to stop')
+		return
+	except Exception:
+		logger.error(traceback.format_exc())
+
+	if supervisor.packager.pending_count > 0:
+		logger.log('Waiting for {} segment(s) being packaged'.format(supervisor.packager.pending_count))
+		supervisor.packager.wait()
 	logger.log('Exited')
 
 
 if __name__ == "__main__":
+	multiprocessing.freeze_support()  # segments are packaged in child processes
 	on_start_up()
-	main()
+	if len(sys.argv) >= 3 and sys.argv[1] == '--supervisor':
+		supervisor_main(sys.argv[2])
+	else:
+		main()
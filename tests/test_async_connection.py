@@ -0,0 +1,90 @@
+# coding: utf8
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools'))
+from FakeServer import FakeServer
+from utils import protocol
+from utils.SARC.packet import Packet as SARCPacket
+from utils.pycraft.networking.async_connection import AsyncConnection, AsyncSession, get_event_loop
+from utils.pycraft.networking.packets.clientbound.play import TimeUpdatePacket
+
+
+def time_update(table, world_age):
+	packet = SARCPacket()
+	packet.write_varint(table.ids['Time Update'])
+	packet.write_long(world_age)
+	packet.write_long(6000)
+	return bytes(packet.flush())
+
+
+class AsyncConnectionTest(unittest.TestCase):
+	RecordCount = 200
+
+	def setUp(self):
+		table = protocol.get_table(754)
+		records = [(i * 50, time_update(table, i)) for i in range(self.RecordCount)]
+		fake_server = FakeServer(records, 754, compression_threshold=16, encryption=True)
+		self.server = asyncio.run_coroutine_threadsafe(fake_server.start(0), get_event_loop()).result()
+		self.exited = threading.Event()
+		self.connection = AsyncConnection(
+			'127.0.0.1', self.server.sockets[0].getsockname()[1], username='Tester', allowed_versions={754}, handle_exit=self.exited.set
+		)
+		self.world_ages = []
+		self.listener_threads = set()
+
+	def tearDown(self):
+		self.server.close()
+
+	def on_time_update(self, packet):
+		self.world_ages.append(packet.world_age)
+		self.listener_threads.add(threading.current_thread())
+
+	def record(self):
+		self.connection.register_packet_listener(self.on_time_update, TimeUpdatePacket)
+		self.connection.connect()
+		self.assertTrue(self.exited.wait(10))
+		self.assertIsNone(self.connection.exception)
+		self.assertEqual(self.world_ages, list(range(self.RecordCount)))
+
+	def test_encrypted_login(self):
+		self.record()
+		# the listeners are not called in the event loop thread
+		self.assertEqual([thread.name for thread in self.listener_threads], ['Packet Listener'])
+
+	def test_event_loop_does_not_take_write_lock(self):
+		lock_released = threading.Event()
+
+		def hold_write_lock():
+			with self.connection._write_lock:
+				lock_released.wait(10)
+
+		self.connection.register_packet_listener(self.on_time_update, TimeUpdatePacket)
+		self.connection.connect()
+		holder = threading.Thread(target=hold_write_lock)
+		holder.start()
+		try:
+			self.assertTrue(self.exited.wait(10))
+		finally:
+			lock_released.set()
+			holder.join()
+		self.assertEqual(self.world_ages, list(range(self.RecordCount)))
+
+	def test_reading_pauses_for_slow_listeners(self):
+		max_pending, resume_pending = AsyncSession.MaxPendingPackets, AsyncSession.ResumePendingPackets
+		AsyncSession.MaxPendingPackets, AsyncSession.ResumePendingPackets = 8, 4
+		try:
+			self.connection.register_packet_listener(lambda packet: time.sleep(0.001), TimeUpdatePacket)
+			self.record()
+		finally:
+			AsyncSession.MaxPendingPackets, AsyncSession.ResumePendingPackets = max_pending, resume_pending
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,41 @@
+# coding: utf8
+
+import copy
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.pycraft.networking.connection import ConnectionContext
+from utils.pycraft.networking.packets import PacketBuffer
+from utils.pycraft.networking.packets.clientbound.play import TimeUpdatePacket
+from utils.pycraft.networking.types import Long
+
+
+def deferred_time_update(world_age, time_of_day):
+	context = ConnectionContext(protocol_version=754)
+	buffer = PacketBuffer()
+	Long.send(world_age, buffer)
+	Long.send(time_of_day, buffer)
+	buffer.reset_cursor()
+	packet = TimeUpdatePacket(context)
+	packet.defer_read(buffer)
+	return packet
+
+
+class LazyPacketTest(unittest.TestCase):
+	def test_copy_before_parsing(self):
+		packet = deferred_time_update(123, 4000)
+		packet_copy = copy.copy(packet)
+		self.assertEqual(packet.time_of_day, 4000)
+		self.assertEqual(packet_copy.world_age, 123)
+		self.assertEqual(packet_copy.time_of_day, 4000)
+
+	def test_special_attribute_probe_keeps_body(self):
+		packet = deferred_time_update(123, 4000)
+		self.assertFalse(hasattr(packet, '__len__'))
+		self.assertEqual(packet.world_age, 123)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,80 @@
+# coding: utf8
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import constant, protocol
+from utils.config import Config
+from utils.logger import Logger
+from utils.packet_processor import PacketProcessor
+from utils.SARC.packet import Packet as SARCPacket
+
+
+class DummyRecorder:
+	def __init__(self, protocol_version, **options):
+		self.temp_dir = tempfile.TemporaryDirectory()
+		self.config = Config(os.path.join(self.temp_dir.name, 'config.json'))
+		for option, value in options.items():
+			self.config.set_value(option, value, forced=True)
+		self.logger = Logger(name='Test', file_name=os.devnull)
+		self.mc_protocol = protocol_version
+		self.mc_version = constant.Map_ProtocolToVersion[protocol_version]
+		self.protocol_table = protocol.get_table(protocol_version)
+		self.player_uuids = set()
+		self.pos = None
+
+	def updatePlayerMovement(self, t=None):
+		pass
+
+
+def make_packet(table, packet_name, *fields):
+	packet = SARCPacket()
+	packet.write_varint(table.ids[packet_name])
+	for field_type, value in fields:
+		getattr(packet, 'write_' + field_type)(value)
+	return bytes(packet.flush())
+
+
+class InterestFilterTest(unittest.TestCase):
+	def test_dropped_head_look_is_not_elided_later(self):
+		recorder = DummyRecorder(754, interest_radius=32, elide_redundant_updates=True, with_player_only=False)
+		table = recorder.protocol_table
+		processor = PacketProcessor(recorder, recorder.mc_version, table)
+		processor.process(make_packet(
+			table, 'Spawn Player', ('varint', 1), ('uuid', '00000000-0000-0000-0000-000000000001'),
+			('double', 0.0), ('double', 64.0), ('double', 0.0), ('ubyte', 0), ('ubyte', 0)
+		))
+		processor.process(make_packet(
+			table, 'Spawn Living Entity', ('varint', 2), ('uuid', '00000000-0000-0000-0000-000000000002'), ('varint', 60),
+			('double', 100.0), ('double', 64.0), ('double', 0.0), ('ubyte', 0), ('ubyte', 0), ('ubyte', 0),
+			('short', 0), ('short', 0), ('short', 0)
+		))
+		head_look = make_packet(table, 'Entity Head Look', ('varint', 2), ('ubyte', 77))
+		self.assertIsNone(processor.process(head_look))  # 100 blocks away
+		teleport = make_packet(
+			table, 'Entity Teleport', ('varint', 2), ('double', 5.0), ('double', 64.0), ('double', 0.0),
+			('ubyte', 0), ('ubyte', 0), ('bool', True)
+		)
+		self.assertIsNotNone(processor.process(teleport))
+		self.assertIsNotNone(processor.process(head_look))
+		self.assertIsNone(processor.process(head_look))  # recorded already
+
+	def test_far_block_change_is_recorded(self):
+		recorder = DummyRecorder(754, interest_radius=32, with_player_only=False)
+		table = recorder.protocol_table
+		processor = PacketProcessor(recorder, recorder.mc_version, table)
+		processor.process(make_packet(
+			table, 'Spawn Player', ('varint', 1), ('uuid', '00000000-0000-0000-0000-000000000001'),
+			('double', 0.0), ('double', 64.0), ('double', 0.0), ('ubyte', 0), ('ubyte', 0)
+		))
+		sound = make_packet(table, 'Sound Effect', ('varint', 1), ('varint', 0), ('int', 8000), ('int', 512), ('int', 0), ('float', 1.0), ('float', 1.0))
+		self.assertIsNone(processor.process(sound))  # 1000 blocks away
+		block_change = make_packet(table, 'Block Change', ('long', 1000 << 38 | 64), ('varint', 1))
+		self.assertIsNotNone(processor.process(block_change))
+
+
+if __name__ == '__main__':
+	unittest.main()
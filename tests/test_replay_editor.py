@@ -0,0 +1,61 @@
+# coding: utf8
+
+import io
+import os
+import sys
+import unittest
+import zipfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import protocol
+from utils.replay_editor import RemoveNonPlayerEntities, copy_zip_member
+from utils.SARC.packet import Packet as SARCPacket
+
+
+def make_record(table, packet_name, *fields):
+	packet = SARCPacket()
+	packet.write_varint(table.ids[packet_name])
+	for field_type, value in fields:
+		getattr(packet, 'write_' + field_type)(value)
+	return 0, table.ids[packet_name], bytes(packet.flush())
+
+
+class RemoveNonPlayerEntitiesTest(unittest.TestCase):
+	def test_entity_status_of_player_is_kept(self):
+		for protocol_version in (340, 754):
+			table = protocol.get_table(protocol_version)
+			stage = RemoveNonPlayerEntities()
+			stage.setup(table, {'protocol': protocol_version})
+			spawn_player = make_record(
+				table, 'Spawn Player', ('varint', 300), ('uuid', '00000000-0000-0000-0000-000000000001'),
+				('double', 0.0), ('double', 0.0), ('double', 0.0), ('ubyte', 0), ('ubyte', 0)
+			)
+			self.assertEqual(stage.process(spawn_player), [spawn_player])
+			# Entity Status has an int entity id, a varint read of it is 0
+			player_status = make_record(table, 'Entity Status', ('int', 300), ('byte', 3))
+			self.assertEqual(stage.process(player_status), [player_status])
+			mob_status = make_record(table, 'Entity Status', ('int', 301), ('byte', 2))
+			self.assertEqual(stage.process(mob_status), [])
+
+
+class CopyZipMemberTest(unittest.TestCase):
+	def test_member_is_copied_with_its_metadata(self):
+		source = io.BytesIO()
+		with zipfile.ZipFile(source, 'w') as zin:
+			zin.writestr(zipfile.ZipInfo('markers.json', (2026, 10, 17, 12, 0, 0)), b'[]' * 1000, zipfile.ZIP_DEFLATED)
+			zin.writestr(zipfile.ZipInfo('mods.json', (2026, 10, 17, 12, 0, 2)), b'{"requiredMods":[]}', zipfile.ZIP_STORED)
+		target = io.BytesIO()
+		with zipfile.ZipFile(source) as zin, zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as zout:
+			for info in zin.infolist():
+				copy_zip_member(zin, info, zout, chunk_size=7)
+		with zipfile.ZipFile(source) as zin, zipfile.ZipFile(target) as zout:
+			self.assertIsNone(zout.testzip())
+			for info in zin.infolist():
+				new_info = zout.getinfo(info.filename)
+				self.assertEqual(zout.read(new_info), zin.read(info))
+				self.assertEqual(new_info.date_time, info.date_time)
+				self.assertEqual(new_info.compress_type, info.compress_type)
+
+
+if __name__ == '__main__':
+	unittest.main()
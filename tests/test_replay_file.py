@@ -0,0 +1,43 @@
+# coding: utf8
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import file_writer
+from utils.logger import Logger
+from utils.replay_file import ReplayFile
+
+
+class ReplayFileTest(unittest.TestCase):
+	def test_json_files_are_written_in_writer_thread(self):
+		threads = set()
+		replace_file = file_writer.replace_file
+
+		def record_thread(file_name, data):
+			threads.add(threading.current_thread())
+			replace_file(file_name, data)
+
+		file_writer.replace_file = record_thread
+		try:
+			with tempfile.TemporaryDirectory() as folder:
+				replay_file = ReplayFile(Logger(name='Test', file_name=os.devnull), path=os.path.join(folder, 'segment'))
+				meta_data = {'protocol': 754, 'duration': 1000}
+				replay_file.set_meta_data(meta_data)
+				meta_data['duration'] = 2000  # serialized when set already
+				replay_file.close()
+				with open(os.path.join(folder, 'segment', 'metaData.json')) as f:
+					self.assertEqual(json.load(f), {'protocol': 754, 'duration': 1000})
+				with open(os.path.join(folder, 'segment', 'markers.json')) as f:
+					self.assertEqual(json.load(f), [])
+		finally:
+			file_writer.replace_file = replace_file
+		self.assertEqual(threads, {replay_file.writer})
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,62 @@
+# coding: utf8
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import constant, file_writer, replay_packager
+from utils.logger import Logger
+from utils.replay_file import RecordHeader, ReplayFile
+from utils.replay_packager import PackagingJob, ReplayPackager
+
+
+class RecoverTest(unittest.TestCase):
+	def test_too_small_recording_is_removed(self):
+		with tempfile.TemporaryDirectory() as folder:
+			path = os.path.join(folder, 'PCRC_2026_10_17_12_00_00')
+			os.makedirs(path)
+			with open(os.path.join(path, 'recording.tmcpr'), 'wb') as f:
+				f.write(RecordHeader.pack(0, 1) + b'\x00')
+			meta_data_file = os.path.join(path, 'metaData.json')
+			with open(meta_data_file, 'w') as f:
+				json.dump({'protocol': 754, 'duration': 0}, f)
+			stale_time = time.time() - constant.StaleRecordingTime - 60
+			os.utime(meta_data_file, (stale_time, stale_time))
+
+			packager = ReplayPackager(Logger(name='Test', file_name=os.devnull))
+			self.assertEqual(packager.recover(folder), 0)
+			self.assertFalse(os.path.exists(path))
+
+
+class SubmitTest(unittest.TestCase):
+	def test_job_is_saved_in_writer_thread(self):
+		threads = set()
+		replace_file = file_writer.replace_file
+
+		def record_thread(file_name, data):
+			threads.add(threading.current_thread())
+			replace_file(file_name, data)
+
+		file_writer.replace_file = replay_packager.replace_file = record_thread
+		try:
+			with tempfile.TemporaryDirectory() as folder:
+				logger = Logger(name='Test', file_name=os.devnull)
+				replay_file = ReplayFile(logger, path=os.path.join(folder, 'segment'))
+				file_path = os.path.join(folder, 'PCRC_test.mcpr')
+				packager = ReplayPackager(logger)  # not started, so the job stays queued
+				packager.submit(replay_file, file_path, 6)
+				self.assertTrue(packager.is_pending(file_path))
+				replay_file.close()
+				self.assertEqual(PackagingJob.load(replay_file.path).file_path, file_path)
+		finally:
+			file_writer.replace_file = replay_packager.replace_file = replace_file
+		self.assertEqual(threads, {replay_file.writer})
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,81 @@
+# coding: utf8
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import protocol
+from utils.SARC.packet import Packet as SARCPacket
+from utils.world_state import WorldState
+
+PLAYER_UUID = '00000000-0000-0000-0000-000000000001'
+
+
+def make_packet(table, packet_name, *fields):
+	packet = SARCPacket()
+	packet.write_varint(table.ids[packet_name])
+	for field_type, value in fields:
+		getattr(packet, 'write_' + field_type)(value)
+	return table.ids[packet_name], bytes(packet.flush())
+
+
+def chunk_data(table, x, z):
+	return make_packet(table, 'Chunk Data', ('int', x), ('int', z), ('bool', True), ('long', 0))
+
+
+class WorldStateTest(unittest.TestCase):
+	def setUp(self):
+		self.table = protocol.get_table(754)
+		self.world_state = WorldState(self.table)
+
+	def update(self, packet):
+		self.world_state.update(*packet)
+		return packet[1]
+
+	def test_painting_and_experience_orb_are_seeded(self):
+		painting = self.update(make_packet(
+			self.table, 'Spawn Painting', ('varint', 10), ('uuid', '00000000-0000-0000-0000-00000000000a'),
+			('varint', 3), ('long', 0), ('byte', 2)
+		))
+		orb = self.update(make_packet(
+			self.table, 'Spawn Experience Orb', ('varint', 11), ('double', 1.0), ('double', 64.0), ('double', 2.0), ('short', 7)
+		))
+		packets = self.world_state.seed_packets()
+		self.assertIn(painting, packets)
+		self.assertIn(orb, packets)
+		self.update(make_packet(self.table, 'Destroy Entities', ('varint', 1), ('varint', 11)))
+		self.assertNotIn(orb, self.world_state.seed_packets())
+
+	def test_player_info_updates_follow_the_add(self):
+		add = self.update(make_packet(
+			self.table, 'Player Info', ('varint', 0), ('varint', 1), ('uuid', PLAYER_UUID), ('utf', 'Steve'),
+			('varint', 0), ('varint', 0), ('varint', 20), ('bool', False)
+		))
+		old_game_mode = self.update(make_packet(self.table, 'Player Info', ('varint', 1), ('varint', 1), ('uuid', PLAYER_UUID), ('varint', 1)))
+		game_mode = self.update(make_packet(self.table, 'Player Info', ('varint', 1), ('varint', 1), ('uuid', PLAYER_UUID), ('varint', 3)))
+		display_name = self.update(make_packet(
+			self.table, 'Player Info', ('varint', 3), ('varint', 1), ('uuid', PLAYER_UUID), ('bool', True), ('utf', '{"text":"Alex"}')
+		))
+		packets = self.world_state.seed_packets()
+		self.assertNotIn(old_game_mode, packets)
+		self.assertLess(packets.index(add), packets.index(game_mode))
+		self.assertLess(packets.index(game_mode), packets.index(display_name))
+
+		self.update(make_packet(self.table, 'Player Info', ('varint', 4), ('varint', 1), ('uuid', PLAYER_UUID)))
+		packets = self.world_state.seed_packets()
+		self.assertNotIn(game_mode, packets)
+		self.assertNotIn(display_name, packets)
+
+	def test_touched_chunk_is_evicted_last(self):
+		first = self.update(chunk_data(self.table, 0, 0))
+		second = self.update(chunk_data(self.table, 1, 0))
+		self.world_state.touch_chunk((0, 0))
+		self.world_state.set_byte_budget(len(first))
+		packets = self.world_state.seed_packets()
+		self.assertIn(first, packets)
+		self.assertNotIn(second, packets)
+
+
+if __name__ == '__main__':
+	unittest.main()
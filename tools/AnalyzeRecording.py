@@ -0,0 +1,68 @@
+# coding: utf8
+"""
+Reports what takes the space in a recording: bytes and counts per packet type, per entity type and per time bucket
+The recording is scanned in parallel, so it works on recordings of several GB
+
+Usage: python AnalyzeRecording.py <file.mcpr | recording directory | recording.tmcpr> [options]
+Options:
+  -o <report.json | report.csv>  The report file. Default: <file>_analysis.json
+  --workers <amount>             Amount of scanning processes. Default: the amount of CPU cores
+  --bucket <seconds>             Length of the time buckets. Default: 60
+  --protocol <protocol>          The protocol version of the recording, read from metaData.json if not given
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import constant
+from utils.recording_analyzer import RecordingAnalyzer, save_report
+
+
+def print_top(title, entries, key_name, total, amount=10):
+	print('{}:'.format(title))
+	for entry in entries[:amount]:
+		print('  {}: {} packets, {}MB ({:.1%})'.format(
+			entry[key_name], entry['count'], round(entry['bytes'] / constant.BytePerMB, 3), entry['bytes'] / total if total > 0 else 0
+		))
+
+
+def main():
+	args = sys.argv[1:]
+	if len(args) < 1 or args[0] in ('-h', '--help'):
+		print(__doc__.strip())
+		return
+	options = {'-o': None, '--workers': None, '--bucket': '60', '--protocol': None}
+	for i in range(1, len(args), 2):
+		if args[i] not in options:
+			print('Unknown option {}'.format(args[i]))
+			return
+		if i + 1 >= len(args):
+			print('Option {} needs a value'.format(args[i]))
+			print(__doc__.strip())
+			return
+		options[args[i]] = args[i + 1]
+	file_name = args[0]
+	if not os.path.exists(file_name):
+		print('File "{}" not found'.format(file_name))
+		return
+	report_file_name = options['-o']
+	if report_file_name is None:
+		report_file_name = os.path.splitext(os.path.abspath(file_name).rstrip(os.sep))[0] + '_analysis.json'
+
+	analyzer = RecordingAnalyzer(
+		int(options['--workers']) if options['--workers'] is not None else None,
+		int(float(options['--bucket']) * 1000)
+	)
+	start_time = time.time()
+	report = analyzer.analyze(file_name, int(options['--protocol']) if options['--protocol'] is not None else None)
+	save_report(report, report_file_name)
+	print('Analyzed {} packets, {}MB in {:.1f}s, report saved to "{}"'.format(
+		report['packets'], round(report['bytes'] / constant.BytePerMB, 2), time.time() - start_time, report_file_name
+	))
+	print_top('Top packet types', report['packet_types'], 'name', report['bytes'])
+	print_top('Top entity types', report['entity_types'], 'type', report['bytes'])
+
+
+if __name__ == '__main__':
+	main()
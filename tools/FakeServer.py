@@ -0,0 +1,252 @@
+# coding: utf8
+"""
+A local stand-in of a Minecraft server that replays the packets of a recording to every client logging in
+It answers status queries and offline mode logins, then sends the recorded packets and disconnects the client
+The login can be encrypted like on an offline mode server behind a proxy, the client isn't authenticated in any case
+
+Usage: python FakeServer.py <file.mcpr | recording.tmcpr> [options]
+Options:
+  --port <port>              The port to listen on. Default: 25565
+  --protocol <protocol>      The protocol version of the recording, read from the .mcpr file if not given
+  --compression <threshold>  Enable compression with the given threshold. Default: -1 (disabled)
+  --speed <factor>           Replay speed, 0 to send everything as fast as possible. Default: 0
+  --encryption <true|false>  Encrypt the connection after the login start. Default: false
+"""
+import asyncio
+import json
+import os
+import sys
+import uuid
+import zipfile
+import zlib
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import constant, protocol
+from utils.replay_file import read_records
+from utils.SARC.packet import Packet as SARCPacket
+from utils.pycraft.networking.async_connection import FrameDecoder
+from utils.pycraft.networking.encryption import create_AES_cipher
+
+
+def load_recording(file_name):
+	if zipfile.is_zipfile(file_name):
+		with zipfile.ZipFile(file_name) as zipf:
+			protocol_version = json.loads(zipf.read('metaData.json'))['protocol']
+			data = zipf.read('recording.tmcpr')
+	else:
+		protocol_version = None
+		with open(file_name, 'rb') as f:
+			data = f.read()
+	return protocol_version, list(read_records(data))
+
+
+class ClientSession:
+	def __init__(self, server, reader, writer):
+		self.server = server
+		self.reader = reader
+		self.writer = writer
+		self.decoder = FrameDecoder()
+		self.compression_threshold = -1
+		self.encryptor = None
+		self.decryptor = None
+
+	async def read_packet(self):
+		while True:
+			frame = self.decoder.next_frame()
+			if frame is not None:
+				packet = SARCPacket()
+				packet.receive(frame)
+				if self.compression_threshold >= 0 and packet.read_varint() > 0:
+					packet.receive(zlib.decompress(packet.read(packet.remaining())))
+				packet.read_varint()  # packet id
+				return packet
+			data = await self.reader.read(65536)
+			if len(data) == 0:
+				raise EOFError()
+			if self.decryptor is not None:
+				data = self.decryptor.update(data)
+			self.decoder.feed(data)
+
+	def send(self, data):
+		data = bytes(data)
+		if self.compression_threshold >= 0:
+			body = SARCPacket()
+			if len(data) >= self.compression_threshold:
+				body.write_varint(len(data))
+				body.write(zlib.compress(data))
+			else:
+				body.write_varint(0)
+				body.write(data)
+			data = bytes(body.flush())
+		frame = SARCPacket()
+		frame.write_varint(len(data))
+		frame.write(data)
+		data = frame.flush()
+		if self.encryptor is not None:
+			data = self.encryptor.update(data)
+		self.writer.write(data)
+
+	def send_packet(self, packet_id, *fields):
+		packet = SARCPacket()
+		packet.write_varint(packet_id)
+		for kind, value in fields:
+			getattr(packet, 'write_' + kind)(value)
+		self.send(packet.flush())
+
+	async def handle(self):
+		handshake = await self.read_packet()
+		client_protocol = handshake.read_varint()
+		handshake.read_utf()
+		handshake.read_ushort()
+		next_state = handshake.read_varint()
+		if next_state == 1:
+			await self.handle_status()
+		elif client_protocol != self.server.protocol_version:
+			self.send_packet(0x00, ('utf', json.dumps({'text': 'Outdated client! Please use {}'.format(self.server.mc_version)})))
+		else:
+			await self.handle_login()
+		await self.writer.drain()
+
+	async def handle_status(self):
+		await self.read_packet()  # Request
+		self.send_packet(0x00, ('utf', json.dumps({
+			'version': {'name': self.server.mc_version, 'protocol': self.server.protocol_version},
+			'players': {'max': 20, 'online': 0},
+			'description': {'text': 'PCRC fake server'}
+		})))
+		ping = await self.read_packet()
+		self.send_packet(0x01, ('long', ping.read_long()))
+
+	async def handle_login(self):
+		name = (await self.read_packet()).read_utf()
+		print('{} is logging in'.format(name))
+		if self.server.private_key is not None:
+			await self.enable_encryption()
+		if self.server.compression_threshold >= 0:
+			self.send_packet(0x03, ('varint', self.server.compression_threshold))
+			self.compression_threshold = self.server.compression_threshold
+		player_uuid = uuid.uuid3(uuid.NAMESPACE_OID, 'OfflinePlayer:' + name)  # any stable uuid works here
+		if self.server.protocol_version >= 707:  # 1.16+
+			self.send_packet(0x02, ('uuid', str(player_uuid)), ('utf', name))
+		else:
+			self.send_packet(0x02, ('utf', str(player_uuid)), ('utf', name))
+
+		# packets from the client are ignored
+		drain_task = asyncio.ensure_future(self.discard_incoming())
+		try:
+			loop = asyncio.get_event_loop()
+			start_time = loop.time()
+			for time_stamp, data in self.server.records:
+				if self.server.speed > 0:
+					delay = start_time + time_stamp / 1000 / self.server.speed - loop.time()
+					if delay > 0:
+						await asyncio.sleep(delay)
+				self.send(data)
+				await self.writer.drain()
+			print('Sent {} packets to {} in {:.2f}s'.format(len(self.server.records), name, loop.time() - start_time))
+			disconnect_id = self.server.protocol_table.ids['Disconnect (play)']
+			self.send_packet(disconnect_id, ('utf', json.dumps({'text': 'End of the recording'})))
+			await self.writer.drain()
+			# let the client close the connection first, so the disconnect packet doesn't get lost in a connection reset
+			await asyncio.wait_for(asyncio.shield(drain_task), 5)
+		except asyncio.TimeoutError:
+			pass
+		finally:
+			drain_task.cancel()
+
+	async def enable_encryption(self):
+		verify_token = os.urandom(4)
+		packet = SARCPacket()
+		packet.write_varint(0x01)  # Encryption Request
+		packet.write_utf('-')  # no server id, the client doesn't authenticate
+		for data in (self.server.public_key, verify_token):
+			packet.write_varint(len(data))
+			packet.write(data)
+		self.send(packet.flush())
+		response = await self.read_packet()
+		encrypted_secret = bytes(response.read(response.read_varint()))
+		encrypted_token = bytes(response.read(response.read_varint()))
+		shared_secret = self.server.private_key.decrypt(encrypted_secret, padding.PKCS1v15())
+		if self.server.private_key.decrypt(encrypted_token, padding.PKCS1v15()) != verify_token:
+			raise EOFError('Verify token mismatched')
+		cipher = create_AES_cipher(shared_secret)
+		self.encryptor = cipher.encryptor()
+		self.decryptor = cipher.decryptor()
+		# what the client sent after the Encryption Response is encrypted already
+		self.decoder.decrypt_remaining(self.decryptor)
+
+	async def discard_incoming(self):
+		try:
+			while True:
+				await self.read_packet()
+		except (EOFError, ConnectionError):
+			pass
+
+
+class FakeServer:
+	def __init__(self, records, protocol_version, compression_threshold=-1, speed=0, encryption=False):
+		self.records = records
+		self.protocol_version = protocol_version
+		self.mc_version = constant.Map_ProtocolToVersion[protocol_version]
+		self.protocol_table = protocol.get_table(protocol_version)
+		self.compression_threshold = compression_threshold
+		self.speed = speed
+		self.private_key = self.public_key = None
+		if encryption:
+			self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=1024)
+			self.public_key = self.private_key.public_key().public_bytes(
+				serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+			)
+
+	async def on_client_connected(self, reader, writer):
+		try:
+			await ClientSession(self, reader, writer).handle()
+		except (EOFError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+	async def start(self, port, host='127.0.0.1'):
+		server = await asyncio.start_server(self.on_client_connected, host, port)
+		print('Replaying {} packets of Minecraft {} on {}:{}'.format(len(self.records), self.mc_version, host, port))
+		return server
+
+	async def serve(self, port, host='127.0.0.1'):
+		server = await self.start(port, host)
+		async with server:
+			await server.serve_forever()
+
+
+def main():
+	args = sys.argv[1:]
+	if len(args) < 1:
+		print(__doc__.strip())
+		return
+	options = {'--port': '25565', '--protocol': None, '--compression': '-1', '--speed': '0', '--encryption': 'false'}
+	for i in range(1, len(args), 2):
+		if args[i] not in options:
+			print('Unknown option {}'.format(args[i]))
+			return
+		if i + 1 >= len(args):
+			print('Option {} needs a value'.format(args[i]))
+			print(__doc__.strip())
+			return
+		options[args[i]] = args[i + 1]
+	protocol_version, records = load_recording(args[0])
+	if options['--protocol'] is not None:
+		protocol_version = int(options['--protocol'])
+	if protocol_version is None:
+		print('Protocol version unknown, please specify it')
+		return
+	server = FakeServer(records, protocol_version, int(options['--compression']), float(options['--speed']), options['--encryption'].lower() == 'true')
+	try:
+		asyncio.run(server.serve(int(options['--port'])))
+	except KeyboardInterrupt:
+		pass
+
+
+if __name__ == '__main__':
+	main()
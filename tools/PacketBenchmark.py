@@ -0,0 +1,167 @@
+# coding: utf8
+"""
+Micro-benchmark of the SARC packet reader against the old bytearray re-slicing reader
+
+Usage: python PacketBenchmark.py [repeat]
+"""
+import os
+import struct
+import sys
+import timeit
+import uuid
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.SARC.packet import Packet as SARCPacket
+
+
+class LegacyPacket:
+	"""
+	The reader part of utils/SARC/packet.py before it was switched to an offset cursor
+	"""
+	def __init__(self):
+		self.received = bytearray()
+
+	def read(self, length):
+		result = self.received[:length]
+		self.received = self.received[length:]
+		return result
+
+	def receive(self, data):
+		if not isinstance(data, bytearray):
+			data = bytearray(data)
+		self.received.extend(data)
+
+	def remaining(self):
+		return len(self.received)
+
+	def _unpack(self, format, data):
+		return struct.unpack('>' + format, bytes(data))[0]
+
+	def read_varint(self):
+		result = 0
+		for i in range(5):
+			part = ord(self.read(1))
+			result |= (part & 0x7F) << 7 * i
+			if not part & 0x80:
+				return result
+		raise IOError('Server sent a varint that was too big!')
+
+	def read_int(self):
+		return self._unpack('i', self.read(4))
+
+	def read_short(self):
+		return self._unpack('h', self.read(2))
+
+	def read_double(self):
+		return self._unpack('d', self.read(8))
+
+	def read_bool(self):
+		return self._unpack('?', self.read(1))
+
+	def read_byte(self):
+		return self._unpack('b', self.read(1))
+
+	def read_uuid(self):
+		return str(uuid.UUID(bytes=bytes(self.read(16))))
+
+
+def make_chunk_packet():
+	# Chunk Data alike: x, z, full chunk, bit mask, a big section data array and some block entities
+	packet = SARCPacket()
+	packet.write_varint(0x22)
+	packet.write_int(12)
+	packet.write_int(-34)
+	packet.write_bool(True)
+	packet.write_varint(0xFFFF)
+	data = os.urandom(96 * 1024)
+	packet.write_varint(len(data))
+	packet.write(data)
+	packet.write_varint(64)
+	for i in range(64):
+		packet.write_int(i)
+		packet.write_short(i)
+		packet.write_varint(i)
+	return bytes(packet.flush())
+
+
+def make_entity_packet():
+	# Spawn Living Entity alike
+	packet = SARCPacket()
+	packet.write_varint(0x02)
+	packet.write_varint(123456)
+	packet.write_uuid(str(uuid.uuid4()))
+	packet.write_varint(97)
+	for i in range(3):
+		packet.write_double(i * 1.5)
+	for i in range(3):
+		packet.write_byte(i)
+	for i in range(3):
+		packet.write_short(i)
+	return bytes(packet.flush())
+
+
+def make_destroy_entities_packet(count=500):
+	packet = SARCPacket()
+	packet.write_varint(0x36)
+	packet.write_varint(count)
+	for i in range(count):
+		packet.write_varint(100000 + i)
+	return bytes(packet.flush())
+
+
+def read_chunk(cls, data):
+	packet = cls()
+	packet.receive(data)
+	packet.read_varint()
+	packet.read_int()
+	packet.read_int()
+	packet.read_bool()
+	packet.read_varint()
+	packet.read(packet.read_varint())
+	for i in range(packet.read_varint()):
+		packet.read_int()
+		packet.read_short()
+		packet.read_varint()
+
+
+def read_entity(cls, data):
+	packet = cls()
+	packet.receive(data)
+	packet.read_varint()
+	packet.read_varint()
+	packet.read_uuid()
+	packet.read_varint()
+	for i in range(3):
+		packet.read_double()
+	for i in range(3):
+		packet.read_byte()
+	for i in range(3):
+		packet.read_short()
+
+
+def read_destroy_entities(cls, data):
+	packet = cls()
+	packet.receive(data)
+	packet.read_varint()
+	for i in range(packet.read_varint()):
+		packet.read_varint()
+
+
+def main():
+	repeat = int(sys.argv[1]) if len(sys.argv) >= 2 else 200
+	cases = [
+		('Chunk Data ({}KB)', make_chunk_packet(), read_chunk),
+		('Spawn Living Entity ({}B)', make_entity_packet(), read_entity),
+		('Destroy Entities ({}B)', make_destroy_entities_packet(), read_destroy_entities),
+	]
+	print('{:<32}{:>14}{:>14}{:>10}'.format('Packet', 'Legacy (us)', 'Cursor (us)', 'Speedup'))
+	for name, data, reader in cases:
+		name = name.format(len(data) // 1024 if 'KB' in name else len(data))
+		number = repeat if len(data) > 1024 else repeat * 50
+		legacy = timeit.timeit(lambda: reader(LegacyPacket, data), number=number) / number * 1e6
+		cursor = timeit.timeit(lambda: reader(SARCPacket, data), number=number) / number * 1e6
+		print('{:<32}{:>14.2f}{:>14.2f}{:>9.1f}x'.format(name, legacy, cursor, legacy / cursor))
+
+
+if __name__ == '__main__':
+	main()
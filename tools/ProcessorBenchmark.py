@@ -0,0 +1,77 @@
+# coding: utf8
+"""
+Replays the packets of a recording through PacketProcessor and reports its throughput
+
+Usage: python ProcessorBenchmark.py <file.mcpr | recording.tmcpr> [protocol] [config.json]
+The protocol version is read from the .mcpr file if not given
+"""
+import json
+import os
+import sys
+import time
+import zipfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import constant, protocol
+from utils.config import Config
+from utils.logger import Logger
+from utils.packet_processor import PacketProcessor
+from utils.replay_file import read_records
+
+
+class DummyRecorder:
+	"""
+	Provides what PacketProcessor needs from a Recorder
+	"""
+	def __init__(self, config, protocol_version):
+		self.config = config
+		self.logger = Logger(name='Benchmark', file_name=os.devnull)
+		self.mc_protocol = protocol_version
+		self.mc_version = constant.Map_ProtocolToVersion[protocol_version]
+		self.protocol_table = protocol.get_table(protocol_version)
+		self.player_uuids = set()
+		self.pos = None
+
+	def updatePlayerMovement(self, t=None):
+		pass
+
+
+def read_packets(file_name):
+	if zipfile.is_zipfile(file_name):
+		with zipfile.ZipFile(file_name) as zipf:
+			protocol_version = json.loads(zipf.read('metaData.json'))['protocol']
+			data = zipf.read('recording.tmcpr')
+	else:
+		protocol_version = None
+		with open(file_name, 'rb') as f:
+			data = f.read()
+	return protocol_version, [packet for time_stamp, packet in read_records(data)]
+
+
+def main():
+	if len(sys.argv) < 2:
+		print(__doc__.strip())
+		return
+	protocol_version, packets = read_packets(sys.argv[1])
+	if len(sys.argv) >= 3:
+		protocol_version = int(sys.argv[2])
+	if protocol_version is None:
+		print('Protocol version unknown, please specify it')
+		return
+	config = Config(sys.argv[3] if len(sys.argv) >= 4 else os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config.json'))
+	processor = PacketProcessor(DummyRecorder(config, protocol_version), constant.Map_ProtocolToVersion[protocol_version], protocol.get_table(protocol_version))
+	print('Replaying {} packets of protocol {}'.format(len(packets), protocol_version))
+
+	recorded = 0
+	start = time.time()
+	for packet in packets:
+		if processor.process(packet) is not None:
+			recorded += 1
+	cost = time.time() - start
+	print('Processed {} packets in {:.3f}s, {:.0f} packets/s, {} packets kept'.format(
+		len(packets), cost, len(packets) / cost if cost > 0 else float('inf'), recorded
+	))
+
+
+if __name__ == '__main__':
+	main()
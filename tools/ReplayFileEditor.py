@@ -1,531 +1,44 @@
 # coding: utf8
-import gc
-import json
+"""
+A script to fix some bugs in recording files recorded by PCRC in old versions, or to strip packets off a recording
+The chosen operations are applied in a single pass over the recording
+
+Usage: python ReplayFileEditor.py <file.mcpr> [<stage>[:<arguments>] ...] [-o <output.mcpr> | --in-place]
+The stages are chosen interactively if none is given. Arguments of a stage are separated by ",", e.g.
+  python ReplayFileEditor.py My_Recording.mcpr daytime:4000 clear_weather fix_time_stamp:10000 remove_packet:"Entity Velocity"
+The output file is "FIX_<file.mcpr>" by default. With --in-place the input file is replaced by the edited one
+The recording is never extracted, only the space for the output file is needed on the disk
+"""
+import collections
 import os
-import shutil
-import struct
 import sys
-import zipfile
-import collections
-
-from utils import constant
-
-sys.path.append("../")
-from utils.SARC.packet import Packet as SARCPacket
-import utils.utils as utils
-
-
-class Data:
-	def __init__(self, time_stamp, packet_length, packet):
-		self.time_stamp = time_stamp
-		self.packet_length = packet_length
-		self.packet = packet
-
 
-WorkingDirectory = '__RFETMP__/'
-TriggerAddingDeltaThreshold = 10000
-protocol_map_name = {}  # id -> name
-protocol_map_id = {}  # name -> id
-target_tmcpr = ''
-temp_tmcpr = ''
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import replay_editor
+from utils.replay_editor import ReplayEditor
 
 
-def prepare():
-	global protocol_map_name, protocol_map_id, protocol_version, input_file_name
-	input_file_name = None
-	if len(sys.argv) >= 2:
-		input_file_name = sys.argv[1]
-	while True:
-		if input_file_name is None:
-			input_file_name = input('Input .mcpr file name (Example: "My_Recording.mcpr"): ')
-		if os.path.isfile(input_file_name):
-			break
-		else:
-			print('File "{}" not found'.format(input_file_name))
-		input_file_name = None
-	print('File Name = {}'.format(input_file_name))
-	print('Cleaning')
-	if os.path.isdir(WorkingDirectory):
-		shutil.rmtree(WorkingDirectory)
-	os.mkdir(WorkingDirectory)
-	print('Extracting')
-	zipf = zipfile.ZipFile(input_file_name)
-	zipf.extractall(WorkingDirectory)
-	zipf.close()
-	print('Reading protocol')
-	with open(WorkingDirectory + 'metaData.json') as f:
-		protocol_version = json.load(f)["protocol"]
-	print('Protocol version =', protocol_version)
-	with open('../protocol.json', 'r') as f:
-		protocol_map_name = {}
-		protocol_map_id = {}
-		for item in json.load(f)[str(protocol_version)]['Clientbound'].items():
-			id = int(item[0])
-			name = item[1]
-			protocol_map_name[id] = name
-			protocol_map_id[name] = id
-
-	global original_tmcpr, temp_tmcpr
-	original_tmcpr = WorkingDirectory + 'recording.tmcpr'
-	temp_tmcpr = WorkingDirectory + 'recording.tmcpr.editing'
-
-
-def read_int(f):
-	data = f.read(4)
-	if len(data) < 4:
-		return None
-	return struct.unpack('>i', data)[0]
-
-
-def write_int(f, data):
-	f.write(struct.pack('>i', data))
-
-
-def update_tmcpr_on_editing_finished():
-	global original_tmcpr, temp_tmcpr
-	os.remove(original_tmcpr)
-	shutil.move(temp_tmcpr, original_tmcpr)
-
-
-def save_file():
-	print('Saving File')
-	with open(WorkingDirectory + 'recording.tmcpr.crc32', 'w') as f:
-		f.write(str(utils.crc32_file(WorkingDirectory + 'recording.tmcpr')))
-	print('Update recording.tmcpr.crc32 finished')
-	global input_file_name
-	output_file_name = 'FIX_' + input_file_name
+def decide_output_file_name(input_file_name):
+	directory, file_name = os.path.split(input_file_name)
+	output_file_name = os.path.join(directory, 'FIX_' + file_name)
 	counter = 2
 	while os.path.isfile(output_file_name):
-		output_file_name = 'FIX{}_{}'.format(counter, input_file_name)
+		output_file_name = os.path.join(directory, 'FIX{}_{}'.format(counter, file_name))
 		counter += 1
-	print('Zipping new .mcpr file to {}'.format(output_file_name))
-	zipf = zipfile.ZipFile(output_file_name, 'w', zipfile.ZIP_DEFLATED)
-	for file in os.listdir(WorkingDirectory):
-		zipf.write(WorkingDirectory + file, arcname=file)
-	zipf.close()
-
-
-def set_day_time(day_time):
-	global protocol_map_id
-	packet = SARCPacket()
-	packet.write_varint(protocol_map_id['Time Update'])
-	packet.write_long(0)  # World Age
-	packet.write_long(-day_time)  # If negative sun will stop moving at the Math.abs of the time
-	success = False
-
-	global original_tmcpr, temp_tmcpr
-	with open(original_tmcpr, 'rb') as of:
-		with open(temp_tmcpr, 'wb') as tf:
-			while True:
-				time_stamp = read_int(of)
-				if time_stamp is None:
-					break
-				packet_length = read_int(of)
-				packet_data = of.read(packet_length)
-
-				if packet_length == 0:
-					packet_data = packet.flush()
-					success = True
-
-				write_int(tf, time_stamp)
-				write_int(tf, packet_length)
-				tf.write(packet_data)
-
-	update_tmcpr_on_editing_finished()
-	print('Set daytime operation finished, success = {}'.format(success))
-
-
-def clear_weather():
-	global protocol_map_id
-	counter = 0
-	global original_tmcpr, temp_tmcpr
-	with open(original_tmcpr, 'rb') as of:
-		with open(temp_tmcpr, 'wb') as tf:
-			while True:
-				time_stamp = read_int(of)
-				if time_stamp is None:
-					break
-				packet_length = read_int(of)
-				packet_data = of.read(packet_length)
-				packet = SARCPacket()
-				packet.receive(packet_data)
-				packet_id = packet.read_varint()
-
-				recorded = True
-				if packet_id == protocol_map_id['Change Game State']:
-					reason = packet.read_ubyte()
-					if reason in [1, 2, 7, 8]:
-						recorded = False
-				if recorded:
-					write_int(tf, time_stamp)
-					write_int(tf, packet_length)
-					tf.write(packet_data)
-				else:
-					counter += 1
-
-	update_tmcpr_on_editing_finished()
-	print('Clear weather operation finished, deleted {} packets'.format(counter))
-
-
-def fix_time_stamp():
-	global original_tmcpr, temp_tmcpr
-	print('Scanning time stamp')
-	last_time = None
-	a = set()
-	with open(original_tmcpr, 'rb') as of:
-		while True:
-			time_stamp = read_int(of)
-			if time_stamp is None:
-				break
-			packet_length = read_int(of)
-			packet_data = of.read(packet_length)
-			if last_time is not None:
-				a.add(time_stamp - last_time)
-			last_time = time_stamp
-	last_timestamp_old = last_time
-	b = list(a)
-	b.sort()
-	print('deltas between packets:', b)
-	s = input(
-		'Input threshold, there should be a big gap near the input value. Input nothing to use default {}\n'.format(
-			TriggerAddingDeltaThreshold))
-	threshold = int(s) if s != '' else TriggerAddingDeltaThreshold
-	print('Fixing time stamp')
-	last_time = None
-	delta = 0
-	with open(original_tmcpr, 'rb') as of:
-		with open(temp_tmcpr, 'wb') as tf:
-			i = 0
-			while True:
-				time_stamp = read_int(of)
-				if time_stamp is None:
-					break
-				packet_length = read_int(of)
-				packet_data = of.read(packet_length)
-				if last_time is not None:
-					d = time_stamp - last_time
-					if d >= threshold:
-						delta += d
-
-				write_int(tf, time_stamp - delta)
-				write_int(tf, packet_length)
-				tf.write(packet_data)
-
-				last_time = time_stamp
-				i += 1
-				if i % 100000 == 0:
-					print(f'{os.path.getsize(original_tmcpr)}/{os.path.getsize(temp_tmcpr)}')
-	last_timestamp_new = last_time
-
-	update_tmcpr_on_editing_finished()
-	print('Last time stamp: {} -> {}'.format(last_timestamp_old, last_timestamp_new))
-	print('Fixed')
-
-
-def fix_missing_player():
-	print('Fixing missing player (ignore all remove player action in PlayerInfo packet)')
-
-	global original_tmcpr, temp_tmcpr, protocol_map_id
-	with open(original_tmcpr, 'rb') as of:
-		with open(temp_tmcpr, 'wb') as tf:
-			while True:
-				time_stamp = read_int(of)
-				if time_stamp is None:
-					break
-				packet_length = read_int(of)
-				packet_data = of.read(packet_length)
-
-				packet = SARCPacket()
-				packet.receive(packet_data)
-				packet_id = packet.read_varint()
-				bad = False
-				if packet_id == protocol_map_id['Player Info']:
-					action = packet.read_varint()
-					if action == 4:
-						bad = True
-				if not bad:
-					write_int(tf, time_stamp)
-					write_int(tf, packet_length)
-					tf.write(packet_data)
-	update_tmcpr_on_editing_finished()
-	print('Fixed')
-
-
-def yeet_entity(bad_entity_id):
-	global original_tmcpr, temp_tmcpr, protocol_map_id
-	print(f'Removing all packets caused by id {bad_entity_id}')
-	counter = 0
-	blocked_entity_ids = []
-
-	with open(original_tmcpr, 'rb') as of:
-		with open(temp_tmcpr, 'wb') as tf:
-			num = 0
-			while True:
-				time_stamp = read_int(of)
-				if time_stamp is None:
-					break
-				packet_length = read_int(of)
-				packet_data = of.read(packet_length)
-
-				packet = SARCPacket()
-				packet.receive(packet_data)
-				packet_id = packet.read_varint()
-				packet_name = protocol_map_name[packet_id]
-
-				bad = False
-				if packet_name == 'Spawn Mob':
-					entity_id = packet.read_varint()
-					entity_uuid = packet.read_uuid()
-					entity_type = packet.read_byte()
-					if entity_type == bad_entity_id:
-						blocked_entity_ids.append(entity_id)
-						bad = True
-
-				elif packet_name == 'Destroy Entities':
-					count = packet.read_varint()
-					for i in range(count):
-						entity_id = packet.read_varint()
-						if entity_id in blocked_entity_ids:
-							blocked_entity_ids.remove(entity_id)
-						bad = True
-
-				elif packet_name in constant.ENTITY_PACKETS:
-					entity_id = packet.read_varint()
-					if entity_id in blocked_entity_ids:
-						bad = True
+	return output_file_name
 
-				if not bad:
-					write_int(tf, time_stamp)
-					write_int(tf, packet_length)
-					tf.write(packet_data)
-				else:
-					counter += 1
-				num += 1
-				if num % 100000 == 0:
-					print(f'packet: {num - counter}/{num}, file size: {round(100.0 * os.path.getsize(temp_tmcpr)/os.path.getsize(original_tmcpr), 2)}%')
-	update_tmcpr_on_editing_finished()
-	print('Removed {} packets'.format(counter))
 
+def print_stages():
+	print('Stages:')
+	for name, stage in replay_editor.Stages.items():
+		print('  {}: {}'.format(name, stage.description))
 
-def yeet_all_entity_except_player():
-	global original_tmcpr, temp_tmcpr, protocol_map_id
-	print(f'Removing all non-player entity packets')
-	counter = 0
-	player_ids = []
-
-	with open(original_tmcpr, 'rb') as of:
-		with open(temp_tmcpr, 'wb') as tf:
-			num = 0
-			processed = 0
-			while True:
-				time_stamp = read_int(of)
-				if time_stamp is None:
-					break
-				packet_length = read_int(of)
-				packet_data = of.read(packet_length)
-
-				packet = SARCPacket()
-				packet.receive(packet_data)
-				packet_id = packet.read_varint()
-				packet_name = protocol_map_name[packet_id]
-
-				bad = False
-
-				if packet_name == 'Spawn Player':
-					entity_id = packet.read_varint()
-					uuid = packet.read_uuid()
-					if entity_id not in player_ids:
-						player_ids.append(entity_id)
-
-				if packet_name == 'Spawn Mob':
-					bad = True
-
-				elif packet_name == 'Destroy Entities':
-					count = packet.read_varint()
-					has_player = False
-					for i in range(count):
-						entity_id = packet.read_varint()
-						if entity_id in player_ids:
-							player_ids.remove(entity_id)
-							has_player = True
-					if not has_player:
-						bad = True
-
-				elif packet_name in constant.ENTITY_PACKETS:
-					entity_id = packet.read_varint()
-					if entity_id not in player_ids:
-						bad = True
-
-				if not bad:
-					write_int(tf, time_stamp)
-					write_int(tf, packet_length)
-					tf.write(packet_data)
-				else:
-					counter += 1
-				num += 1
-				processed += 8 + packet_length
-				if num % 100000 == 0:
-					print(f'packet: {num - counter}/{num}, file size: {round(100.0 * processed/os.path.getsize(original_tmcpr), 2)}%')
-	update_tmcpr_on_editing_finished()
-	print('Removed {} packets'.format(counter))
-
-
-def yeet_packet(bad_packet_name):
-	global original_tmcpr, temp_tmcpr, protocol_map_id
-	print(f'Removing all packet named {bad_packet_name}')
-	counter = 0
-
-	with open(original_tmcpr, 'rb') as of:
-		with open(temp_tmcpr, 'wb') as tf:
-			num = 0
-			processed = 0
-			while True:
-				time_stamp = read_int(of)
-				if time_stamp is None:
-					break
-				packet_length = read_int(of)
-				packet_data = of.read(packet_length)
-
-				packet = SARCPacket()
-				packet.receive(packet_data)
-				packet_id = packet.read_varint()
-				packet_name = protocol_map_name[packet_id]
-
-				if packet_name != bad_packet_name:
-					write_int(tf, time_stamp)
-					write_int(tf, packet_length)
-					tf.write(packet_data)
-				else:
-					counter += 1
-				num += 1
-				processed += 8 + packet_length
-				if num % 100000 == 0:
-					print(f'packet: {num - counter}/{num}, file size: {round(100.0 * processed/os.path.getsize(original_tmcpr), 2)}%')
-	update_tmcpr_on_editing_finished()
-	print('Removed {} packets'.format(counter))
-
-
-def analyze():
-	print('What'' type of packet takes the most space')
-	counter = {}
-	global original_tmcpr, protocol_map_id, protocol_map_name
-	entity_type_map = {}
-	player_ids = []
-	with open('analyze.txt', 'w') as af:
-		with open(original_tmcpr, 'rb') as of:
-			all = 0
-			num = 0
-			while True:
-				time_stamp = read_int(of)
-				if time_stamp is None:
-					break
-				packet_length = read_int(of)
-				packet_data = of.read(packet_length)
-				packet = SARCPacket()
-				packet.receive(packet_data)
-				packet_id = packet.read_varint()
-				packet_name = protocol_map_name[packet_id]
-				af.write('#{}\t{}\t@ {}\n'.format(num, packet_name, time_stamp))
-				entity_type = None
-
-				if packet_name == 'Spawn Player':
-					entity_id = packet.read_varint()
-					uuid = packet.read_uuid()
-					if entity_id not in player_ids:
-						player_ids.append(entity_id)
-				elif packet_name == 'Spawn Mob' or packet_name == 'Spawn Object':
-					entity_id = packet.read_varint()
-					entity_uuid = packet.read_uuid()
-					entity_type = packet.read_byte()
-					entity_type_map[entity_id] = ('Mob' if packet_name == 'Spawn Mob' else 'Obj') + str(entity_type)
-					entity_type = entity_type_map[entity_id]
-				elif packet_name == 'Destroy Entities':
-					count = packet.read_varint()
-					for i in range(count):
-						entity_id = packet.read_varint()
-						if entity_id in player_ids:
-							player_ids.remove(entity_id)
-
-				elif packet_name in constant.ENTITY_PACKETS:
-					entity_id = packet.read_varint()
-					entity_type = entity_type_map.get(entity_id, '?')
-					if entity_id in player_ids:
-						entity_type = 'Player'
-
-				if entity_type is not None:
-					packet_name += ' (' + entity_type + ')'
-
-				if packet_name not in counter:
-					counter[packet_name] = 0
-				counter[packet_name] += 8 + packet_length
-				all += 8 + packet_length
-				num += 1
-				if num % 100000 == 0:
-					print(f'scanned: {round(100.0 * all/os.path.getsize(original_tmcpr), 2)}%')
-
-
-	arr = list(counter.items())
-	arr.sort(key=lambda x: x[1], reverse=True)
-	for a in arr:
-		print(f'{a[0]}: {round(a[1] / constant.BytePerMB, 5)}MB')
-
-	print('Done')
-
-
-def fix_missing_time_update_after_dim_changed():
-	global original_tmcpr, temp_tmcpr, protocol_map_id
-	print(f'fix missing time update after dim changed')
-	counter = 0
-	time_update_packet = None
-
-	with open(original_tmcpr, 'rb') as of:
-		with open(temp_tmcpr, 'wb') as tf:
-			num = 0
-			processed = 0
-			while True:
-				time_stamp = read_int(of)
-				if time_stamp is None:
-					break
-				packet_length = read_int(of)
-				packet_data = of.read(packet_length)
-				write_int(tf, time_stamp)
-				write_int(tf, packet_length)
-				tf.write(packet_data)
-
-				packet = SARCPacket()
-				packet.receive(packet_data)
-				packet_id = packet.read_varint()
-				packet_name = protocol_map_name[packet_id]
-
-				if packet_name == 'Time Update':
-					time_update_packet = bytes()
-					time_update_packet += struct.pack('>i', time_stamp)
-					time_update_packet += struct.pack('>i', packet_length)
-					time_update_packet += packet_data
-				elif packet_name == 'Respawn' and time_update_packet is not None:
-					tf.write(time_update_packet)
-					counter += 1
-
-				num += 1
-				processed += 8 + packet_length
-				if num % 100000 == 0:
-					print(f'processed file size: {round(100.0 * processed/os.path.getsize(original_tmcpr), 2)}%')
-	update_tmcpr_on_editing_finished()
-	print('Wrote {} time update packets after Respawn packet'.format(counter))
-
-
-print('A script to fix some bugs in recording file recorded by PCRC in old versions')
-print('It can be optimize a lot but I\'m too lazy xd. Whatever it works, but it may consume a lots of RAM')
-print('Only works for 1.14.4 recording file')
-
-prepare()
-print('Init finish')
 
 CommandListMessageData = collections.namedtuple('CommandListMessageData', ['id', 'name', 'detail'])
 CommandList = [
 	CommandListMessageData(
 		0, 'Save and Exit',
-		'Exit the tool'
+		'Apply the chosen operations and exit the tool'
 	),
 	CommandListMessageData(
 		1, 'Time and weather fix',
@@ -557,44 +70,101 @@ CommandList = [
 	),
 ]
 CommandListMessage = 'Command List:\n' + '\n'.join(['{}. {}'.format(cmd.id, cmd.name) for cmd in CommandList])
-while True:
-	print()
-	print(CommandListMessage)
-	cmd = input('> ')
-	try:
-		msg = CommandList[int(cmd)].detail
-	except:
-		pass
-	else:
-		print('Command effect:', msg)
-	if cmd == '0':
-		save_file()
-		shutil.rmtree(WorkingDirectory)
-		break
-	elif cmd == '1':
-		do_set_daytime = input('Set daytime? (0: no; 1: yes) = ') == '1'
-		if do_set_daytime:
-			day_time = int(input('Daytime = '))
-		do_clear_weather = input('Clear weather? (0: no; 1: yes) = ') == '1'
-		if do_set_daytime:
-			set_day_time(day_time)
-		if do_clear_weather:
-			clear_weather()
-	elif cmd == '2':
-		fix_time_stamp()
-	elif cmd == '3':
-		fix_missing_player()
-	elif cmd == '4':
-		analyze()
-	elif cmd == '5':
-		yeet_entity(56)  # PigZombie / minecraft:zombie_pigman
-	elif cmd == '6':
-		yeet_all_entity_except_player()
-	elif cmd == '7':
-		packet_name = input('Input packet name, u can find the name in https://wiki.vg/\nname = ')
-		yeet_packet(packet_name)
-	elif cmd == '8':
-		fix_missing_time_update_after_dim_changed()
-	else:
-		print('Unknown command')
-input('press enter to exit')
+
+
+# Returns the stages chosen, empty if none
+def choose_stages():
+	stages = []
+	while True:
+		print()
+		print(CommandListMessage)
+		if len(stages) > 0:
+			print('Chosen: {}'.format(', '.join(stage.name for stage in stages)))
+		cmd = input('> ')
+		try:
+			msg = CommandList[int(cmd)].detail
+		except:
+			pass
+		else:
+			print('Command effect:', msg)
+		if cmd == '0':
+			return stages
+		elif cmd == '1':
+			if input('Set daytime? (0: no; 1: yes) = ') == '1':
+				stages.append(replay_editor.SetDayTime(int(input('Daytime = '))))
+			if input('Clear weather? (0: no; 1: yes) = ') == '1':
+				stages.append(replay_editor.ClearWeather())
+		elif cmd == '2':
+			s = input('Input threshold, time gaps not less than it will be removed. Input nothing to use default {}\n'.format(
+				replay_editor.FixTimeStamp.DefaultThreshold))
+			stages.append(replay_editor.FixTimeStamp(int(s)) if s != '' else replay_editor.FixTimeStamp())
+		elif cmd == '3':
+			stages.append(replay_editor.KeepPlayers())
+		elif cmd == '4':
+			stages.append(replay_editor.Analyze('analyze.txt'))
+		elif cmd == '5':
+			stages.append(replay_editor.RemoveEntityType(56))  # PigZombie / minecraft:zombie_pigman
+		elif cmd == '6':
+			stages.append(replay_editor.RemoveNonPlayerEntities())
+		elif cmd == '7':
+			packet_name = input('Input packet name, u can find the name in https://wiki.vg/\nname = ')
+			stages.append(replay_editor.RemovePacket(packet_name))
+		elif cmd == '8':
+			stages.append(replay_editor.TimeUpdateAfterRespawn())
+		else:
+			print('Unknown command')
+
+
+def main():
+	args = sys.argv[1:]
+	if len(args) >= 1 and args[0] in ('-h', '--help'):
+		print(__doc__.strip())
+		print_stages()
+		return
+	interactive = len(args) <= 1
+	input_file_name = args[0] if len(args) >= 1 else None
+	while True:
+		if input_file_name is None:
+			input_file_name = input('Input .mcpr file name (Example: "My_Recording.mcpr"): ')
+		if os.path.isfile(input_file_name):
+			break
+		print('File "{}" not found'.format(input_file_name))
+		if not interactive:
+			return
+		input_file_name = None
+	output_file_name = None
+	stages = []
+	i = 1
+	while i < len(args):
+		if args[i] == '-o' and i + 1 < len(args):
+			output_file_name = args[i + 1]
+			i += 2
+			continue
+		if args[i] == '--in-place':
+			output_file_name = input_file_name
+			i += 1
+			continue
+		try:
+			stages.append(replay_editor.parse_stage(args[i]))
+		except (ValueError, TypeError) as e:
+			print('Bad stage "{}": {}'.format(args[i], e))
+			print_stages()
+			return
+		i += 1
+	if len(stages) == 0:
+		stages = choose_stages()
+		if len(stages) == 0:
+			print('Nothing to do')
+			return
+	if output_file_name is None:
+		output_file_name = decide_output_file_name(input_file_name)
+
+	print('Applying {} to "{}", output file: "{}"'.format(', '.join(stage.name for stage in stages), input_file_name, output_file_name))
+	ReplayEditor(stages).edit(input_file_name, output_file_name)
+	print('Done')
+	if interactive:
+		input('press enter to exit')
+
+
+if __name__ == '__main__':
+	main()
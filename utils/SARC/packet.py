@@ -2,14 +2,54 @@ import uuid
 import struct
 
 
+def read_varint(data, offset=0):
+    """Reads a varint from a bytes-like object without copying it
+
+    Returns the value and the offset right after the varint
+    """
+    result = 0
+    for i in range(5):
+        part = data[offset]
+        offset += 1
+        result |= (part & 0x7F) << 7 * i
+        if not part & 0x80:
+            return result, offset
+    raise IOError('Server sent a varint that was too big!')
+
+
+_Short = struct.Struct('>h')
+_UShort = struct.Struct('>H')
+_Int = struct.Struct('>i')
+_UInt = struct.Struct('>I')
+_Long = struct.Struct('>q')
+_ULong = struct.Struct('>Q')
+_Float = struct.Struct('>f')
+_Double = struct.Struct('>d')
+_Bool = struct.Struct('>?')
+_Byte = struct.Struct('>b')
+_UByte = struct.Struct('>B')
+
+
 class Packet:
+    """Packet reader / writer
+
+    Received data is kept as a memoryview and read with an offset cursor,
+    so reading a field never copies or shifts the remaining data. Values
+    returned by read() are memoryview slices of the received data
+    """
     def __init__(self):
         self.sent = bytearray()
-        self.received = bytearray()
+        self.received = memoryview(b'')
+        self.offset = 0
 
     def read(self, length):
-        result = self.received[:length]
-        self.received = self.received[length:]
+        start = self.offset
+        self.offset = min(start + length, len(self.received))
+        return self.received[start:self.offset]
+
+    def _read_struct(self, st):
+        result = st.unpack_from(self.received, self.offset)[0]
+        self.offset += st.size
         return result
 
     def write(self, data):
@@ -22,12 +62,14 @@ class Packet:
         self.sent.extend(data)
 
     def receive(self, data):
-        if not isinstance(data, bytearray):
-            data = bytearray(data)
-        self.received.extend(data)
+        if self.remaining() == 0:
+            self.received = memoryview(data)
+        else:
+            self.received = memoryview(bytes(self.received[self.offset:]) + bytes(data))
+        self.offset = 0
 
     def remaining(self):
-        return len(self.received)
+        return len(self.received) - self.offset
 
     def flush(self):
         result = self.sent
@@ -41,111 +83,109 @@ class Packet:
         return struct.pack('>' + format, data)
 
     def read_varint(self):
-        result = 0
-        for i in range(5):
-            part = ord(self.read(1))
-            result |= (part & 0x7F) << 7 * i
-            if not part & 0x80:
-                return result
-        raise IOError('Server sent a varint that was too big!')
+        result, self.offset = read_varint(self.received, self.offset)
+        return result
 
     def write_varint(self, value):
         remaining = value
         for i in range(5):
             if remaining & ~0x7F == 0:
-                self.write(struct.pack('!B', remaining))
+                self.sent.append(remaining)
                 return
-            self.write(struct.pack('!B', remaining & 0x7F | 0x80))
+            self.sent.append(remaining & 0x7F | 0x80)
             remaining >>= 7
         raise ValueError('The value' + str(value) + 'is too big to send in a varint')
 
     def read_utf(self):
         length = self.read_varint()
-        return self.read(length).decode('utf8')
+        return str(self.read(length), 'utf8')
 
     def write_utf(self, value):
+        value = value.encode('utf8')
         self.write_varint(len(value))
-        self.write(bytearray(value, 'utf8'))
+        self.sent += value
 
     def read_ascii(self):
-        result = bytearray()
-        while len(result) == 0 or result[-1] != 0:
-            result.extend(self.read(1))
-        return result[:-1].decode('ISO-8859-1')
+        end = self.offset
+        while self.received[end] != 0:
+            end += 1
+        result = str(self.received[self.offset:end], 'ISO-8859-1')
+        self.offset = end + 1
+        return result
 
     def write_ascii(self, value):
         self.write(bytearray(value, 'ISO-8859-1'))
         self.write(bytearray.fromhex('00'))
 
     def read_short(self):
-        return self._unpack('h', self.read(2))
+        return self._read_struct(_Short)
 
     def write_short(self, value):
-        self.write(self._pack('h', value))
+        self.sent += _Short.pack(value)
 
     def read_ushort(self):
-        return self._unpack('H', self.read(2))
+        return self._read_struct(_UShort)
 
     def write_ushort(self, value):
-        self.write(self._pack('H', value))
+        self.sent += _UShort.pack(value)
 
     def read_int(self):
-        return self._unpack('i', self.read(4))
+        return self._read_struct(_Int)
 
     def write_int(self, value):
-        self.write(self._pack('i', value))
+        self.sent += _Int.pack(value)
 
     def read_uint(self):
-        return self._unpack('I', self.read(4))
+        return self._read_struct(_UInt)
 
     def write_uint(self, value):
-        self.write(self._pack('I', value))
+        self.sent += _UInt.pack(value)
 
     def read_long(self):
-        return self._unpack('q', self.read(8))
+        return self._read_struct(_Long)
 
     def write_long(self, value):
-        self.write(self._pack('q', value))
+        self.sent += _Long.pack(value)
 
     def read_ulong(self):
-        return self._unpack('Q', self.read(8))
+        return self._read_struct(_ULong)
 
     def write_ulong(self, value):
-        self.write(self._pack('Q', value))
+        self.sent += _ULong.pack(value)
 
     def read_bytearray_as_str(self):
         length = self.read_varint()
-        return self._unpack(str(length) + 's', self.read(length))
+        return bytes(self.read(length))
 
     def read_float(self):
-        return self._unpack('f', self.read(4))
+        return self._read_struct(_Float)
 
     def write_float(self, value):
-        self.write(self._pack('f', value))
+        self.sent += _Float.pack(value)
 
     def read_double(self):
-        return self._unpack('d', self.read(8))
+        return self._read_struct(_Double)
 
     def write_double(self, value):
-        self.write(self._pack('d', value))
+        self.sent += _Double.pack(value)
 
     def read_bool(self):
-        return self._unpack('?', self.read(1))
+        return self._read_struct(_Bool)
 
     def write_bool(self, value):
-        self.write(self._pack('?', value))
+        self.sent += _Bool.pack(value)
 
     def read_byte(self):
-        return self._unpack('b', self.read(1))
+        return self._read_struct(_Byte)
 
     def write_byte(self, value):
-        self.write(self._pack('b', value))
+        self.sent += _Byte.pack(value)
 
     def read_ubyte(self):
-        return self._unpack('B', self.read(1))
+        return self._read_struct(_UByte)
 
     def write_ubyte(self, value):
-        self.write(self._pack('B', value))
+        self.sent += _UByte.pack(value)
 
     def read_uuid(self):
         return str(uuid.UUID(bytes=bytes(self.read(16))))
@@ -0,0 +1,39 @@
+# coding: utf8
+
+import hashlib
+
+
+class ChunkDeduplicator:
+	"""
+	Remembers a hash of the content of every chunk the client has, so chunks re-sent with byte-identical content can be dropped
+	A chunk is forgotten as soon as anything else may change it, e.g. a block change or an unload, so its next Chunk Data is always kept
+	"""
+	def __init__(self):
+		self.hashes = {}  # (x, z) -> digest of the Chunk Data packet the client has
+		self.dropped_count = 0
+		self.saved_bytes = 0
+
+	def __len__(self):
+		return len(self.hashes)
+
+	# Returns if the client already has the chunk at pos with the content of data, so data doesn't need to be recorded
+	def check(self, pos, data):
+		digest = hashlib.blake2b(data, digest_size=16).digest()
+		if self.hashes.get(pos) == digest:
+			self.dropped_count += 1
+			self.saved_bytes += len(data)
+			return True
+		self.hashes[pos] = digest
+		return False
+
+	def forget(self, pos):
+		self.hashes.pop(pos, None)
+
+	# Forgets every chunk except the given ones
+	def retain(self, positions):
+		positions = set(positions)
+		for pos in [pos for pos in self.hashes if pos not in positions]:
+			del self.hashes[pos]
+
+	def clear(self):
+		self.hashes.clear()
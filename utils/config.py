@@ -15,10 +15,16 @@ DefaultOption = json.loads('''
 	"port": 20000,
 	"server_name": "SECRET SERVER",
 	"initial_version": "1.14.4",
+	"asyncio_networking": false,
 
 	"__3__": "-------- PCRC Control --------",
 	"file_size_limit_mb": 2048,
 	"file_buffer_size_mb": 8,
+	"file_writer_queue_size": 4,
+	"fsync_interval_second": 0,
+	"mcpr_compression_level": 6,
+	"seamless_rotation": false,
+	"world_cache_size_mb": 64,
 	"time_recorded_limit_hour": 12,
 	"delay_before_afk_second": 15,
 	"record_packets_when_afk": true,
@@ -28,6 +34,10 @@ DefaultOption = json.loads('''
 
 	"__4__": "-------- PCRC Features --------",
 	"minimal_packets": true,
+	"deduplicate_chunks": true,
+	"elide_redundant_updates": false,
+	"entity_movement_interval_ms": 0,
+	"interest_radius": 0,
 	"daytime": 4000,
 	"weather": false,
 	"with_player_only": true,
@@ -48,6 +58,10 @@ SettableOptions = [
 	'language',
 	'server_name',
 	'minimal_packets',
+	'deduplicate_chunks',
+	'elide_redundant_updates',
+	'entity_movement_interval_ms',
+	'interest_radius',
 	'daytime',
 	'weather',
 	'with_player_only',
@@ -56,6 +70,7 @@ SettableOptions = [
 	'remove_phantoms',
 	'file_size_limit_mb',
 	'time_recorded_limit_hour',
+	'seamless_rotation',
 ]
 
 
@@ -126,14 +141,24 @@ class Config:
 		messages.append(f"Server port = {self.get('port')}")
 		messages.append(f"Server name = {self.get('server_name')}")
 		messages.append(f"Initial Version = {self.get('initial_version')}")
+		messages.append(f"Asyncio networking = {self.get('asyncio_networking')}")
 		messages.append('-------- PCRC Control --------')
 		messages.append(f"File size limit = {self.get('file_size_limit_mb')}MB")
 		messages.append(f"File buffer size = {self.get('file_buffer_size_mb')}MB")
+		messages.append(f"File writer queue size = {self.get('file_writer_queue_size')}")
+		messages.append(f"Fsync interval = {self.get('fsync_interval_second')}s")
+		messages.append(f"Mcpr compression level = {self.get('mcpr_compression_level')}")
 		messages.append(f"Time recorded limit = {self.get('time_recorded_limit_hour')}h")
+		messages.append(f"Seamless rotation = {self.get('seamless_rotation')}")
+		messages.append(f"World cache size = {self.get('world_cache_size_mb')}MB")
 		messages.append(f"Auto relogin = {self.get('auto_relogin')}")
 		messages.append(f"Chat spam protect = {self.get('chat_spam_protect')}")
 		messages.append('-------- PCRC Features --------')
 		messages.append(f"Minimal packets mode = {self.get('minimal_packets')}")
+		messages.append(f"Deduplicate chunks = {self.get('deduplicate_chunks')}")
+		messages.append(f"Elide redundant updates = {self.get('elide_redundant_updates')}")
+		messages.append(f"Entity movement interval = {self.get('entity_movement_interval_ms')}ms")
+		messages.append(f"Interest radius = {self.get('interest_radius')}")
 		messages.append(f"Daytime set to = {self.get('daytime')}")
 		messages.append(f"Weather switch = {self.get('weather')}")
 		messages.append(f"Record with player only = {self.get('with_player_only')}")
@@ -11,8 +11,13 @@ MilliSecondPerHour = 60 * 60 * 1000
 BytePerKB = 1024
 BytePerMB = BytePerKB * 1024
 MinimumLegalFileSize = 10 * BytePerKB
+MaxTrackedEntities = 1000000  # in case the server leaks entity ids
 RecordingFilePath = 'temp_recording/'
 RecordingStorageFolder = 'PCRC_recordings/'
+RecordingIndexTimeInterval = 1000  # in millisecond, the longest time between 2 entries in the index of recording.tmcpr
+RecordingIndexByteInterval = BytePerMB  # the most bytes between 2 entries in the index of recording.tmcpr
+CheckpointInterval = 10 * 1000  # in millisecond, how often the meta data of the recording in progress is saved
+StaleRecordingTime = 5 * 60  # in second, a recording in RecordingFilePath without checkpoints for this long is considered interrupted
 ALLOWED_VERSIONS = ['1.12', '1.12.2', '1.14.4', '1.15.2', '1.16.1', '1.16.2', '1.16.3', '1.16.4', '1.17.1', '1.18', '1.18.1']
 Map_VersionToProtocol = pycraft.SUPPORTED_MINECRAFT_VERSIONS
 Map_ProtocolToVersion = {}
@@ -134,7 +139,6 @@ ENTITY_PACKETS = [
 	'Entity Relative Move',
 	'Entity Look And Relative Move',
 	'Entity Look',
-	'Entity Teleport'
 	'Entity Status',
 	'Remove Entity Effect',
 	'Entity Head Look',
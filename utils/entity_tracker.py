@@ -0,0 +1,96 @@
+# coding: utf8
+
+from . import utils
+
+
+class TrackedEntity:
+	__slots__ = ('entity_id', 'entity_type', 'spawn_time', 'blocked', 'is_player')
+
+	def __init__(self, entity_id, entity_type, spawn_time, blocked, is_player):
+		self.entity_id = entity_id
+		self.entity_type = entity_type  # None for players
+		self.spawn_time = spawn_time
+		self.blocked = blocked
+		self.is_player = is_player
+
+	def __repr__(self):
+		return 'TrackedEntity(id={}, type={}, spawn_time={}, blocked={}, is_player={})'.format(
+			self.entity_id, self.entity_type, self.spawn_time, self.blocked, self.is_player
+		)
+
+
+class EntityTracker:
+	"""
+	Keeps the entities spawned on the client with O(1) lookups by entity id
+	At most max_entities entities are kept, the oldest non-player entities are evicted first when the server leaks ids
+	"""
+	def __init__(self, max_entities):
+		self.max_entities = max_entities
+		self.entities = {}  # entity id -> TrackedEntity, in spawn order
+		self.blocked_ids = set()
+		self.player_ids = set()
+		self.evicted_count = 0
+
+	def __len__(self):
+		return len(self.entities)
+
+	def __contains__(self, entity_id):
+		return entity_id in self.entities
+
+	@property
+	def blocked_count(self):
+		return len(self.blocked_ids)
+
+	@property
+	def player_count(self):
+		return len(self.player_ids)
+
+	def get(self, entity_id):
+		return self.entities.get(entity_id)
+
+	def is_blocked(self, entity_id):
+		return entity_id in self.blocked_ids
+
+	def is_player(self, entity_id):
+		return entity_id in self.player_ids
+
+	def add(self, entity_id, entity_type=None, blocked=False, is_player=False, spawn_time=None):
+		if entity_id in self.entities:
+			self.remove(entity_id)
+		elif len(self.entities) >= self.max_entities:
+			self.evict()
+		if spawn_time is None:
+			spawn_time = utils.getMilliTime()
+		entity = TrackedEntity(entity_id, entity_type, spawn_time, blocked, is_player)
+		self.entities[entity_id] = entity
+		if blocked:
+			self.blocked_ids.add(entity_id)
+		if is_player:
+			self.player_ids.add(entity_id)
+		return entity
+
+	def remove(self, entity_id):
+		entity = self.entities.pop(entity_id, None)
+		if entity is not None:
+			self.blocked_ids.discard(entity_id)
+			self.player_ids.discard(entity_id)
+		return entity
+
+	def evict(self):
+		victim = None
+		for entity in self.entities.values():
+			if not entity.is_player:
+				victim = entity
+				break
+		if victim is None:
+			victim = next(iter(self.entities.values()))
+		self.remove(victim.entity_id)
+		self.evicted_count += 1
+
+	def clear(self):
+		self.entities.clear()
+		self.blocked_ids.clear()
+		self.player_ids.clear()
+
+	def format_counts(self):
+		return '{} (blocked {}, players {}, evicted {})'.format(len(self), self.blocked_count, self.player_count, self.evicted_count)
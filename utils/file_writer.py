@@ -0,0 +1,124 @@
+# coding: utf8
+
+import os
+import queue
+import threading
+import time
+import zlib
+
+
+# the file is replaced as a whole, so a crash never leaves a half written one
+def replace_file(file_name, data):
+	with open(file_name + '.tmp', 'wb') as f:
+		f.write(data)
+	os.replace(file_name + '.tmp', file_name)
+
+
+class FileWriter(threading.Thread):
+	"""
+	Appends buffers to a file from a background thread, so a slow disk doesn't block the caller
+	The file handle is kept open until close() is called
+	Index data can be given with each buffer, it's appended to the index file once the buffer is written
+	Small side files like the meta data can be replaced from the same thread, in order with the buffers
+	"""
+	def __init__(self, file_name, logger, queue_size=4, fsync_interval=0, index_file_name=None):
+		super().__init__(daemon=True)
+		self.file_name = file_name
+		self.logger = logger
+		self.fsync_interval = fsync_interval  # in second, fsync after writing at most once per interval, 0 to never fsync
+		self.queue = queue.Queue(maxsize=queue_size)
+		self.file = open(file_name, 'xb')  # never overwrite an existing recording
+		self.index_file = open(index_file_name, 'xb') if index_file_name is not None else None
+		self.lock = threading.Lock()
+		self.bytes_pending = 0
+		self.bytes_written = 0
+		self.crc32 = 0  # of the written content, so it doesn't need to be read again when packaging
+		self.last_write_latency = 0.0
+		self.max_write_latency = 0.0
+		self.last_fsync_time = time.time()
+		self.exception = None
+		self.closed = False
+
+	@property
+	def queue_depth(self):
+		return self.queue.qsize()
+
+	def __check(self):
+		if self.exception is not None:
+			raise IOError('Fail to write to "{}": {}'.format(self.file_name, self.exception))
+		if self.closed:
+			raise IOError('Writing to closed file writer of "{}"'.format(self.file_name))
+
+	# Blocks only when the queue is full, which means the disk can't keep up
+	def write(self, data, index_entry=None):
+		self.__check()
+		if len(data) == 0:
+			return
+		with self.lock:
+			self.bytes_pending += len(data)
+		self.queue.put((data, index_entry, None))
+
+	# Replaces the file file_name with data, see replace_file, after the buffers queued before are written
+	def replace_file(self, file_name, data):
+		self.__check()
+		self.queue.put((data, None, file_name))
+
+	# Waits until every queued buffer is written
+	def flush(self):
+		self.queue.join()
+
+	def close(self):
+		if self.closed:
+			return
+		self.closed = True
+		self.queue.put(None)
+		self.join()
+
+	def _fsync(self):
+		os.fsync(self.file.fileno())
+		if self.index_file is not None:
+			os.fsync(self.index_file.fileno())
+		self.last_fsync_time = time.time()
+
+	def run(self):
+		try:
+			while True:
+				item = self.queue.get()
+				try:
+					if item is None:
+						break
+					data, index_entry, file_name = item
+					if file_name is not None:
+						try:
+							replace_file(file_name, data)
+						except Exception as e:
+							self.logger.error('Fail to write "{}": {}'.format(file_name, e))
+						continue
+					start_time = time.time()
+					try:
+						self.file.write(data)
+						self.file.flush()
+						if self.index_file is not None and index_entry:
+							self.index_file.write(index_entry)
+							self.index_file.flush()
+						self.crc32 = zlib.crc32(data, self.crc32)
+						if self.fsync_interval > 0 and time.time() - self.last_fsync_time >= self.fsync_interval:
+							self._fsync()
+					except Exception as e:
+						self.exception = e
+						self.logger.error('Fail to write {} bytes to "{}": {}'.format(len(data), self.file_name, e))
+					self.last_write_latency = time.time() - start_time
+					self.max_write_latency = max(self.max_write_latency, self.last_write_latency)
+					with self.lock:
+						self.bytes_pending -= len(data)
+						self.bytes_written += len(data)
+				finally:
+					self.queue.task_done()
+		finally:
+			try:
+				if self.fsync_interval > 0:
+					self._fsync()
+			finally:
+				self.file.close()
+				if self.index_file is not None:
+					self.index_file.close()
@@ -0,0 +1,156 @@
+# coding: utf8
+
+import math
+
+from .SARC.packet import Packet as SARCPacket
+
+
+class InterestEntity:
+	__slots__ = ('entity_id', 'x', 'y', 'z', 'yaw', 'pitch', 'on_ground', 'stale')
+
+	def __init__(self, entity_id, x, y, z, yaw, pitch):
+		self.entity_id = entity_id
+		self.x, self.y, self.z = x, y, z
+		self.yaw, self.pitch = yaw, pitch
+		self.on_ground = False
+		self.stale = False  # a movement of the entity is not recorded, so the replay has it somewhere else
+
+
+class InterestFilter:
+	"""
+	Tells if a position is within the radius around any player, horizontally
+	Player positions are kept in a grid of cells at least as large as the radius, so a lookup checks the players of 9 cells only
+	Positions of players and other entities are updated in O(1) per spawn, movement or teleport packet
+	"""
+	def __init__(self, radius, max_entities):
+		self.max_entities = max_entities
+		self.players = {}  # entity id -> [x, y, z]
+		self.entities = {}  # entity id -> InterestEntity, of non-player entities
+		self.cells = {}  # (cell x, cell z) -> {entity id -> [x, y, z]} of the players in the cell
+		self.player_cells = {}  # entity id -> (cell x, cell z)
+		self.dropped_count = 0
+		self.dropped_bytes = 0
+		self.set_radius(radius)
+
+	def set_radius(self, radius):
+		self.radius = radius
+		self.cell_size = max(1, radius)
+		self.cells.clear()
+		self.player_cells.clear()
+		for entity_id, position in self.players.items():
+			self.__place_player(entity_id, position)
+
+	def __cell(self, x, z):
+		return math.floor(x / self.cell_size), math.floor(z / self.cell_size)
+
+	def __place_player(self, entity_id, position):
+		cell = self.__cell(position[0], position[2])
+		old_cell = self.player_cells.get(entity_id)
+		if cell == old_cell:
+			return
+		if old_cell is not None:
+			players = self.cells[old_cell]
+			del players[entity_id]
+			if len(players) == 0:
+				del self.cells[old_cell]
+		self.cells.setdefault(cell, {})[entity_id] = position
+		self.player_cells[entity_id] = cell
+
+	def __remove_player(self, entity_id):
+		self.players.pop(entity_id, None)
+		cell = self.player_cells.pop(entity_id, None)
+		if cell is not None:
+			players = self.cells[cell]
+			del players[entity_id]
+			if len(players) == 0:
+				del self.cells[cell]
+
+	def add_player(self, entity_id, x, y, z):
+		self.entities.pop(entity_id, None)
+		position = self.players.get(entity_id)
+		if position is None:
+			position = self.players[entity_id] = [x, y, z]
+		else:
+			position[:] = x, y, z
+		self.__place_player(entity_id, position)
+
+	def add_entity(self, entity_id, x, y, z, yaw, pitch):
+		self.__remove_player(entity_id)
+		if entity_id not in self.entities and len(self.entities) >= self.max_entities:  # in case the server leaks entity ids
+			del self.entities[next(iter(self.entities))]
+		self.entities[entity_id] = InterestEntity(entity_id, x, y, z, yaw, pitch)
+
+	def remove(self, entity_id):
+		self.__remove_player(entity_id)
+		self.entities.pop(entity_id, None)
+
+	def clear(self):
+		self.players.clear()
+		self.entities.clear()
+		self.cells.clear()
+		self.player_cells.clear()
+
+	# A movement of the entity is not in the replay, e.g. when PCRC is afk
+	def mark_stale(self, entity_id):
+		entity = self.entities.get(entity_id)
+		if entity is not None:
+			entity.stale = True
+
+	def get_position(self, entity_id):
+		position = self.players.get(entity_id)
+		if position is not None:
+			return position
+		entity = self.entities.get(entity_id)
+		return (entity.x, entity.y, entity.z) if entity is not None else None
+
+	# absolute is False for relative moves, whose deltas are in 1/4096 block
+	def move(self, entity_id, x, y, z, absolute):
+		position = self.players.get(entity_id)
+		if position is not None:
+			if absolute:
+				position[:] = x, y, z
+			else:
+				position[0] += x / 4096
+				position[1] += y / 4096
+				position[2] += z / 4096
+			self.__place_player(entity_id, position)
+			return
+		entity = self.entities.get(entity_id)
+		if entity is not None:
+			if absolute:
+				entity.x, entity.y, entity.z = x, y, z
+			else:
+				entity.x += x / 4096
+				entity.y += y / 4096
+				entity.z += z / 4096
+
+	# Everything is near when no player position is known, e.g. when all players left
+	def is_near(self, x, z):
+		if len(self.players) == 0:
+			return True
+		max_distance = self.radius ** 2
+		cell_x, cell_z = self.__cell(x, z)
+		for i in (cell_x - 1, cell_x, cell_x + 1):
+			for j in (cell_z - 1, cell_z, cell_z + 1):
+				players = self.cells.get((i, j))
+				if players is not None:
+					for position in players.values():
+						if (position[0] - x) ** 2 + (position[2] - z) ** 2 <= max_distance:
+							return True
+		return False
+
+	def add_dropped(self, size):
+		self.dropped_count += 1
+		self.dropped_bytes += size
+
+	def teleport_packet(self, teleport_id, entity):
+		packet = SARCPacket()
+		packet.write_varint(teleport_id)
+		packet.write_varint(entity.entity_id)
+		packet.write_double(entity.x)
+		packet.write_double(entity.y)
+		packet.write_double(entity.z)
+		packet.write_ubyte(entity.yaw)
+		packet.write_ubyte(entity.pitch)
+		packet.write_bool(entity.on_ground)
+		return packet.flush()
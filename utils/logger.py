@@ -1,57 +1,193 @@
+import atexit
+import collections
 import os
+import sys
+import threading
 import time
 import traceback
 
 
+class LogFile:
+	"""
+	The backend shared by every Logger writing to the same file
+	Messages are appended to an in-memory ring queue and written out in batches by a background thread with a single open handle
+	"""
+	QueueCapacity = 65536  # the oldest messages are dropped when the writing thread can't keep up
+	FlushInterval = 0.5  # in second
+	MaxFileSize = 16 * 1024 * 1024  # the file gets rotated when it grows larger than this, 0 to disable
+	RotateInterval = 24 * 60 * 60  # in second, the file gets rotated when it's older than this, 0 to disable
+	BackupCount = 5
+
+	__instances = {}
+	__instances_lock = threading.Lock()
+
+	def __init__(self, file_name):
+		self.file_name = file_name
+		self.queue = collections.deque(maxlen=LogFile.QueueCapacity)
+		self.dropped_count = 0
+		self.write_lock = threading.Lock()
+		self.wakeup = threading.Event()
+		self.file = None
+		self.file_size = 0
+		self.open_time = 0
+		if file_name is not None and not os.path.isdir(os.path.dirname(file_name)):
+			os.makedirs(os.path.dirname(file_name))
+		self.thread = threading.Thread(target=self.run, name='LogFile', daemon=True)
+		self.thread.start()
+
+	@staticmethod
+	def get(file_name):
+		with LogFile.__instances_lock:
+			log_file = LogFile.__instances.get(file_name)
+			if log_file is None:
+				log_file = LogFile.__instances[file_name] = LogFile(file_name)
+			return log_file
+
+	@staticmethod
+	def flush_all():
+		for log_file in list(LogFile.__instances.values()):
+			log_file.flush()
+
+	# loggers are deep copied for different threads, but they should still share the same file
+	def __deepcopy__(self, memo):
+		return self
+
+	def __copy__(self):
+		return self
+
+	# urgent messages are written out right away, others wait for the next batch
+	def append(self, message, do_print, urgent):
+		if len(self.queue) == self.queue.maxlen:
+			self.dropped_count += 1
+		self.queue.append((message, do_print))
+		if urgent:
+			self.wakeup.set()
+
+	def __open(self):
+		self.file = open(self.file_name, 'a', encoding='utf8')
+		self.file_size = self.file.tell()
+		self.open_time = time.time()
+
+	def __need_rotate(self):
+		if not os.path.isfile(self.file_name) or self.file_size == 0:
+			return False
+		return (LogFile.MaxFileSize > 0 and self.file_size >= LogFile.MaxFileSize) or \
+			(LogFile.RotateInterval > 0 and time.time() - self.open_time >= LogFile.RotateInterval)
+
+	# PCRC.log -> PCRC.log.1 -> PCRC.log.2 ...
+	def __rotate(self):
+		self.file.close()
+		self.file = None
+		for i in range(LogFile.BackupCount - 1, 0, -1):
+			src = '{}.{}'.format(self.file_name, i)
+			if os.path.isfile(src):
+				os.replace(src, '{}.{}'.format(self.file_name, i + 1))
+		if LogFile.BackupCount > 0:
+			os.replace(self.file_name, self.file_name + '.1')
+		else:
+			os.remove(self.file_name)
+		self.__open()
+
+	# Writes every queued message out, can be called from any thread
+	def flush(self):
+		with self.write_lock:
+			if len(self.queue) == 0:
+				return
+			lines = []
+			printed = []
+			if self.dropped_count > 0:
+				lines.append('[{} messages dropped since the log queue is full]\n'.format(self.dropped_count))
+				self.dropped_count = 0
+			try:
+				while True:
+					message, do_print = self.queue.popleft()
+					lines.append(message)
+					if do_print:
+						printed.append(message)
+			except IndexError:
+				pass
+			if len(printed) > 0:
+				sys.stdout.write(''.join(printed))
+				sys.stdout.flush()
+			if self.file_name is not None:
+				try:
+					if self.file is None:
+						self.__open()
+					if self.__need_rotate():
+						self.__rotate()
+					data = ''.join(lines)
+					self.file.write(data)
+					self.file.flush()
+					self.file_size += len(data)
+				except Exception:
+					print('fail to write log to file "{}"'.format(self.file_name))
+					print(traceback.format_exc())
+
+	def run(self):
+		while True:
+			self.wakeup.wait(LogFile.FlushInterval)
+			self.wakeup.clear()
+			self.flush()
+
+
+atexit.register(LogFile.flush_all)
+
+
 class Logger:
 	DefaultFileName = './log/PCRC.log'
+	__time_cache = (None, '')  # (second, formatted time)
 
 	def __init__(self, name=None, thread=None, file_name=DefaultFileName, display_debug=False):
 		self.name = name
 		self.thread = thread
 		self.file_name = file_name
 		self.display_debug = display_debug
-		if not os.path.isdir(os.path.dirname(file_name)):
-			os.makedirs(os.path.dirname(file_name))
+		self.log_file = LogFile.get(file_name)
 
 	@staticmethod
 	def set_default_file_name(fn):
 		Logger.DefaultFileName = fn
 
-	def _log(self, msg, log_type, do_print):
+	@staticmethod
+	def format_time(now):
+		second = int(now)
+		if Logger.__time_cache[0] != second:
+			Logger.__time_cache = (second, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second)))
+		return Logger.__time_cache[1]
+
+	# msg is formatted with args only when the message is going to be logged
+	def _log(self, msg, args, log_type, do_print):
 		if not isinstance(msg, str):
 			msg = str(msg)
-		message = '[{} {}]'.format(format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))), log_type)
+		if len(args) > 0:
+			msg = msg.format(*args)
+		message = '[{} {}]'.format(Logger.format_time(time.time()), log_type)
 		if self.name is not None:
 			message += ' [{}]'.format(self.name)
 		if self.thread is not None:
 			message += ' [Thread {}]'.format(self.thread)
 		message += ' {}\n'.format(msg)
-		if do_print:
-			print(message, end='')
-		if self.file_name is not None:
-			try:
-				with open(self.file_name, 'a') as f:
-					f.write(message)
-			except Exception:
-				print('fail to write log to file "{}"'.format(self.file_name))
-				print(traceback.format_exc())
+		self.log_file.append(message, do_print, log_type != 'DEBUG')
+
+	# Writes all logged messages out now
+	def flush(self):
+		self.log_file.flush()
 
-	def log(self, msg, log_type=None, do_print=True):
+	def log(self, msg, *args, log_type=None, do_print=True):
 		if log_type is None:
-			self.info(msg, do_print)
+			self.info(msg, *args, do_print=do_print)
 		else:
-			self._log(msg, log_type, do_print)
+			self._log(msg, args, log_type, do_print)
 
-	def info(self, msg, do_print=True):
-		self._log(msg, 'INFO', do_print)
+	def info(self, msg, *args, do_print=True):
+		self._log(msg, args, 'INFO', do_print)
 
-	def debug(self, msg, do_print=True):
+	def debug(self, msg, *args, do_print=True):
 		if self.display_debug:
-			self._log(msg, 'DEBUG', do_print)
+			self._log(msg, args, 'DEBUG', do_print)
 
-	def warn(self, msg, do_print=True):
-		self._log(msg, 'WARN', do_print)
+	def warn(self, msg, *args, do_print=True):
+		self._log(msg, args, 'WARN', do_print)
 
-	def error(self, msg, do_print=True):
-		self._log(msg, 'ERROR', do_print)
+	def error(self, msg, *args, do_print=True):
+		self._log(msg, args, 'ERROR', do_print)
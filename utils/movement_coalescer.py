@@ -0,0 +1,172 @@
+# coding: utf8
+
+import collections
+
+from .world_state import ENTITY_MOVE_PACKETS, ENTITY_MOVE_LOOK_PACKETS, ENTITY_LOOK_PACKETS
+from .SARC.packet import Packet as SARCPacket
+
+MaxRelativeMove = 32767  # deltas of relative moves are shorts in 1/4096 block
+
+
+class CoalescedEntity:
+	__slots__ = ('entity_id', 'x', 'y', 'z', 'yaw', 'pitch', 'on_ground', 'dx', 'dy', 'dz', 'moved', 'looked', 'velocity', 'last_emit_time', 'synced')
+
+	def __init__(self, entity_id, x, y, z, yaw, pitch):
+		self.entity_id = entity_id
+		# the position the server has, the replay has the position minus the pending deltas
+		self.x, self.y, self.z = x, y, z
+		self.yaw, self.pitch = yaw, pitch
+		self.on_ground = False
+		self.dx = self.dy = self.dz = 0  # pending deltas in 1/4096 block
+		self.moved = False
+		self.looked = False
+		self.velocity = None  # the latest pending Entity Velocity packet
+		self.last_emit_time = 0
+		self.synced = True  # False if a movement of the entity got lost, so only a teleport puts it where it is
+
+	def reset(self, time):
+		self.dx = self.dy = self.dz = 0
+		self.moved = self.looked = False
+		self.velocity = None
+		self.last_emit_time = time
+
+
+class MovementCoalescer:
+	"""
+	Lets each non-player entity have at most one movement update per interval
+	The movements received in between are held back and merged: relative moves are summed up and the latest rotation and velocity win
+	A teleport is emitted instead of the merged relative move when the summed up deltas don't fit in one
+	"""
+	def __init__(self, protocol_table, interval):
+		self.interval = interval  # in ms
+		self.move_packet_ids = protocol_table.compile_ids(ENTITY_MOVE_PACKETS)
+		self.move_look_packet_ids = protocol_table.compile_ids(ENTITY_MOVE_LOOK_PACKETS)
+		self.look_packet_ids = protocol_table.compile_ids(ENTITY_LOOK_PACKETS)
+		self.teleport_id = protocol_table.ids.get('Entity Teleport')
+		self.velocity_id = protocol_table.ids.get('Entity Velocity')
+		self.move_id = next(iter(self.move_packet_ids), None)
+		self.move_look_id = next(iter(self.move_look_packet_ids), None)
+		self.look_id = next(iter(self.look_packet_ids), None)
+		self.packet_ids = self.move_packet_ids | self.move_look_packet_ids | self.look_packet_ids | \
+			frozenset(packet_id for packet_id in (self.teleport_id, self.velocity_id) if packet_id is not None)
+		self.entities = {}  # entity id -> CoalescedEntity
+		self.pending = collections.OrderedDict()  # entity id -> time its first held back movement came, oldest first
+		self.held_count = 0
+		self.held_bytes = 0
+		self.emitted_count = 0
+		self.emitted_bytes = 0
+
+	def __len__(self):
+		return len(self.entities)
+
+	def add(self, entity_id, x, y, z, yaw, pitch):
+		self.pending.pop(entity_id, None)
+		self.entities[entity_id] = CoalescedEntity(entity_id, x, y, z, yaw, pitch)
+
+	def remove(self, entity_id):
+		self.pending.pop(entity_id, None)
+		self.entities.pop(entity_id, None)
+
+	# A movement of the entity is not in the replay, e.g. when PCRC is afk
+	def desync(self, entity_id):
+		entity = self.entities.get(entity_id)
+		if entity is not None:
+			entity.synced = False
+
+	def clear(self):
+		self.entities.clear()
+		self.pending.clear()
+
+	def has_pending(self):
+		return len(self.pending) > 0
+
+	@property
+	def saved_bytes(self):
+		return self.held_bytes - self.emitted_bytes
+
+	# packet is positioned after the entity id
+	# Returns the data to record, which is data itself if the entity may move now, or None if the movement is held back
+	def process(self, entity_id, packet_id, packet, data, time):
+		entity = self.entities.get(entity_id)
+		if entity is None:
+			return data
+		if packet_id == self.teleport_id:
+			entity.x, entity.y, entity.z = packet.read_double(), packet.read_double(), packet.read_double()
+			entity.yaw, entity.pitch = packet.read_ubyte(), packet.read_ubyte()
+			entity.on_ground = packet.read_bool()
+			velocity = entity.velocity
+			entity.reset(time)
+			entity.synced = True
+			# the teleport replaces the held back movements but not the velocity
+			entity.velocity = velocity
+			if velocity is None:
+				self.pending.pop(entity_id, None)
+			return data
+		if packet_id != self.velocity_id:
+			if packet_id in self.move_packet_ids or packet_id in self.move_look_packet_ids:
+				dx, dy, dz = packet.read_short(), packet.read_short(), packet.read_short()
+				entity.x += dx / 4096
+				entity.y += dy / 4096
+				entity.z += dz / 4096
+				entity.dx += dx
+				entity.dy += dy
+				entity.dz += dz
+				entity.moved = True
+			if packet_id not in self.move_packet_ids:
+				entity.yaw, entity.pitch = packet.read_ubyte(), packet.read_ubyte()
+				entity.looked = True
+			entity.on_ground = packet.read_bool()
+		else:
+			entity.velocity = bytes(data)
+		if entity_id not in self.pending and entity.synced and time - entity.last_emit_time >= self.interval:
+			entity.reset(time)
+			return data
+		if entity_id not in self.pending:
+			self.pending[entity_id] = time
+		self.held_count += 1
+		self.held_bytes += len(data)
+		return None
+
+	# Returns the merged movements of the entities whose held back movements are due
+	def collect(self, time):
+		packets = []
+		while len(self.pending) > 0:
+			entity_id, since = next(iter(self.pending.items()))
+			if time - since < self.interval:
+				break
+			del self.pending[entity_id]
+			entity = self.entities[entity_id]
+			for data in self.__merged_packets(entity):
+				self.emitted_count += 1
+				self.emitted_bytes += len(data)
+				packets.append(data)
+			entity.reset(time)
+		return packets
+
+	def __merged_packets(self, entity):
+		packets = []
+		if entity.moved or entity.looked or not entity.synced:
+			packet = SARCPacket()
+			teleport = not entity.synced or max(abs(entity.dx), abs(entity.dy), abs(entity.dz)) > MaxRelativeMove
+			if teleport:
+				packet.write_varint(self.teleport_id)
+				packet.write_varint(entity.entity_id)
+				packet.write_double(entity.x)
+				packet.write_double(entity.y)
+				packet.write_double(entity.z)
+				entity.synced = True
+			else:
+				packet.write_varint(self.move_look_id if entity.moved and entity.looked else self.move_id if entity.moved else self.look_id)
+				packet.write_varint(entity.entity_id)
+				if entity.moved:
+					packet.write_short(entity.dx)
+					packet.write_short(entity.dy)
+					packet.write_short(entity.dz)
+			if teleport or entity.looked or not entity.moved:
+				packet.write_ubyte(entity.yaw)
+				packet.write_ubyte(entity.pitch)
+			packet.write_bool(entity.on_ground)
+			packets.append(packet.flush())
+		if entity.velocity is not None:
+			packets.append(entity.velocity)
+		return packets
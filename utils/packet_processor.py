@@ -1,179 +1,456 @@
 # coding: utf8
 
-import copy
-from . import constant
-from .SARC.packet import Packet as SARCPacket
+import struct
+
+from . import constant, utils
+from .chunk_deduplicator import ChunkDeduplicator
+from .entity_tracker import EntityTracker
+from .interest_filter import InterestFilter
+from .movement_coalescer import MovementCoalescer
+from .protocol import PacketType
+from .update_elider import UpdateElider
+from .world_state import WorldState, PLAYER_INFO_PACKETS, ENTITY_MOVE_PACKETS, ENTITY_MOVE_LOOK_PACKETS, ENTITY_LOOK_PACKETS, \
+	read_chunk_data_position, read_block_change_chunk, read_block_position
+from .SARC.packet import Packet as SARCPacket, read_varint
 from .pycraft.networking.types import PositionAndLook
 
+# Entity packets that set a state of the entity instead of playing something, sending one twice changes nothing
+ELIDABLE_ENTITY_PACKETS = ['Entity Metadata', 'Entity Head Look', 'Entity Properties']
+PlayerInfoUpdateActions = {1: 'update game mode', 2: 'update latency', 3: 'update display name'}
+# Packets that only show something at a position, they are dropped far from every player by the interest filter
+# Block changes are not, nothing sends the chunk again when a player comes close, so the replay would keep the old blocks
+POSITIONED_PACKETS = ['Sound Effect', 'Named Sound Effect', 'Entity Sound Effect', 'Particle', 'Effect']
+# Entity packets besides the movements that are dropped far from every player by the interest filter
+TRANSIENT_ENTITY_PACKETS = ['Entity Velocity', 'Entity Head Look', 'Animation (clientbound)', 'Entity Animation (clientbound)']
+
 
 class PacketProcessor:
-	def __init__(self, recorder, version):
+	def __init__(self, recorder, version, protocol_table):
 		self.recorder = recorder
 		self.version = version
-		self.blocked_entity_ids = []
-		self.player_ids = []
+		self.protocol_table = protocol_table
+		self.entity_tracker = EntityTracker(constant.MaxTrackedEntities)
+		self.chunk_deduplicator = ChunkDeduplicator()
+		self.update_elider = UpdateElider(constant.MaxTrackedEntities)
+		self.movement_coalescer = MovementCoalescer(protocol_table, recorder.config.get('entity_movement_interval_ms'))
+		self.interest_filter = InterestFilter(recorder.config.get('interest_radius'), constant.MaxTrackedEntities)
+		self.teleport_id = protocol_table.ids.get('Entity Teleport')
+		self.entity_move_ids = protocol_table.compile_ids(ENTITY_MOVE_PACKETS)
+		self.entity_relative_move_ids = self.entity_move_ids | protocol_table.compile_ids(ENTITY_MOVE_LOOK_PACKETS)
+		self.entity_movement_ids = self.entity_relative_move_ids | protocol_table.compile_ids(ENTITY_LOOK_PACKETS + ['Entity Teleport'])
+		self.world_state = WorldState(protocol_table, recorder.config.get('world_cache_size_mb') * constant.BytePerMB)  # fed with the recorded packets
+		self.stages = []  # packet id -> stages to run for the packet
+		self.filtered_packet_ids = frozenset()  # packets that are never recorded in this session
+		self.time_update_blocked = False  # further Time Update packets are ignored after the daytime got set
+		self.register_stages()
 
 	@property
 	def logger(self):
 		return self.recorder.logger
 
-	def analyze(self, packet, modification=False):
-		if not modification:
-			packet = copy.deepcopy(packet)
-		packet_id = packet.read_varint()
-		packet_name = self.recorder.protocolMap[str(packet_id)] if str(packet_id) in self.recorder.protocolMap else 'unknown'
-		return packet_id, packet_name
+	# data is the raw packet (packet id + body), any bytes-like object
+	def analyze(self, data):
+		packet_id, _ = read_varint(data)
+		return packet_id, self.protocol_table.get_name(packet_id)
 
-	def process(self, packet):
+	# returns the data to record, which is the given data itself unless the packet got rewritten, or None if it should not be recorded
+	def process(self, data):
 		try:
-			return self._process(packet)
+			return self._process(data)
 		except:
 			self.logger.error('Error when processing packet')
 			try:
-				packet_id, packet_name = self.analyze(packet)
+				packet_id, packet_name = self.analyze(data)
 			except:
 				self.logger.error('Fail to analyze packet information')
 			else:
 				self.logger.error('Packet id = {}; Packet name = {}'.format(packet_id, packet_name))
 			raise
 
-	def _process(self, packet):
-		def filterBadPacket(packet_result):
-			if packet_result is not None and (packet_name in constant.BAD_PACKETS or (
-					self.recorder.config.get('minimal_packets') and packet_name in constant.USELESS_PACKETS)):
-				packet_result = None
-			return packet_result
+	# Stages are registered to the packet ids they handle based on the current config
+	# Call it again after the related config changed
+	def register_stages(self):
+		table = self.protocol_table
+		config = self.recorder.config
+		stages = [[] for _ in range(len(table.names))]
 
-		# update PCRC's position
-		def processPlayerPositionAndLook(packet_result):
-			if packet_name == 'Player Position And Look (clientbound)':
-				player_x = packet.read_double()
-				player_y = packet.read_double()
-				player_z = packet.read_double()
-				player_yaw = packet.read_float()
-				player_pitch = packet.read_float()
-				flags = packet.read_byte()
-				if flags == 0:
-					self.recorder.pos = PositionAndLook(x=player_x, y=player_y, z=player_z, yaw=player_yaw, pitch=player_pitch)
-					self.logger.log('Set self\'s position to {}'.format(self.recorder.pos))
-			return packet_result
+		def register(stage, *packet_types):
+			for packet_id in range(len(table.names)):
+				if table.types[packet_id] in packet_types:
+					stages[packet_id].append(stage)
 
-		# world time control
-		def processTimeUpdate(packet_result):
-			if packet_result is not None and 0 <= self.recorder.config.get('daytime') < 24000 and packet_name == 'Time Update':
-				self.logger.log('Set daytime to: ' + str(self.recorder.config.get('daytime')))
-				world_age = packet.read_long()
-				packet_result = SARCPacket()
-				packet_result.write_varint(packet_id)
-				packet_result.write_long(world_age)
-				packet_result.write_long(-self.recorder.config.get(
-					'daytime'))  # If negative sun will stop moving at the Math.abs of the time
-				packet_result.receive(packet_result.flush())
-				constant.BAD_PACKETS.append('Time Update')  # Ignore all further updates
-			return packet_result
+		register(self.filterTimeUpdate, PacketType.TimeUpdate)
+		register(self.processPlayerPositionAndLook, PacketType.PlayerPositionAndLook)
+		if 0 <= config.get('daytime') < 24000:
+			register(self.processTimeUpdate, PacketType.TimeUpdate)
+		if not config.get('weather'):
+			register(self.processChangeGameState, PacketType.ChangeGameState)
+		register(self.processSpawnPlayer, PacketType.SpawnPlayer)
+		register(self.processSpawnEntity, PacketType.SpawnObject, PacketType.SpawnMob)
+		register(self.processDestroyEntities, PacketType.DestroyEntities)
+		register(self.processEntityPackets, PacketType.Entity)
+		register(self.processRespawn, PacketType.Respawn, PacketType.JoinGame)
+		if config.get('deduplicate_chunks'):
+			register(self.processChunkData, PacketType.ChunkData)
+			register(self.processChunkChange, PacketType.UnloadChunk, PacketType.BlockChange)
+		if config.get('entity_movement_interval_ms') > 0:
+			for packet_id in self.movement_coalescer.packet_ids:
+				stages[packet_id].append(self.processEntityMovement)
+		# held back movements are still collected after it got disabled, the interval 0 makes them due right away
+		self.movement_coalescer.interval = max(0, config.get('entity_movement_interval_ms'))
+		if config.get('interest_radius') > 0:
+			# after processEntityMovement, so positions are tracked from the movements it holds back too
+			for packet_id in self.entity_movement_ids | table.compile_ids(TRANSIENT_ENTITY_PACKETS):
+				stages[packet_id].append(self.processEntityInterest)
+			for packet_id in table.compile_ids(POSITIONED_PACKETS):
+				stages[packet_id].append(self.processPositionInterest)
+			self.interest_filter.set_radius(config.get('interest_radius'))
+		else:
+			self.interest_filter.clear()  # positions are not tracked while it's disabled
+		if config.get('elide_redundant_updates'):
+			# after processEntityPackets and processEntityInterest, so it only remembers the values that are recorded
+			for packet_id in table.compile_ids(ELIDABLE_ENTITY_PACKETS):
+				stages[packet_id].append(self.processEntityUpdate)
+			for packet_id in table.compile_ids(PLAYER_INFO_PACKETS):
+				stages[packet_id].append(self.processPlayerInfoUpdate)
+		# chunks and values might have changed while these are disabled
+		self.chunk_deduplicator.clear()
+		self.update_elider.clear()
+		self.stages = stages
+		self.filtered_packet_ids = table.bad_packet_ids | (table.useless_packet_ids if config.get('minimal_packets') else frozenset())
+		self.logger.debug('Registered {} packet processing stages for {} packet types'.format(
+			sum(map(len, stages)), sum(1 for s in stages if len(s) > 0)
+		))
 
-		# Weather yeet
-		def processChangeGameState(packet_result):
-			# Remove weather if configured
-			if packet_result is not None and not self.recorder.config.get('weather') and packet_name == 'Change Game State':
-				reason = packet.read_ubyte()
-				if reason in [1, 2, 7, 8]:
-					packet_result = None
-			return packet_result
+	# The packet is processed but not recorded, e.g. when PCRC is afk, so the replay doesn't have what the client has
+	def discard(self, packet_id, data):
+		packet_type = self.protocol_table.get_type(packet_id)
+		if packet_type == PacketType.ChunkData or packet_type == PacketType.Entity:
+			packet = SARCPacket()
+			packet.receive(data)
+			packet.read_varint()
+			if packet_type == PacketType.ChunkData:
+				self.chunk_deduplicator.forget(read_chunk_data_position(packet, self.protocol_table.protocol)[0])
+			else:
+				entity_id, packet.offset = self.protocol_table.read_entity_id(packet_id, packet.received, packet.offset)
+				self.update_elider.forget_entity(entity_id, packet_id)
+				if packet_id in self.movement_coalescer.packet_ids:
+					self.movement_coalescer.desync(entity_id)
+				if packet_id in self.entity_movement_ids:
+					self.interest_filter.mark_stale(entity_id)
 
-		# add player id for afk detector and uuid for recording
-		def processSpawnPlayer(packet_result):
-			if packet_result is not None and packet_name == 'Spawn Player':
-				entity_id = packet.read_varint()
-				uuid = packet.read_uuid()
-				if entity_id not in self.player_ids:
-					self.player_ids.append(entity_id)
-					self.logger.debug('Player spawned, added to player id list, id = {}'.format(entity_id))
-				if uuid not in self.recorder.player_uuids:
-					self.recorder.player_uuids.append(uuid)
-					self.logger.log('Player spawned, added to uuid list, uuid = {}'.format(uuid))
-				self.recorder.updatePlayerMovement()
-			return packet_result
+	# The merged movements of entities that are due, to record after the current packet
+	def collect_movements(self):
+		packets = []
+		for data in self.movement_coalescer.collect(utils.getMilliTime()):
+			packet_id, offset = read_varint(data)
+			if self.recorder.config.get('interest_radius') > 0:
+				entity = self.interest_filter.entities.get(read_varint(data, offset)[0])
+				if entity is not None:
+					data = self.filter_entity_interest(entity, packet_id, data)
+					if data is None:
+						continue
+					packet_id = read_varint(data)[0]
+			self.world_state.update(packet_id, data)
+			packets.append(data)
+		return packets
 
-		# check if the spawned is in black list
-		def processSpawnEntity(packet_result):
-			# Keep track of spawned items and their ids
-			if packet_result is None:
-				return
-			flag_spawn_object = packet_name in ['Spawn Object', 'Spawn Entity']
-			flag_spawn_mob = packet_name in ['Spawn Mob', 'Spawn Living Entity']
-			if flag_spawn_object or flag_spawn_mob:
-				entity_id = packet.read_varint()
-				entity_uuid = packet.read_uuid()
-				entity_type = packet.read_byte()
-				self.logger.debug('{} with id {} and type {}'.format(packet_name, entity_id, entity_type))
-				entity_name = None
-				if self.recorder.config.get('remove_items') and flag_spawn_object and entity_type == constant.EntityTypeItem[self.recorder.mc_version]:
-					entity_name = 'Item'
-				if self.recorder.config.get('remove_bats') and flag_spawn_mob and entity_type == constant.EntityTypeBat[self.recorder.mc_version]:
-					entity_name = 'Bat'
-				if self.recorder.config.get('remove_phantoms') and flag_spawn_mob and entity_type == constant.EntityTypePhantom[self.recorder.mc_version]:
-					entity_name = 'Phantom'
-				if entity_name is not None:
-					self.logger.debug('{} spawned but ignore and added to blocked id list, id = {}'.format(entity_name, entity_id))
-					self.blocked_entity_ids.append(entity_id)
-					packet_result = None
-			return packet_result
+	def _process(self, data):
+		packet_id, packet_name = self.analyze(data)
+		if packet_id in self.filtered_packet_ids or packet_id >= len(self.stages):  # bad, useless or unknown packet
+			return None
+		stages = self.stages[packet_id]
+		packet_recorded = data
+		if len(stages) > 0:
+			# the stages read fields from packet while packet_recorded keeps referring to the untouched data
+			packet = SARCPacket()
+			packet.receive(data)
+			packet.read_varint()
+			body_offset = packet.offset
+			for stage in stages:
+				packet.offset = body_offset
+				packet_recorded = stage(packet, packet_id, packet_name, packet_recorded)
+		if packet_recorded is not None:
+			self.world_state.update(packet_id, packet_recorded)
+		return packet_recorded
 
-		# Removed destroyed blocked entity's id
-		def processDestroyEntities(packet_result):
-			if packet_result is not None and packet_name == 'Destroy Entities':
-				count = packet.read_varint()
-				for i in range(count):
-					entity_id = packet.read_varint()
-					if entity_id in self.blocked_entity_ids:
-						self.blocked_entity_ids.remove(entity_id)
-						self.logger.debug(
-							'Entity destroyed, removed from blocked entity id list, id = {}'.format(entity_id))
-					if entity_id in self.player_ids:
-						self.player_ids.remove(entity_id)
-						self.logger.debug('Player destroyed, removed from player id list, id = {}'.format(entity_id))
-			return packet_result
+	def filterTimeUpdate(self, packet, packet_id, packet_name, packet_result):
+		if self.time_update_blocked:
+			packet_result = None
+		return packet_result
 
-		# Detecting player activity to continue recording and remove items or bats
-		def processEntityPackets(packet_result):
-			if packet_name in constant.ENTITY_PACKETS:
-				entity_id = packet.read_varint()
-				if entity_id in self.player_ids:
-					self.recorder.updatePlayerMovement()
-					self.logger.debug('Update player movement time, triggered by entity id {}'.format(entity_id))
-				if entity_id in self.blocked_entity_ids:
-					packet_result = None
-			return packet_result
+	# update PCRC's position
+	def processPlayerPositionAndLook(self, packet, packet_id, packet_name, packet_result):
+		player_x = packet.read_double()
+		player_y = packet.read_double()
+		player_z = packet.read_double()
+		player_yaw = packet.read_float()
+		player_pitch = packet.read_float()
+		flags = packet.read_byte()
+		if flags == 0:
+			self.recorder.pos = PositionAndLook(x=player_x, y=player_y, z=player_z, yaw=player_yaw, pitch=player_pitch)
+			self.logger.log('Set self\'s position to {}'.format(self.recorder.pos))
+		return packet_result
+
+	# world time control
+	def processTimeUpdate(self, packet, packet_id, packet_name, packet_result):
+		if packet_result is not None and 0 <= self.recorder.config.get('daytime') < 24000:
+			self.logger.log('Set daytime to: ' + str(self.recorder.config.get('daytime')))
+			world_age = packet.read_long()
+			packet_result = SARCPacket()
+			packet_result.write_varint(packet_id)
+			packet_result.write_long(world_age)
+			packet_result.write_long(-self.recorder.config.get(
+				'daytime'))  # If negative sun will stop moving at the Math.abs of the time
+			packet_result = packet_result.flush()
+			self.time_update_blocked = True  # Ignore all further updates
+		return packet_result
+
+	# Weather yeet
+	def processChangeGameState(self, packet, packet_id, packet_name, packet_result):
+		# Remove weather if configured
+		if packet_result is not None and not self.recorder.config.get('weather'):
+			reason = packet.read_ubyte()
+			if reason in [1, 2, 7, 8]:
+				packet_result = None
+		return packet_result
 
-		# Detecting player activity to continue recording and remove items or bats
-		def processRespawn(packet_result):
-			if packet_name == 'Respawn':
+	# add player id for afk detector and uuid for recording
+	def processSpawnPlayer(self, packet, packet_id, packet_name, packet_result):
+		if packet_result is not None:
+			entity_id = packet.read_varint()
+			uuid = packet.read_uuid()
+			self.update_elider.forget_entity(entity_id)
+			self.movement_coalescer.remove(entity_id)
+			if self.recorder.config.get('interest_radius') > 0:
 				try:
-					constant.BAD_PACKETS.remove('Time Update')
-				except ValueError:
-					pass
+					self.interest_filter.add_player(entity_id, packet.read_double(), packet.read_double(), packet.read_double())
+				except (struct.error, IndexError):
+					self.logger.debug('Fail to read the position of player with id {}', entity_id)
+			if not self.entity_tracker.is_player(entity_id):
+				self.entity_tracker.add(entity_id, is_player=True)
+				self.logger.debug('Player spawned, added to player id list, id = {}', entity_id)
+			if uuid not in self.recorder.player_uuids:
+				self.recorder.player_uuids.add(uuid)
+				self.logger.log('Player spawned, added to uuid list, uuid = {}'.format(uuid))
+			self.recorder.updatePlayerMovement()
+		return packet_result
+
+	# track spawned entities and check if the spawned is in black list
+	def processSpawnEntity(self, packet, packet_id, packet_name, packet_result):
+		if packet_result is None:
+			return
+		packet_type = self.protocol_table.types[packet_id]
+		flag_spawn_object = packet_type == PacketType.SpawnObject
+		flag_spawn_mob = packet_type == PacketType.SpawnMob
+		entity_id = packet.read_varint()
+		entity_uuid = packet.read_uuid()
+		# object type is a byte before 1.14, other entity types are varints
+		entity_type = packet.read_byte() if flag_spawn_object and self.protocol_table.protocol < 477 else packet.read_varint()
+		self.logger.debug('{} with id {} and type {}', packet_name, entity_id, entity_type)
+		entity_name = None
+		if self.recorder.config.get('remove_items') and flag_spawn_object and entity_type == constant.EntityTypeItem[self.recorder.mc_version]:
+			entity_name = 'Item'
+		if self.recorder.config.get('remove_bats') and flag_spawn_mob and entity_type == constant.EntityTypeBat[self.recorder.mc_version]:
+			entity_name = 'Bat'
+		if self.recorder.config.get('remove_phantoms') and flag_spawn_mob and entity_type == constant.EntityTypePhantom[self.recorder.mc_version]:
+			entity_name = 'Phantom'
+		self.entity_tracker.add(entity_id, entity_type, blocked=entity_name is not None)
+		self.update_elider.forget_entity(entity_id)
+		self.movement_coalescer.remove(entity_id)
+		self.interest_filter.remove(entity_id)
+		if entity_name is not None:
+			self.logger.debug('{} spawned but ignore and added to blocked id list, id = {}', entity_name, entity_id)
+			packet_result = None
+		elif self.recorder.config.get('entity_movement_interval_ms') > 0 or self.recorder.config.get('interest_radius') > 0:
+			try:
+				x, y, z = packet.read_double(), packet.read_double(), packet.read_double()
+				if flag_spawn_object:
+					pitch, yaw = packet.read_ubyte(), packet.read_ubyte()
 				else:
-					self.logger.debug('Removed Time Update packet from BAD_PACKET list due to dimension change')
+					yaw, pitch = packet.read_ubyte(), packet.read_ubyte()
+			except (struct.error, IndexError):
+				self.logger.debug('Fail to read the position of {} with id {}, its movements are always recorded', packet_name, entity_id)
+			else:
+				if self.recorder.config.get('entity_movement_interval_ms') > 0:
+					self.movement_coalescer.add(entity_id, x, y, z, yaw, pitch)
+				if self.recorder.config.get('interest_radius') > 0:
+					self.interest_filter.add_entity(entity_id, x, y, z, yaw, pitch)
+		return packet_result
+
+	# Removed destroyed blocked entity's id
+	def processDestroyEntities(self, packet, packet_id, packet_name, packet_result):
+		if packet_result is not None:
+			count = packet.read_varint()
+			for i in range(count):
+				entity_id = packet.read_varint()
+				self.update_elider.forget_entity(entity_id)
+				self.movement_coalescer.remove(entity_id)
+				self.interest_filter.remove(entity_id)
+				entity = self.entity_tracker.remove(entity_id)
+				if entity is not None and entity.blocked:
+					self.logger.debug('Entity destroyed, removed from blocked entity id list, id = {}', entity.entity_id)
+				if entity is not None and entity.is_player:
+					self.logger.debug('Player destroyed, removed from player id list, id = {}', entity.entity_id)
+		return packet_result
+
+	# Detecting player activity to continue recording and remove items or bats
+	def processEntityPackets(self, packet, packet_id, packet_name, packet_result):
+		entity_id, packet.offset = self.protocol_table.read_entity_id(packet_id, packet.received, packet.offset)
+		if self.entity_tracker.is_player(entity_id):
+			self.recorder.updatePlayerMovement()
+			self.logger.debug('Update player movement time, triggered by entity id {}', entity_id)
+		if self.entity_tracker.is_blocked(entity_id):
+			packet_result = None
+		return packet_result
+
+	# Drop chunks that the client already has with the same content
+	def processChunkData(self, packet, packet_id, packet_name, packet_result):
+		if packet_result is None:
+			return None
+		pos, full = read_chunk_data_position(packet, self.protocol_table.protocol)
+		if not full:
+			self.chunk_deduplicator.forget(pos)
+		elif self.chunk_deduplicator.check(pos, packet_result):
+			self.logger.debug('Chunk {} re-sent with the same content, ignore', pos)
+			self.world_state.touch_chunk(pos)
+			packet_result = None
+		return packet_result
+
+	# the content of the chunk on the client is not the one of its last Chunk Data anymore
+	def processChunkChange(self, packet, packet_id, packet_name, packet_result):
+		if self.protocol_table.types[packet_id] == PacketType.UnloadChunk:
+			pos = (packet.read_int(), packet.read_int())
+		else:
+			pos = read_block_change_chunk(packet, self.protocol_table.protocol, packet_name != 'Block Change')
+		self.chunk_deduplicator.forget(pos)
+		return packet_result
+
+	# Drop entity updates that set the same values as the last one
+	def processEntityUpdate(self, packet, packet_id, packet_name, packet_result):
+		if packet_result is not None and self.update_elider.check_entity(packet.read_varint(), packet_id, packet_result):
+			self.update_elider.add_elided(packet_name, len(packet_result))
+			packet_result = None
+		return packet_result
+
+	# Drop the players of Player Info updates whose game mode, latency or display name doesn't change
+	def processPlayerInfoUpdate(self, packet, packet_id, packet_name, packet_result):
+		if packet_result is None:
+			return None
+		action = packet.read_varint()
+		if action not in PlayerInfoUpdateActions:
+			self.update_elider.forget_players()  # players are added or removed
 			return packet_result
+		count = packet.read_varint()
+		changed = []
+		for i in range(count):
+			start = packet.offset
+			uuid = packet.read_uuid()
+			if action == 3:  # display name
+				if packet.read_bool():
+					packet.read_utf()
+			else:
+				packet.read_varint()
+			if not self.update_elider.check_player(uuid, action, packet.received[start + 16:packet.offset]):
+				changed.append(packet.received[start:packet.offset])
+		if len(changed) < count:
+			report_name = '{} ({})'.format(packet_name, PlayerInfoUpdateActions[action])
+			if len(changed) == 0:
+				self.update_elider.add_elided(report_name, len(packet_result), count)
+				return None
+			original_size = len(packet_result)
+			packet_result = SARCPacket()
+			packet_result.write_varint(packet_id)
+			packet_result.write_varint(action)
+			packet_result.write_varint(len(changed))
+			for entry in changed:
+				packet_result.write(bytes(entry))
+			packet_result = packet_result.flush()
+			self.update_elider.add_elided(report_name, original_size - len(packet_result), count - len(changed))
+		return packet_result
 
-		packet = copy.deepcopy(packet)
-		packet_recorded = copy.deepcopy(packet)
-		packet_id, packet_name = self.analyze(packet, modification=True)
-
-		# update chatSpamThresholdCount in chat thread
-		if packet_name == 'Time Update':
-			self.recorder.chat_thread.on_recieved_TimeUpdatePacket()
-
-		# process packet
-		packet_recorded = filterBadPacket(packet_recorded)
-		packet_recorded = processPlayerPositionAndLook(packet_recorded)
-		packet_recorded = processTimeUpdate(packet_recorded)
-		packet_recorded = processChangeGameState(packet_recorded)
-		packet_recorded = processSpawnPlayer(packet_recorded)
-		packet_recorded = processSpawnEntity(packet_recorded)
-		packet_recorded = processDestroyEntities(packet_recorded)
-		packet_recorded = processEntityPackets(packet_recorded)
-		packet_recorded = processRespawn(packet_recorded)
+	# Hold back movements of non-player entities to merge them, players always move smoothly
+	def processEntityMovement(self, packet, packet_id, packet_name, packet_result):
+		if packet_result is not None:
+			entity_id = packet.read_varint()
+			if not self.entity_tracker.is_player(entity_id):
+				packet_result = self.movement_coalescer.process(entity_id, packet_id, packet, packet_result, utils.getMilliTime())
+		return packet_result
 
-		return packet_recorded
+	# Track player and entity positions, and drop movements and animations of entities far from every player
+	def processEntityInterest(self, packet, packet_id, packet_name, packet_result):
+		entity_id = packet.read_varint()
+		if packet_id in self.entity_movement_ids:
+			if packet_id == self.teleport_id:
+				self.interest_filter.move(entity_id, packet.read_double(), packet.read_double(), packet.read_double(), True)
+			elif packet_id in self.entity_relative_move_ids:
+				self.interest_filter.move(entity_id, packet.read_short(), packet.read_short(), packet.read_short(), False)
+			entity = self.interest_filter.entities.get(entity_id)
+			if entity is not None:
+				if packet_id not in self.entity_move_ids:
+					entity.yaw, entity.pitch = packet.read_ubyte(), packet.read_ubyte()
+				entity.on_ground = packet.read_bool()
+		else:
+			entity = self.interest_filter.entities.get(entity_id)
+		if packet_result is None or entity is None:  # players and entities without a known position are always recorded
+			return packet_result
+		return self.filter_entity_interest(entity, packet_id, packet_result)
+
+	# A stale entity that moves near a player is teleported to where it is
+	def filter_entity_interest(self, entity, packet_id, data):
+		if self.interest_filter.is_near(entity.x, entity.z):
+			if entity.stale and packet_id in self.entity_movement_ids:
+				entity.stale = False
+				data = self.interest_filter.teleport_packet(self.teleport_id, entity)
+			return data
+		if packet_id in self.entity_movement_ids:
+			entity.stale = True
+		self.interest_filter.add_dropped(len(data))
+		return None
+
+	# Drop sounds, particles and block changes far from every player
+	def processPositionInterest(self, packet, packet_id, packet_name, packet_result):
+		if packet_result is None:
+			return None
+		protocol = self.protocol_table.protocol
+		if packet_name == 'Sound Effect' or packet_name == 'Named Sound Effect':
+			if packet_name == 'Sound Effect':
+				packet.read_varint()
+			else:
+				packet.read_utf()
+			packet.read_varint()  # category
+			x, y, z = packet.read_int() / 8, packet.read_int() / 8, packet.read_int() / 8
+		elif packet_name == 'Entity Sound Effect':
+			packet.read_varint()
+			packet.read_varint()  # category
+			position = self.interest_filter.get_position(packet.read_varint())
+			if position is None:
+				return packet_result
+			x, y, z = position
+		elif packet_name == 'Particle':
+			packet.read_int()
+			packet.read_bool()  # long distance
+			if protocol >= 573:  # 1.15 changed the position to doubles
+				x, y, z = packet.read_double(), packet.read_double(), packet.read_double()
+			else:
+				x, y, z = packet.read_float(), packet.read_float(), packet.read_float()
+		else:
+			packet.read_int()  # Effect
+			x, y, z = read_block_position(packet, protocol)
+		if self.interest_filter.is_near(x, z):
+			return packet_result
+		self.interest_filter.add_dropped(len(packet_result))
+		return None
+
+	# Detecting player activity to continue recording and remove items or bats
+	def processRespawn(self, packet, packet_id, packet_name, packet_result):
+		# the client drops all of its entities and chunks on respawn
+		self.entity_tracker.clear()
+		self.chunk_deduplicator.clear()
+		self.update_elider.clear()
+		self.movement_coalescer.clear()
+		self.interest_filter.clear()
+		if self.time_update_blocked:
+			self.time_update_blocked = False
+			self.logger.debug('Stopped ignoring Time Update packets due to dimension change')
+		return packet_result
@@ -0,0 +1,118 @@
+# coding: utf8
+
+import json
+import struct
+import threading
+
+from . import constant, utils
+from .SARC.packet import read_varint
+
+
+class PacketType:
+	"""
+	Packets that PacketProcessor handles, as small integers so dispatching a packet is a list index
+	"""
+	Other = 0
+	PlayerPositionAndLook = 1
+	TimeUpdate = 2
+	ChangeGameState = 3
+	SpawnPlayer = 4
+	SpawnObject = 5
+	SpawnMob = 6
+	DestroyEntities = 7
+	Entity = 8
+	Respawn = 9
+	JoinGame = 10
+	ChunkData = 11
+	UnloadChunk = 12
+	BlockChange = 13
+
+
+PacketTypeMap = {
+	'Player Position And Look (clientbound)': PacketType.PlayerPositionAndLook,
+	'Time Update': PacketType.TimeUpdate,
+	'Change Game State': PacketType.ChangeGameState,
+	'Spawn Player': PacketType.SpawnPlayer,
+	'Spawn Object': PacketType.SpawnObject,  # 1.12 - 1.13
+	'Spawn Entity': PacketType.SpawnObject,  # 1.14+
+	'Spawn Mob': PacketType.SpawnMob,  # 1.12 - 1.13
+	'Spawn Living Entity': PacketType.SpawnMob,  # 1.14+
+	'Destroy Entities': PacketType.DestroyEntities,
+	'Respawn': PacketType.Respawn,
+	'Join Game': PacketType.JoinGame,
+	'Chunk Data': PacketType.ChunkData,
+	'Chunk Data and Update Light': PacketType.ChunkData,  # 1.18+
+	'Unload Chunk': PacketType.UnloadChunk,
+	'Block Change': PacketType.BlockChange,
+	'Multi Block Change': PacketType.BlockChange,
+}
+for name in constant.ENTITY_PACKETS:
+	PacketTypeMap[name] = PacketType.Entity
+
+
+class ProtocolTable:
+	"""
+	Clientbound packet id lookup tables of a protocol version, indexed by packet id
+	"""
+	def __init__(self, protocol, clientbound):
+		self.protocol = protocol
+		size = max(map(int, clientbound.keys())) + 1 if len(clientbound) > 0 else 0
+		self.names = ['unknown'] * size
+		self.types = [PacketType.Other] * size
+		self.ids = {}  # name -> id
+		for packet_id, name in clientbound.items():
+			packet_id = int(packet_id)
+			self.names[packet_id] = name
+			self.types[packet_id] = PacketTypeMap.get(name, PacketType.Other)
+			self.ids[name] = packet_id
+		self.bad_packet_ids = self.compile_ids(constant.BAD_PACKETS)
+		self.useless_packet_ids = self.compile_ids(constant.USELESS_PACKETS)
+		self.entity_packet_ids = self.compile_ids(constant.ENTITY_PACKETS)
+		self.important_packet_ids = self.compile_ids(constant.IMPORTANT_PACKETS)
+		# Entity packets whose entity id is not the leading varint
+		self.int_entity_id_packet_ids = self.compile_ids(['Entity Status'])
+		self.entity_sound_packet_ids = self.compile_ids(['Entity Sound Effect'])  # the sound id and category come first
+
+	# Returns the entity id of an Entity packet and the offset right after it, offset is the one right after the packet id
+	def read_entity_id(self, packet_id, data, offset):
+		if packet_id in self.int_entity_id_packet_ids:
+			return struct.unpack_from('>i', data, offset)[0], offset + 4
+		if packet_id in self.entity_sound_packet_ids:
+			offset = read_varint(data, offset)[1]
+			offset = read_varint(data, offset)[1]
+		return read_varint(data, offset)
+
+	# packet name list -> frozenset of packet ids of this protocol
+	def compile_ids(self, packet_names):
+		packet_names = set(packet_names)
+		return frozenset(packet_id for packet_id, name in enumerate(self.names) if name in packet_names)
+
+	def get_name(self, packet_id):
+		return self.names[packet_id] if 0 <= packet_id < len(self.names) else 'unknown'
+
+	def get_type(self, packet_id):
+		return self.types[packet_id] if 0 <= packet_id < len(self.types) else PacketType.Other
+
+
+_lock = threading.Lock()
+_protocol_data = None
+_tables = {}
+
+
+def load_protocol_data():
+	global _protocol_data
+	with _lock:
+		if _protocol_data is None:
+			with open(utils.get_path('protocol.json'), 'r') as f:
+				_protocol_data = json.load(f)
+		return _protocol_data
+
+
+# The table of each protocol version is built once and shared
+def get_table(protocol):
+	table = _tables.get(protocol)
+	if table is None:
+		table = ProtocolTable(protocol, load_protocol_data()[str(protocol)]['Clientbound'])
+		with _lock:
+			table = _tables.setdefault(protocol, table)
+	return table
@@ -0,0 +1,371 @@
+# PCRC: an asyncio transport for Connection, so that many connections can be
+# driven by one event loop thread instead of a networking thread each
+import asyncio
+import queue
+import sys
+import threading
+
+from .connection import Connection
+from ..exceptions import InvalidState, IgnorePacket
+
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """Returns the event loop shared by every AsyncConnection, which runs in a
+    daemon thread started on first use.
+    """
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=loop.run_forever, name='Networking Loop', daemon=True)
+            thread.start()
+            _event_loop = loop
+        return _event_loop
+
+
+class _StreamSocket(object):
+    """Stands for the socket of an AsyncConnection. The data sent is written
+    to the stream in the event loop thread, in the order of the calls, so the
+    encryption wrapper of LoginReactor can be put on top of it as usual.
+    """
+    def __init__(self, session):
+        self.session = session
+
+    def send(self, data):
+        self.session.loop.call_soon_threadsafe(self.session.write, bytes(data))
+
+    def shutdown(self, *args, **kwds):
+        pass
+
+    def close(self):
+        self.session.loop.call_soon_threadsafe(self.session.close)
+
+
+class _StreamFileObject(object):
+    """Stands for the file object of an AsyncConnection. Incoming data is not
+    read through it, but LoginReactor wraps it with the decryptor to use when
+    the encryption gets enabled.
+    """
+    def read(self, length):
+        raise IOError('An asyncio connection is not read through its file '
+                      'object.')
+
+    def close(self):
+        pass
+
+
+class FrameDecoder(object):
+    """Splits the incoming (decrypted) bytes into frames, i.e. the bytes after
+    the VarInt length prefix of each packet.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def feed(self, data):
+        if self.offset > 0:
+            del self.buffer[:self.offset]
+            self.offset = 0
+        self.buffer += data
+
+    def next_frame(self):
+        # Returns None until a whole frame is buffered
+        buffer = self.buffer
+        pos = self.offset
+        length = 0
+        for i in range(5):
+            if pos >= len(buffer):
+                return None
+            byte = buffer[pos]
+            pos += 1
+            length |= (byte & 0x7F) << 7 * i
+            if not byte & 0x80:
+                break
+        else:
+            raise IOError('Frame length VarInt is too big.')
+        if pos + length > len(buffer):
+            return None
+        self.offset = pos + length
+        return bytes(buffer[pos:self.offset])
+
+    def decrypt_remaining(self, decryptor):
+        # The bytes after the frame that enabled the encryption are encrypted
+        remaining = bytes(self.buffer[self.offset:])
+        self.buffer[self.offset:] = decryptor.update(remaining)
+
+
+class ListenerThread(threading.Thread):
+    """Calls the packet listeners of an AsyncSession, in the order the packets
+    are read, so that a listener that blocks holds up its own connection only
+    instead of the event loop shared by every connection.
+    """
+    def __init__(self, session):
+        super(ListenerThread, self).__init__(
+            name='Packet Listener', daemon=True)
+        self.session = session
+        self.queue = queue.Queue()
+        self.exc_info = None
+
+    def put(self, packet):
+        self.queue.put(packet)
+
+    @property
+    def pending_count(self):
+        return self.queue.qsize()
+
+    def stop(self):
+        # Returns after the packets put so far are handled
+        self.queue.put(None)
+        if self.is_alive():
+            self.join()
+
+    def raise_exception(self):
+        if self.exc_info is not None:
+            exc_value, exc_tb = self.exc_info[1:]
+            raise exc_value.with_traceback(exc_tb)
+
+    def run(self):
+        session = self.session
+        while True:
+            packet = self.queue.get()
+            if session.reading_paused and \
+                    self.queue.qsize() < session.ResumePendingPackets:
+                session.reading_paused = False
+                session.loop.call_soon_threadsafe(session.listeners_caught_up.set)
+            if packet is None:
+                break
+            try:
+                for listener in session.connection.packet_listeners:
+                    listener.call_packet(packet)
+            except IgnorePacket:
+                pass
+            except Exception:
+                self.exc_info = sys.exc_info()
+                session.loop.call_soon_threadsafe(session.close)
+                break
+
+
+class AsyncSession(object):
+    """Takes the place of NetworkingThread for an AsyncConnection: a task on
+    the event loop that reads the packets of one socket and reacts to them.
+    The packet listeners are called in a ListenerThread of the session.
+    Everything but the constructor runs in the event loop thread.
+    """
+    ReadSize = 65536
+    # Reading pauses while the listeners are this many packets behind, until
+    # they are less than ResumePendingPackets behind
+    MaxPendingPackets = 4096
+    ResumePendingPackets = 2048
+
+    def __init__(self, connection, sock, loop):
+        self.connection = connection
+        self.sock = sock
+        self.loop = loop
+        self.interrupt = False
+        self.writer = None
+        self.pending_writes = []
+        self.decoder = FrameDecoder()
+        self.listener_thread = ListenerThread(self)
+        self.listeners_caught_up = None  # an asyncio.Event, set by the ListenerThread
+        self.reading_paused = False
+
+    def write(self, data):
+        if self.writer is None:
+            self.pending_writes.append(data)
+        elif not self.writer.is_closing():
+            self.writer.write(data)
+
+    def close(self):
+        self.interrupt = True
+        if self.writer is not None:
+            self.writer.close()
+        if self.listeners_caught_up is not None:
+            self.listeners_caught_up.set()
+
+    async def run(self):
+        connection = self.connection
+        self.listeners_caught_up = asyncio.Event()
+        self.listener_thread.start()
+        try:
+            try:
+                reader, self.writer = await asyncio.open_connection(
+                    sock=self.sock, limit=self.ReadSize)
+                for data in self.pending_writes:
+                    self.writer.write(data)
+                self.pending_writes = []
+                if not self.interrupt:
+                    await self._read(reader)
+            finally:
+                # The listeners get the packets read before the session ends
+                await self.loop.run_in_executor(
+                    None, self.listener_thread.stop)
+            self.listener_thread.raise_exception()
+            connection._handle_exit()
+        except Exception as e:
+            self.interrupt = True
+            connection._handle_exception(e, sys.exc_info())
+        finally:
+            # The write lock may be held for long by other threads, so it's
+            # not taken in the event loop thread
+            await self.loop.run_in_executor(None, self._detach)
+            if self.writer is not None:
+                self.writer.close()
+            else:
+                self.sock.close()
+            connection.running_networking_thread -= 1  # PCRC
+
+    async def _read(self, reader):
+        connection = self.connection
+        decryptor = None
+        while not self.interrupt:
+            data = await reader.read(self.ReadSize)
+            if len(data) == 0:
+                if self.interrupt:
+                    break
+                raise EOFError('Connection closed by the server.')
+            if decryptor is not None:
+                data = decryptor.update(data)
+            self.decoder.feed(data)
+            while not self.interrupt:
+                frame = self.decoder.next_frame()
+                if frame is None:
+                    break
+                self._react(connection.reactor.parse_frame(frame))
+
+                new_decryptor = getattr(
+                    connection.file_object, 'decryptor', None)
+                if new_decryptor is not None and new_decryptor is not decryptor:
+                    decryptor = new_decryptor
+                    self.decoder.decrypt_remaining(decryptor)
+            if self.listener_thread.pending_count >= self.MaxPendingPackets:
+                await self._wait_for_listeners()
+
+    async def _wait_for_listeners(self):
+        while not self.interrupt:
+            # The flag is set before the check, so the ListenerThread sees it
+            # if it catches up after the check
+            self.reading_paused = True
+            if self.listener_thread.pending_count < self.ResumePendingPackets:
+                break
+            await self.listeners_caught_up.wait()
+            self.listeners_caught_up.clear()
+        self.reading_paused = False
+
+    def _detach(self):
+        with self.connection._write_lock:
+            if self.connection.networking_thread is self:
+                self.connection.networking_thread = None
+
+    def _react(self, packet):
+        # The reactor handles the packet right away, since it may change how
+        # the next frames are read, e.g. by enabling the compression
+        connection = self.connection
+        try:
+            for listener in connection.early_packet_listeners:
+                listener.call_packet(packet)
+            connection.reactor.react(packet)
+        except IgnorePacket:
+            return
+        self.listener_thread.put(packet)
+
+
+class AsyncConnection(Connection):
+    """A Connection whose networking runs as a task on an asyncio event loop,
+    see 'get_event_loop', instead of in a NetworkingThread of its own. It has
+    the same interface. The early packet listeners are called in the event
+    loop thread, so they should not block, and the other packet listeners in
+    a thread of the connection.
+
+    :param loop: The event loop to use, the shared one by default.
+    """
+    def __init__(self, *args, **kwds):
+        self.loop = kwds.pop('loop', None) or get_event_loop()
+        self._session = None
+        super(AsyncConnection, self).__init__(*args, **kwds)
+
+    def _connect(self):
+        super(AsyncConnection, self)._connect()
+        self.file_object.close()
+        self.socket.setblocking(False)
+        self._session = AsyncSession(self, self.socket, self.loop)
+        self.socket = _StreamSocket(self._session)
+        self.file_object = _StreamFileObject()
+
+    def _start_network_thread(self):
+        with self._write_lock:
+            if self.networking_thread is not None and \
+               not self.networking_thread.interrupt:
+                raise InvalidState('A networking session is already running.')
+            self.networking_thread = self._session
+            self.running_networking_thread += 1  # PCRC
+            asyncio.run_coroutine_threadsafe(self._session.run(), self.loop)
+        self._schedule_flush()
+
+    def write_packet(self, packet, force=False):
+        # The packets are written in the event loop thread only, in the order
+        # they are given, so neither the loop nor the callers wait for the
+        # write lock. A forced packet is written right away in the loop thread
+        # only, which is where the reactor answers the Encryption Request.
+        packet.context = self.context
+        self._outgoing_packet_queue.append(packet)
+        if force and self._in_loop_thread():
+            self._flush_outgoing_packets()
+        else:
+            self._schedule_flush()
+
+    def disconnect(self, immediate=False):
+        # Unlike Connection.disconnect, the write lock is not taken, since
+        # this may be called in the event loop thread, e.g. by the reactor.
+        # The queued packets are written before the session closes the stream
+        self.connected = False
+        sock, self.socket = self.socket, None
+        if sock is not None and not immediate:
+            self.loop.call_soon_threadsafe(
+                self._flush_outgoing_packets, sock,
+                self._outgoing_packet_queue)
+        if self.networking_thread is not None:
+            self.networking_thread.interrupt = True
+        if sock is not None:
+            sock.close()
+
+    def _in_loop_thread(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _schedule_flush(self):
+        self.loop.call_soon_threadsafe(self._flush_outgoing_packets)
+
+    def _flush_outgoing_packets(self, sock=None, packets=None):
+        sock = sock or self.socket
+        if packets is None:
+            packets = self._outgoing_packet_queue
+        try:
+            while sock is not None and len(packets) > 0:
+                self._send_packet(packets.popleft(), sock)
+        except Exception as e:
+            if self.networking_thread is not None:
+                self.networking_thread.interrupt = True
+            self._handle_exception(e, sys.exc_info())
+
+    def _send_packet(self, packet, sock):
+        # Connection._write_packet, through the given socket
+        try:
+            for listener in self.early_outgoing_packet_listeners:
+                listener.call_packet(packet)
+
+            if self.options.compression_enabled:
+                packet.write(sock, self.options.compression_threshold)
+            else:
+                packet.write(sock)
+
+            for listener in self.outgoing_packet_listeners:
+                listener.call_packet(packet)
+        except IgnorePacket:
+            pass
@@ -1,4 +1,3 @@
-import copy
 from collections import deque
 from threading import RLock
 import zlib
@@ -23,6 +22,9 @@ from ..exceptions import (
 STATE_STATUS = 1
 STATE_PLAYING = 2
 
+# PCRC: (packet getter of a state, protocol version) -> {id: packet class}
+_clientbound_packet_tables = {}
+
 
 class ConnectionContext(object):
     """A ConnectionContext encapsulates the static configuration parameters
@@ -58,6 +60,7 @@ class Connection(object):
         handle_exception=None,
         handle_exit=None,
         recorder=None,  # PCRC
+        lazy_decoding=False,  # PCRC
     ):
         """Sets up an instance of this object to be able to connect to a
         minecraft server.
@@ -100,6 +103,11 @@ class Connection(object):
                             and not with the intention to automatically
                             reconnect. Exceptions raised from this function
                             will be handled by any matching exception handlers.
+        :param lazy_decoding: If 'True', only the packet ID of an incoming
+                              packet is decoded up front unless some listener
+                              is registered for its type. The body of other
+                              packets is parsed on the first access to one of
+                              their fields.
         """  # NOQA
 
         # This lock is re-entrant because it may be acquired in a re-entrant
@@ -117,6 +125,8 @@ class Connection(object):
         # PCRC fields
         self.running_networking_thread = 0
         self.recorder = recorder
+        self.lazy_decoding = lazy_decoding
+        self.eager_packet_types = set()  # incoming packet types that always get parsed on read
 
         def proto_version(version):
             if isinstance(version, str):
@@ -241,6 +251,11 @@ class Connection(object):
                       listeners with 'early=False' are called. If
                       'outgoing=True', the listener will be called before the
                       packet is written to the network, rather than afterwards.
+
+        With 'lazy_decoding' enabled, registering an incoming listener for a
+        packet type makes packets of that type get parsed as soon as they are
+        read. Listeners for the base 'Packet' class do not, they receive the
+        other packets with their body parsed on first field access.
         """
         outgoing = kwds.pop('outgoing', False)
         early = kwds.pop('early', False)
@@ -248,7 +263,13 @@ class Connection(object):
             else self.early_packet_listeners if early and not outgoing \
             else self.outgoing_packet_listeners if not early \
             else self.early_outgoing_packet_listeners
-        target.append(packets.PacketListener(method, *packet_types, **kwds))
+        listener = packets.PacketListener(method, *packet_types, **kwds)
+        target.append(listener)
+        if not outgoing:
+            self.eager_packet_types.update(
+                packet_type for packet_type in listener.packets_to_listen
+                if packet_type is not packets.Packet)
+            self.reactor.update_eager_packets()
 
     def register_exception_handler(self, handler_func, *exc_types, **kwds):
         """
@@ -625,10 +646,31 @@ class PacketReactor(object):
 
     def __init__(self, connection):
         self.connection = connection
-        context = self.connection.context
-        self.clientbound_packets = {
-            packet.get_id(context): packet
-            for packet in self.__class__.get_clientbound_packets(context)}
+        self.clientbound_packets = \
+            self.get_clientbound_packet_table(self.connection.context)
+        self.update_eager_packets()
+
+    @classmethod
+    def get_clientbound_packet_table(cls, context):
+        # PCRC: resolve the ids of the packet classes once per protocol
+        # version instead of on every reactor creation
+        key = (cls.get_clientbound_packets, context.protocol_version)
+        table = _clientbound_packet_tables.get(key)
+        if table is None:
+            table = {
+                packet.get_id(context): packet
+                for packet in cls.get_clientbound_packets(context)}
+            _clientbound_packet_tables[key] = table
+        return table
+
+    def update_eager_packets(self):
+        # PCRC: ids of the packets to be parsed right away, see
+        # 'lazy_decoding' in Connection
+        eager_packet_types = tuple(self.connection.eager_packet_types)
+        self.eager_packet_ids = {
+            packet_id for packet_id, packet in self.clientbound_packets.items()
+            if not self.connection.lazy_decoding or
+            issubclass(packet, eager_packet_types)}
 
     def read_packet(self, stream, timeout=0):
         # Block for up to `timeout' seconds waiting for `stream' to become
@@ -638,44 +680,57 @@ class PacketReactor(object):
         if ready_to_read:
             length = VarInt.read(stream)
 
-            packet_data = packets.PacketBuffer()
-            packet_data.send(stream.read(length))
-            # Ensure we read all the packet
-            while len(packet_data.get_writable()) < length:
-                packet_data.send(
-                    stream.read(length - len(packet_data.get_writable())))
-            packet_data.reset_cursor()
-
-            if self.connection.options.compression_enabled:
-                decompressed_size = VarInt.read(packet_data)
-                if decompressed_size > 0:
-                    decompressor = zlib.decompressobj()
-                    decompressed_packet = decompressor.decompress(
-                                                       packet_data.read())
-                    assert len(decompressed_packet) == decompressed_size, \
-                        'decompressed length %d, but expected %d' % \
-                        (len(decompressed_packet), decompressed_size)
-                    packet_data.reset()
-                    packet_data.send(decompressed_packet)
-                    packet_data.reset_cursor()
-
-            packet_raw = copy.deepcopy(packet_data.bytes.getvalue())  # PCRC storing raw data
-            packet_id = VarInt.read(packet_data)
-
-            # If we know the structure of the packet, attempt to parse it
-            # otherwise, just return an instance of the base Packet class.
-            if packet_id in self.clientbound_packets:
-                packet = self.clientbound_packets[packet_id]()
-                packet.context = self.connection.context
+            # PCRC: read the frame once, joining only when the socket hands
+            # it out in several pieces
+            data = stream.read(length)
+            if len(data) < length:
+                chunks = [data]
+                remaining = length - len(data)
+                while remaining > 0:
+                    chunk = stream.read(remaining)
+                    if len(chunk) == 0:
+                        raise EOFError("Unexpected end of message.")
+                    chunks.append(chunk)
+                    remaining -= len(chunk)
+                data = b''.join(chunks)
+            return self.parse_frame(data)
+        else:
+            return None
+
+    def parse_frame(self, data):
+        # PCRC: build the packet from a frame (the bytes after the length
+        # prefix), shared with the asyncio transport
+        packet_data = packets.PacketBuffer(data)
+
+        if self.connection.options.compression_enabled:
+            decompressed_size = VarInt.read(packet_data)
+            if decompressed_size > 0:
+                data = zlib.decompress(
+                    memoryview(data)[packet_data.bytes.tell():])
+                assert len(data) == decompressed_size, \
+                    'decompressed length %d, but expected %d' % \
+                    (len(data), decompressed_size)
+                packet_data = packets.PacketBuffer(data)
+
+        # PCRC storing raw data (packet id + body) as a view of the frame
+        packet_raw = memoryview(data)[packet_data.bytes.tell():]
+        packet_id = VarInt.read(packet_data)
+
+        # If we know the structure of the packet, attempt to parse it
+        # otherwise, just return an instance of the base Packet class.
+        if packet_id in self.clientbound_packets:
+            packet = self.clientbound_packets[packet_id]()
+            packet.context = self.connection.context
+            if packet_id in self.eager_packet_ids:
                 packet.read(packet_data)
             else:
-                packet = packets.Packet()
-                packet.context = self.connection.context
-                packet.id = packet_id
-            packet.raw_data = packet_raw  # PCRC storing raw data
-            return packet
+                packet.defer_read(packet_data)
         else:
-            return None
+            packet = packets.Packet()
+            packet.context = self.connection.context
+            packet.id = packet_id
+        packet.raw_data = packet_raw  # PCRC storing raw data
+        return packet
 
     def react(self, packet):
         """Called with each incoming packet after early packet listeners are
@@ -745,7 +800,8 @@ class LoginReactor(PacketReactor):
 
         elif packet.packet_name == "login success":
             self.connection.reactor = PlayingReactor(self.connection)
-            self.connection.recorder.start_recording()
+            if self.connection.recorder is not None:  # PCRC
+                self.connection.recorder.start_recording()
 
         elif packet.packet_name == "set compression":
             self.connection.options.compression_threshold = packet.threshold
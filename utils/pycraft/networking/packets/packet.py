@@ -69,6 +69,25 @@ class Packet(object):
                 value = data_type.read_with_context(file_object, self.context)
                 setattr(self, var_name, value)
 
+    # PCRC: lazy decoding. Keep the unread body around and only parse it
+    # when one of its fields is accessed for the first time. The position of
+    # the body is kept too, so copies of the packet can each parse it
+    def defer_read(self, file_object):
+        self._deferred_read = (file_object, file_object.bytes.tell())
+
+    def __getattr__(self, name):
+        # Only called for missing attributes, e.g. the fields of a packet
+        # whose body has not been parsed yet. Special attributes probed by
+        # copy, pickle or hasattr must not trigger the parsing
+        if name.startswith('__') or name == '_deferred_read' or \
+                '_deferred_read' not in self.__dict__:
+            raise AttributeError('%r object has no attribute %r'
+                                 % (type(self).__name__, name))
+        file_object, position = self.__dict__.pop('_deferred_read')
+        file_object.bytes.seek(position)
+        self.read(file_object)
+        return getattr(self, name)
+
     # Writes a packet buffer to the socket with the appropriate headers
     # and compressing the data if necessary
     def _write_buffer(self, socket, packet_buffer, compression_threshold):
@@ -2,8 +2,10 @@ from io import BytesIO
 
 
 class PacketBuffer(object):
-    def __init__(self):
-        self.bytes = BytesIO()
+    def __init__(self, initial_bytes=b''):
+        # a bytes object passed here is shared with the BytesIO, not copied,
+        # until something is written into the buffer
+        self.bytes = BytesIO(initial_bytes)
 
     def send(self, value):
         """
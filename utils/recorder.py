@@ -3,7 +3,6 @@
 import copy
 import heapq
 import os
-import shutil
 import socket
 import threading
 import time
@@ -11,25 +10,28 @@ import json
 import traceback
 import datetime
 
-from . import config, utils, constant
-from .replay_file import ReplayFile
+from . import config, utils, constant, protocol
+from .replay_file import ReplayFile, RecordHeader
+from .replay_packager import ReplayPackager
 from .translation import Translation
 from .packet_processor import PacketProcessor
 from .logger import Logger
 from .pycraft import authentication
 from .pycraft.networking.connection import Connection
+from .pycraft.networking.async_connection import AsyncConnection
 from .pycraft.networking.packets import Packet as PycraftPacket, clientbound, serverbound
-from .SARC.packet import Packet as SARCPacket
 
 
 
 class Recorder:
 	socket_id = None
 
-	def __init__(self, config_file, translation_folder):
+	# translations and packager can be shared between recorders, see Supervisor
+	def __init__(self, config_file, translation_folder=None, translations=None, packager=None, name=None):
 
+		self.name = name
 		self.config = config.Config(config_file)
-		self.translations = Translation(translation_folder)
+		self.translations = translations if translations is not None else Translation(translation_folder)
 		self.working = False
 		self.online = False
 		self.stop_by_user = False  # set to true once PCRC is stopped by user; reset to false when PCRC starts
@@ -40,17 +42,26 @@ class Recorder:
 		self.file_name = None
 		self.mc_version = None
 		self.mc_protocol = None
-		self.logger = Logger(name='PCRC-Recorder', display_debug=self.config.get('debug_mode'))
+		self.logger = Logger(name='PCRC-Recorder' if name is None else 'PCRC-{}'.format(name), display_debug=self.config.get('debug_mode'))
 		self.print_config()
-
+		if packager is None:
+			packager_logger = copy.deepcopy(self.logger)
+			packager_logger.thread = 'Packager'
+			packager = ReplayPackager(packager_logger)
+			packager.start()
+		self.packager = packager
+		self.submitted_file_paths = set()  # the segments of this recorder given to the packager
+
+		connection_class = AsyncConnection if self.config.get('asyncio_networking') else Connection
 		if not self.config.get('online_mode'):
 			self.logger.log("Login in offline mode")
-			self.connection = Connection(self.config.get('address'), self.config.get('port'),
+			self.connection = connection_class(self.config.get('address'), self.config.get('port'),
 				username=self.config.get('username'),
 				recorder=self,
 				initial_version=self.config.get('initial_version'),
 				allowed_versions=constant.ALLOWED_VERSIONS,
-				handle_exception=self.onConnectionException
+				handle_exception=self.onConnectionException,
+				lazy_decoding=True
 			)
 		else:
 			self.logger.log("Login in online mode")
@@ -58,12 +69,13 @@ class Recorder:
 			auth_token.authenticate(self.config.get('username'), self.config.get('password'))
 			self.logger.log("Logged in as %s" % auth_token.profile.name)
 			self.config.set_value('username', auth_token.profile.name)
-			self.connection = Connection(self.config.get('address'), self.config.get('port'),
+			self.connection = connection_class(self.config.get('address'), self.config.get('port'),
 				auth_token=auth_token,
 				recorder=self,
 				initial_version=self.config.get('initial_version'),
 				allowed_versions=constant.ALLOWED_VERSIONS,
-				handle_exception=self.onConnectionException
+				handle_exception=self.onConnectionException,
+				lazy_decoding=True
 			)
 
 		self.connection.register_packet_listener(self.onPacketReceived, PycraftPacket)
@@ -73,7 +85,9 @@ class Recorder:
 		self.connection.register_packet_listener(self.onChatMessage, clientbound.play.ChatMessagePacket)
 		self.connection.register_packet_listener(self.onPlayerPositionAndLook, clientbound.play.PlayerPositionAndLookPacket)
 
-		self.protocolMap = {}
+		self.protocol_table = None
+		self.packet_processor = None
+		self.world_state = None
 		self.logger.log('init finish')
 
 	def translation(self, text):
@@ -101,11 +115,11 @@ class Recorder:
 
 	def onPacketSent(self, packet):
 		if hasattr(packet, 'raw_data'):
-			self.logger.debug('<- {}'.format(packet.raw_data))
+			self.logger.debug('<- {}', packet.raw_data)
 
 	def onPacketReceived(self, packet):
 		if hasattr(packet, 'raw_data'):
-			# self.logger.debug('-> {}'.format(packet.raw_data))
+			# self.logger.debug('-> {}', packet.raw_data)
 			pass
 		self.processPacketData(packet)
 
@@ -123,7 +137,7 @@ class Recorder:
 
 	def onChatMessage(self, packet):
 		js = json.loads(packet.json_data)
-		self.logger.debug('Message json data = {}'.format(packet.json_data))
+		self.logger.debug('Message json data = {}', packet.json_data)
 		try:
 			translate = js['translate']
 			msg = js['with'][-1]
@@ -158,7 +172,7 @@ class Recorder:
 				message = packet.json_data
 			self.logger.log(message, do_print=False)
 		except:
-			self.logger.debug('Cannot resolve chat json data: {}'.format(packet.json_data))
+			self.logger.debug('Cannot resolve chat json data: {}', packet.json_data)
 			self.logger.debug(traceback.format_exc())
 			pass
 
@@ -219,19 +233,27 @@ class Recorder:
 	def time_recorded_limit(self):
 		return self.config.get('time_recorded_limit_hour') * constant.MilliSecondPerHour
 
+	def record(self, packet_id, packet_name, packet_recorded):
+		is_important = packet_id in self.protocol_table.important_packet_ids
+		if not self.isAFKing() or is_important or self.config.get('record_packets_when_afk'):
+			self.write(self.timeRecorded(), packet_recorded)
+			self.packet_counter += 1
+			if self.isAFKing() and is_important:
+				self.logger.debug('PCRC is afking but {} is an important packet so PCRC recorded it', packet_name)
+			else:
+				self.logger.debug('{} packet recorded', packet_name)
+		else:
+			self.packet_processor.discard(packet_id, packet_recorded)
+			self.logger.debug('{} packet ignore due to being afk', packet_name)
+
 	def processPacketData(self, packet_raw):
 		if not self.is_working():
 			return
-		bytes = packet_raw.raw_data
-		if bytes[0] == 0x00:
-			bytes = bytes[1:]
+		data = packet_raw.raw_data
 		t = utils.getMilliTime()
-		packet_length = len(bytes)
 
-		packet = SARCPacket()
-		packet.receive(bytes)
-		packet_id, packet_name = self.packet_processor.analyze(packet)
-		packet_recorded = self.packet_processor.process(packet)
+		packet_id, packet_name = self.packet_processor.analyze(data)
+		packet_recorded = self.packet_processor.process(data)
 
 		# Increase afk timer when recording stopped, afk timer prevents afk time in replays
 		if self.config.get('with_player_only'):
@@ -246,32 +268,35 @@ class Recorder:
 
 		# Recording
 		if self.is_working() and packet_recorded is not None:
-			if not self.isAFKing() or packet_name in constant.IMPORTANT_PACKETS or self.config.get('record_packets_when_afk'):
-				bytes_recorded = packet_recorded.read(packet_recorded.remaining())
-				data = self.timeRecorded().to_bytes(4, byteorder='big', signed=True)
-				data += len(bytes_recorded).to_bytes(4, byteorder='big', signed=True)
-				data += bytes_recorded
-				self.write(data)
-				self.packet_counter += 1
-				if self.isAFKing() and packet_name in constant.IMPORTANT_PACKETS:
-					self.logger.debug('PCRC is afking but {} is an important packet so PCRC recorded it'.format(packet_name))
-				else:
-					self.logger.debug('{} packet recorded'.format(packet_name))
-			else:
-				self.logger.debug('{} packet ignore due to being afk'.format(packet_name))
+			self.record(packet_id, packet_name, packet_recorded)
 		else:
-			self.logger.debug('{} packet ignore'.format(packet_name))
+			self.logger.debug('{} packet ignore', packet_name)
 			pass
+		if self.is_working() and self.packet_processor.movement_coalescer.has_pending():
+			for data in self.packet_processor.collect_movements():
+				self.record(*self.packet_processor.analyze(data), data)
 
 		if self.is_working() and self.replay_file.size() > self.file_size_limit():
-			self.logger.log('tmcpr file size limit {}MB reached! Restarting'.format(utils.convert_file_size_MB(self.file_size_limit())))
-			self.chat(self.translation('OnReachFileSizeLimit').format(utils.convert_file_size_MB(self.file_size_limit())))
-			self.restart()
+			self.logger.log('tmcpr file size limit {}MB reached!'.format(utils.convert_file_size_MB(self.file_size_limit())))
+			if self.config.get('seamless_rotation'):
+				self.chat(self.translation('OnReachFileSizeLimitNewSegment').format(utils.convert_file_size_MB(self.file_size_limit())))
+				self.rotate_segment()
+			else:
+				self.chat(self.translation('OnReachFileSizeLimit').format(utils.convert_file_size_MB(self.file_size_limit())))
+				self.restart()
 
 		if self.is_working() and self.timeRecorded(t) > self.time_recorded_limit():
 			self.logger.log('{} actual recording time reached!'.format(utils.convert_millis(self.time_recorded_limit())))
-			self.chat(self.translation('OnReachTimeLimit').format(utils.convert_millis(self.time_recorded_limit())))
-			self.restart()
+			if self.config.get('seamless_rotation'):
+				self.chat(self.translation('OnReachTimeLimitNewSegment').format(utils.convert_millis(self.time_recorded_limit())))
+				self.rotate_segment()
+			else:
+				self.chat(self.translation('OnReachTimeLimit').format(utils.convert_millis(self.time_recorded_limit())))
+				self.restart()
+
+		# the checkpoint keeps the meta data on disk up to date in case PCRC crashes, see ReplayPackager.recover
+		if self.is_working() and t - self.last_checkpoint_time >= constant.CheckpointInterval:
+			self.checkpoint(t)
 
 		def get_showinfo_time():
 			return int(self.timePassed(t) / (5 * 60 * 1000))
@@ -280,9 +305,10 @@ class Recorder:
 		if get_showinfo_time()!= self.last_showinfo_time or self.packet_counter - self.last_showinfo_packetcounter >= 100000:
 			self.last_showinfo_time = get_showinfo_time()
 			self.last_showinfo_packetcounter = self.packet_counter
-			self.logger.log('Recorded/Passed: {}/{}; Packet count: {}'.format(
-				utils.convert_millis(self.timeRecorded(t)), utils.convert_millis(self.timePassed(t)), self.packet_counter)
-			)
+			self.logger.log('Recorded/Passed: {}/{}; Packet count: {}; Tracked entities: {}'.format(
+				utils.convert_millis(self.timeRecorded(t)), utils.convert_millis(self.timePassed(t)), self.packet_counter,
+				self.packet_processor.entity_tracker.format_counts()
+			))
 
 	def flush(self):
 		if len(self.file_buffer) == 0:
@@ -293,7 +319,9 @@ class Recorder:
 		))
 		self.file_buffer = bytearray()
 
-	def write(self, data):
+	def write(self, time_stamp, data):
+		self.replay_file.indexer.on_record(time_stamp, self.replay_file.size() + len(self.file_buffer))
+		self.file_buffer += RecordHeader.pack(time_stamp, len(data))
 		self.file_buffer += data
 		if len(self.file_buffer) > self.file_buffer_size():
 			self.flush()
@@ -317,7 +345,8 @@ class Recorder:
 	def start_recording(self):
 		assert self.mc_protocol is not None and self.mc_version is not None
 		self.logger.log('Connected to the server, start recording')
-		self.packet_processor = PacketProcessor(self, self.mc_version)
+		self.packet_processor = PacketProcessor(self, self.mc_version, self.protocol_table)
+		self.world_state = self.packet_processor.world_state
 		self.on_recording_start()
 
 	# called when there's only 1 protocol version in allowed_proto_versions in pycraft connection
@@ -325,32 +354,98 @@ class Recorder:
 		self.mc_protocol = protocol_version
 		self.mc_version = constant.Map_ProtocolToVersion[protocol_version]
 		self.logger.log('Connecting using protocol version {}, mc version = {}'.format(self.mc_protocol, self.mc_version))
-		# as a MCDR plugin
-		with open(utils.get_path('protocol.json'), 'r') as f:
-			self.protocolMap = json.load(f)[str(protocol_version)]['Clientbound']
+		self.protocol_table = protocol.get_table(protocol_version)
 
 	# initializing stuffs
 	def on_recording_start(self):
 		self.working = True
-		self.start_time = utils.getMilliTime()
-		self.last_player_movement = self.start_time
-		self.afk_time = 0
-		self.last_t = 0
+		self.last_player_movement = utils.getMilliTime()
 		self.last_no_player_movement = False
-		self.player_uuids = []
-		self.file_buffer = bytearray()
-		self.last_showinfo_time = 0
-		self.packet_counter = 0
-		self.last_showinfo_packetcounter = 0
 		self.file_thread = None
-		self.replay_file = ReplayFile(path=constant.RecordingFilePath)
+		self.start_segment()
 		self.pos = None
 		if self.chat_thread is not None:
 			self.chat_thread.kill()
 		self.chat_thread = ChatThread(self)
 		self.chat_thread.start()
-		if 'Time Update' in constant.BAD_PACKETS:
-			constant.BAD_PACKETS.remove('Time Update')
+
+	# A segment is what goes into a single .mcpr file
+	# With seamless_rotation a connection is split into segments without reconnecting
+	def start_segment(self):
+		self.start_time = utils.getMilliTime()
+		self.afk_time = 0
+		self.last_t = self.start_time
+		self.player_uuids = set(self.world_state.player_uuids())
+		self.file_buffer = bytearray()
+		self.last_showinfo_time = 0
+		self.packet_counter = 0
+		self.last_showinfo_packetcounter = 0
+		writer_logger = copy.deepcopy(self.logger)
+		writer_logger.thread = 'Writer'
+		self.replay_file = ReplayFile(
+			writer_logger, path=self.new_recording_path(),
+			queue_size=self.config.get('file_writer_queue_size'), fsync_interval=self.config.get('fsync_interval_second')
+		)
+		# the world the client already knows, so the segment can be played without the previous ones
+		# it's kept within half of the file size limit, or the seed alone would fill up the new segment
+		self.world_state.set_byte_budget(min(self.config.get('world_cache_size_mb') * constant.BytePerMB, self.file_size_limit() // 2))
+		seed_packets = self.world_state.seed_packets()
+		for data in seed_packets:
+			self.write(0, data)
+			self.packet_counter += 1
+		if len(seed_packets) > 0:
+			self.logger.log('New segment seeded with {} packets: {}'.format(len(seed_packets), self.world_state.format_counts()))
+		self.packet_processor.chunk_deduplicator.retain(self.world_state.chunks.keys())  # the chunks the new segment has
+		self.packet_processor.update_elider.clear()  # the seed might not have the latest values
+		self.checkpoint(self.start_time)
+
+	def checkpoint(self, t):
+		self.last_checkpoint_time = t
+		self.update_meta_data()
+
+	# what the redundant packet filters saved since connected
+	def log_savings(self, logger):
+		if self.packet_processor is None:
+			return
+		deduplicator = self.packet_processor.chunk_deduplicator
+		if deduplicator.dropped_count > 0:
+			logger.log('Re-sent chunks dropped: {}, {}MB saved'.format(deduplicator.dropped_count, utils.convert_file_size_MB(deduplicator.saved_bytes)))
+		elider = self.packet_processor.update_elider
+		if elider.elided_count > 0:
+			logger.log('Redundant updates elided: {}'.format(elider.format_report()))
+		coalescer = self.packet_processor.movement_coalescer
+		if coalescer.held_count > 0:
+			logger.log('Entity movements coalesced: {} held back, {} emitted, {}MB saved'.format(
+				coalescer.held_count, coalescer.emitted_count, utils.convert_file_size_MB(coalescer.saved_bytes)
+			))
+		interest_filter = self.packet_processor.interest_filter
+		if interest_filter.dropped_count > 0:
+			logger.log('Packets far from players dropped: {}, {}MB saved'.format(interest_filter.dropped_count, utils.convert_file_size_MB(interest_filter.dropped_bytes)))
+
+	def rotate_segment(self):
+		self.logger.log('Continue recording in a new segment')
+		self.flush()
+		self.logger.log('Time recorded/passed: {}/{}'.format(utils.convert_millis(self.timeRecorded()), utils.convert_millis(self.timePassed())))
+		self.log_savings(self.logger)
+		file_name, file_path = self.decide_file_path(self.logger)
+		self.update_meta_data()
+		self.submitted_file_paths.add(file_path)
+		self.packager.submit(self.replay_file, file_path, self.config.get('mcpr_compression_level'), self.on_segment_packaged)
+		self.start_segment()
+
+	def on_segment_packaged(self, file_name):
+		if self.is_online():
+			self.chat(self.translation('OnCreatedMCPRFile').format(file_name), priority=ChatThread.Priority.High)
+
+	# every segment has its own working directory since the previous ones might still be being packaged
+	def new_recording_path(self):
+		path_raw = constant.RecordingFilePath + self.file_name_prefix() + datetime.datetime.today().strftime('%Y_%m_%d_%H_%M_%S')
+		path = path_raw
+		counter = 2
+		while os.path.exists(path):
+			path = f'{path_raw}_{counter}'
+			counter += 1
+		return path + '/'
 
 	def stop(self, restart=False, by_user=False):
 		self.logger.log('Stopping PCRC, restart = {}, by_user = {}'.format(restart, by_user))
@@ -368,8 +463,7 @@ class Recorder:
 	def createReplayFile(self, restart):
 		if self.file_thread is not None:
 			return
-		self.file_thread = threading.Thread(target=self._createReplayFile, args=(restart, ))
-		self.file_thread.setDaemon(True)
+		self.file_thread = threading.Thread(target=self._createReplayFile, args=(restart, ), daemon=True)
 		self.file_thread.start()
 
 	def _createReplayFile(self, restart):
@@ -398,43 +492,57 @@ class Recorder:
 			logger.warn('Size of "recording.tmcpr" too small ({}KB < {}KB), abort creating replay file'.format(
 				utils.convert_file_size_KB(self.replay_file.size()), utils.convert_file_size_KB(constant.MinimumLegalFileSize)
 			))
+			self.replay_file.discard()
 			return
 
 		# Creating .mcpr zipfile based on timestamp
 		logger.log('Time recorded/passed: {}/{}'.format(utils.convert_millis(self.timeRecorded()), utils.convert_millis(self.timePassed())))
+		self.log_savings(logger)
+
+		file_name, file_path = self.decide_file_path(logger)
 
-		# Deciding file name
+		if self.is_online():
+			self.chat(self.translation('OnCreatingMCPRFile'))
+
+		self.update_meta_data()
+		self.submitted_file_paths.add(file_path)
+		self.packager.submit(self.replay_file, file_path, self.config.get('mcpr_compression_level'))
+		self.packager.wait([file_path])
+		if os.path.isfile(file_path) and self.is_online():
+			self.chat(self.translation('OnCreatedMCPRFile').format(file_name), priority=ChatThread.Priority.High)
+
+	# recorders in the same process must not pick the same names
+	def file_name_prefix(self):
+		return '' if self.name is None else self.name + '_'
+
+	def decide_file_path(self, logger):
 		if not os.path.exists(constant.RecordingStorageFolder):
 			os.makedirs(constant.RecordingStorageFolder)
-		file_name_raw = datetime.datetime.today().strftime('PCRC_%Y_%m_%d_%H_%M_%S')
+		file_name_raw = 'PCRC_' + self.file_name_prefix() + datetime.datetime.today().strftime('%Y_%m_%d_%H_%M_%S')
 		if self.file_name is not None:
 			file_name_raw = self.file_name
+
+		def is_taken(file_name):
+			file_path = f'{constant.RecordingStorageFolder}{file_name}'
+			return os.path.isfile(file_path) or os.path.isfile(file_path + '.part') or self.packager.is_pending(file_path)
+
 		file_name = file_name_raw + '.mcpr'
 		counter = 2
-		while os.path.isfile(f'{constant.RecordingStorageFolder}{file_name}'):
+		while is_taken(file_name):
 			file_name = f'{file_name_raw}_{counter}.mcpr'
 			counter += 1
 		logger.log('File name is set to "{}"'.format(file_name))
+		return file_name, f'{constant.RecordingStorageFolder}{file_name}'
 
-		logger.log('Creating "{}"'.format(file_name))
-		if self.is_online():
-			self.chat(self.translation('OnCreatingMCPRFile'))
-
+	def update_meta_data(self):
 		self.replay_file.set_meta_data(utils.get_meta_data(
 			server_name=self.config.get('server_name'),
 			duration=self.timeRecorded(),
 			date=utils.getMilliTime(),
 			mcversion=self.mc_version,
 			protocol=self.mc_protocol,
-			player_uuids=self.player_uuids
+			player_uuids=list(self.player_uuids)
 		))
-		self.replay_file.create(file_name)
-
-		logger.log('Size of replay file "{}": {}MB'.format(file_name, utils.convert_file_size_MB(os.path.getsize(file_name))))
-		file_path = f'{constant.RecordingStorageFolder}{file_name}'
-		shutil.move(file_name, file_path)
-		if self.is_online():
-			self.chat(self.translation('OnCreatedMCPRFile').format(file_name), priority=ChatThread.Priority.High)
 
 	def on_final_stop(self, logger, restart):
 		logger.log('File operations finished, disconnect now')
@@ -446,9 +554,16 @@ class Recorder:
 				self.connection.disconnect(immediate=True)
 			except Exception as e:
 				logger.warn('Fail to immediately disconnect: {}'.format(e))
+		pending_file_paths = [file_path for file_path in self.submitted_file_paths if self.packager.is_pending(file_path)]
+		if not restart and len(pending_file_paths) > 0:
+			logger.log('Waiting for {} segment(s) being packaged'.format(len(pending_file_paths)))
+			self.packager.wait(pending_file_paths)
+		self.submitted_file_paths.clear()
 		self.file_thread = None
 		self.mc_version = None
 		self.mc_protocol = None
+		if self.replay_file is not None:
+			self.replay_file.close()
 		self.replay_file = None
 		if self.chat_thread is not None:
 			self.chat_thread.kill()
@@ -513,11 +628,18 @@ class Recorder:
 			self.logger.warn('Cannot send spectate when disconnected')
 
 	def format_status(self, text):
+		writer = self.replay_file.writer
 		return text.format(
 			self.is_working(), self.is_working() and not self.isAFKing(),
 			utils.convert_millis(self.timeRecorded()), utils.convert_millis(self.timePassed()),
 			self.packet_counter, utils.convert_file_size_MB(len(self.file_buffer)), utils.convert_file_size_MB(self.replay_file.size()),
-			self.file_name
+			self.file_name,
+			writer.queue_depth, utils.convert_file_size_MB(writer.bytes_pending),
+			round(writer.last_write_latency * 1000), round(writer.max_write_latency * 1000),
+			self.packet_processor.chunk_deduplicator.dropped_count, utils.convert_file_size_MB(self.packet_processor.chunk_deduplicator.saved_bytes),
+			self.packet_processor.update_elider.elided_count, utils.convert_file_size_MB(self.packet_processor.update_elider.elided_bytes),
+			self.packet_processor.movement_coalescer.held_count, utils.convert_file_size_MB(self.packet_processor.movement_coalescer.saved_bytes),
+			self.packet_processor.interest_filter.dropped_count, utils.convert_file_size_MB(self.packet_processor.interest_filter.dropped_bytes)
 		)
 
 	def set_config(self, option, value, forced=False):
@@ -527,6 +649,8 @@ class Recorder:
 		self.chat(self.translation('OnOptionSet').format(option, value))
 		self.config.set_value(option, value)
 		self.logger.log('Option <{}> set to <{}>'.format(option, value))
+		if self.packet_processor is not None:
+			self.packet_processor.register_stages()
 
 	def print_markers(self):
 		if len(self.replay_file.markers) == 0:
@@ -632,19 +756,51 @@ class ChatThread(threading.Thread):
 		def __lt__(self, other):
 			return self.priority < other.priority or (self.priority == other.priority and self.id < other.id)
 
+	class TokenBucket:
+		"""
+		Vanilla server adds 20 to a player's spam counter for every chat message, subtracts 1 from it every tick,
+		and kicks the player when it exceeds 200. Here it's modeled as a bucket that refills 20 tokens per second
+		"""
+		def __init__(self, capacity, refill_rate):
+			self.capacity = capacity
+			self.refill_rate = refill_rate  # token per second
+			self.tokens = capacity
+			self.last_refill_time = time.monotonic()
+
+		def refill(self):
+			now = time.monotonic()
+			self.tokens = min(self.capacity, self.tokens + (now - self.last_refill_time) * self.refill_rate)
+			self.last_refill_time = now
+
+		# the bucket might go below zero when messages are sent regardless of it
+		def consume(self, amount):
+			self.refill()
+			self.tokens -= amount
+
+		# in second, how long until there are enough tokens
+		def wait_time(self, amount):
+			self.refill()
+			return max(0.0, (amount - self.tokens) / self.refill_rate)
+
+	MessageCost = 20
+	# vanilla threshold is 200 but I set it to 180 for safety
+	SpamThreshold = 180
+
 	def __init__(self, recorder):
-		super().__init__()
-		self.setDaemon(True)
+		super().__init__(daemon=True)
 		self.recorder = recorder
-		self.clear_queue()
+		self.condition = threading.Condition()
+		self.message_queue = []
 		self.logger = copy.deepcopy(recorder.logger)
 		self.logger.thread = 'Chat'
 		self.interrupt = False
-		self.chatSpamThresholdCount = 0
+		self.token_bucket = ChatThread.TokenBucket(ChatThread.SpamThreshold - ChatThread.MessageCost, ChatThread.MessageCost)
 
 	def add_chat(self, msg, prio=Priority.Normal):
-		self.logger.debug('Added chat "{}" with priority {} to queue'.format(msg, prio))
-		heapq.heappush(self.message_queue, ChatThread.QueueData(prio, msg))
+		self.logger.debug('Added chat "{}" with priority {} to queue', msg, prio)
+		with self.condition:
+			heapq.heappush(self.message_queue, ChatThread.QueueData(prio, msg))
+			self.condition.notify()
 
 	def send_chat(self, queue_data):
 		msg = queue_data.data
@@ -652,35 +808,49 @@ class ChatThread(threading.Thread):
 		packet.message = msg
 		self.recorder.connection.write_packet(packet)
 		self.logger.log('Sent chat message "{}" to the server'.format(msg))
-		self.chatSpamThresholdCount += 20
+		with self.condition:
+			self.token_bucket.consume(ChatThread.MessageCost)
 
 	def clear_queue(self):
-		self.message_queue = []
+		with self.condition:
+			self.message_queue = []
 
 	def kill(self):
-		self.interrupt = True
-		self.clear_queue()
+		with self.condition:
+			self.interrupt = True
+			self.message_queue = []
+			self.condition.notify()
 
 	# instant send all chat with priority <= p
 	def flush_pending_chat(self, p=Priority.Low):
-		while len(self.message_queue) > 0 and self.message_queue[0].priority <= p:
-			self.send_chat(heapq.heappop(self.message_queue))
-
-	def on_recieved_TimeUpdatePacket(self):
-		self.chatSpamThresholdCount -= 20  # 20 gt passed
-		if self.chatSpamThresholdCount < 0:
-			self.chatSpamThresholdCount = 0
-
-	def can_chat(self):
-		# vanilla threshold is 200 but I set it to 180 for safety
-		return not self.recorder.config.get('chat_spam_protect') or self.chatSpamThresholdCount + 20 < 180
-
+		pending = []
+		with self.condition:
+			while len(self.message_queue) > 0 and self.message_queue[0].priority <= p:
+				pending.append(heapq.heappop(self.message_queue))
+		for queue_data in pending:
+			self.send_chat(queue_data)
+
+	# in second, how long to wait until the next message can be sent
+	def chat_wait_time(self):
+		if not self.recorder.config.get('chat_spam_protect'):
+			return 0
+		return self.token_bucket.wait_time(ChatThread.MessageCost)
+
+	# Sleeps until there's a message and it can be sent without being kicked for spamming
 	def run(self):
 		self.logger.log('Chat thread started')
-		while not self.interrupt:
-			if self.can_chat():
-				if len(self.message_queue) > 0:
-					self.send_chat(heapq.heappop(self.message_queue))
-			time.sleep(0.001)
+		while True:
+			with self.condition:
+				while not self.interrupt:
+					if len(self.message_queue) == 0:
+						self.condition.wait()
+						continue
+					wait_time = self.chat_wait_time()
+					if wait_time <= 0:
+						break
+					self.condition.wait(wait_time)
+				if self.interrupt:
+					break
+				queue_data = heapq.heappop(self.message_queue)
+			self.send_chat(queue_data)
 		self.logger.log('Chat thread stopped')
-
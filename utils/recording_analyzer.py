@@ -0,0 +1,234 @@
+# coding: utf8
+
+import collections
+import concurrent.futures
+import csv
+import json
+import multiprocessing
+import os
+import struct
+import zipfile
+
+from . import protocol
+from .protocol import PacketType
+from .replay_file import RecordHeader, RecordingReader
+from .SARC.packet import read_varint
+
+
+def _add(histogram, key, count, size):
+	entry = histogram.get(key)
+	if entry is None:
+		histogram[key] = [count, size]
+	else:
+		entry[0] += count
+		entry[1] += size
+
+
+class ChunkStats:
+	"""
+	Histograms of a record-aligned chunk of recording.tmcpr
+	Entity packets whose entities are spawned in an earlier chunk are kept by entity id, they are resolved when the chunks are merged in order
+	"""
+	def __init__(self):
+		self.count = 0
+		self.size = 0
+		self.last_time = 0
+		self.packets = {}  # packet id -> [count, bytes]
+		self.entities = {}  # entity type -> [count, bytes]
+		self.buckets = {}  # time bucket index -> [count, bytes]
+		self.unresolved = {}  # entity id -> [count, bytes]
+		self.spawned = {}  # entity id -> entity type, of entities spawned in the chunk
+		self.destroyed = set()  # entity ids destroyed in the chunk and not spawned again
+
+
+# runs in a worker process
+def scan_chunk(data, protocol_version, bucket_size):
+	table = protocol.get_table(protocol_version)
+	types = table.types
+	type_count = len(types)
+	object_type_is_byte = protocol_version < 477  # Spawn Object of 1.12 - 1.13
+	stats = ChunkStats()
+	packets, entities, buckets, unresolved, spawned, destroyed = stats.packets, stats.entities, stats.buckets, stats.unresolved, stats.spawned, stats.destroyed
+	unpack_header = RecordHeader.unpack_from
+	header_size = RecordHeader.size
+	offset = 0
+	end = len(data)
+	time_stamp = 0
+	while offset + header_size <= end:
+		time_stamp, length = unpack_header(data, offset)
+		start = offset + header_size
+		if length < 0 or start + length > end:
+			break
+		offset = start + length
+		size = header_size + length
+		stats.count += 1
+		stats.size += size
+		_add(buckets, time_stamp // bucket_size, 1, size)
+		if length == 0:
+			_add(packets, -1, 1, size)
+			continue
+		try:
+			packet_id, position = read_varint(data, start)
+			_add(packets, packet_id, 1, size)
+			packet_type = types[packet_id] if packet_id < type_count else PacketType.Other
+			if packet_type == PacketType.Entity:
+				entity_id = table.read_entity_id(packet_id, data, position)[0]
+				entity_type = spawned.get(entity_id)
+				if entity_type is None:
+					_add(unresolved, entity_id, 1, size)
+				else:
+					_add(entities, entity_type, 1, size)
+			elif packet_type == PacketType.SpawnPlayer or packet_type == PacketType.SpawnObject or packet_type == PacketType.SpawnMob:
+				entity_id, position = read_varint(data, position)
+				if packet_type == PacketType.SpawnPlayer:
+					entity_type = 'Player'
+				else:
+					position += 16  # uuid
+					if packet_type == PacketType.SpawnObject and object_type_is_byte:
+						entity_type = 'Obj' + str(data[position])
+					else:
+						entity_type = ('Mob' if packet_type == PacketType.SpawnMob else 'Obj') + str(read_varint(data, position)[0])
+				spawned[entity_id] = entity_type
+				destroyed.discard(entity_id)
+				_add(entities, entity_type, 1, size)
+			elif packet_type == PacketType.DestroyEntities:
+				amount, position = read_varint(data, position)
+				for i in range(amount):
+					entity_id, position = read_varint(data, position)
+					spawned.pop(entity_id, None)
+					destroyed.add(entity_id)
+		except (IndexError, IOError, struct.error):
+			pass  # malformed packet, it's counted by its id only
+	stats.last_time = time_stamp
+	return stats
+
+
+# Yields record-aligned chunks of about chunk_size bytes read from a recording.tmcpr file object
+# The index entries are used as cut points, the part not covered by the index is cut by walking the record headers
+def split_recording(file, index_entries=(), chunk_size=16 * 1024 * 1024):
+	position = 0
+	for time_stamp, offset, ordinal in index_entries:
+		if offset - position >= chunk_size:
+			data = file.read(offset - position)
+			position += len(data)
+			if len(data) > 0:
+				yield data
+			if position != offset:  # the recording is shorter than its index says
+				return
+	buffer = b''
+	while True:
+		data = file.read(chunk_size)
+		if len(data) == 0:
+			break
+		buffer = buffer + data if len(buffer) > 0 else data
+		cut = 0
+		while cut + RecordHeader.size <= len(buffer):
+			length = RecordHeader.unpack_from(buffer, cut)[1]
+			if length < 0 or cut + RecordHeader.size + length > len(buffer):
+				break
+			cut += RecordHeader.size + length
+		if cut > 0:
+			yield buffer[:cut]
+			buffer = buffer[cut:]
+	if len(buffer) > 0:
+		yield buffer  # an incomplete record, or garbage, scan_chunk stops at it
+
+
+def read_meta_data(file_name):
+	if zipfile.is_zipfile(file_name):
+		with zipfile.ZipFile(file_name) as zipf:
+			return json.loads(zipf.read('metaData.json'))
+	path = file_name if os.path.isdir(file_name) else os.path.dirname(os.path.abspath(file_name))
+	meta_data_file = os.path.join(path, 'metaData.json')
+	if os.path.isfile(meta_data_file):
+		with open(meta_data_file) as f:
+			return json.load(f)
+	return {}
+
+
+class RecordingAnalyzer:
+	"""
+	Finds out what takes the space in a recording: bytes and counts per packet type, per entity type and per time bucket
+	recording.tmcpr is cut into record-aligned chunks that are scanned in a process pool, the main process only inflates and cuts the data
+	"""
+	ChunkSize = 16 * 1024 * 1024
+	DefaultBucketSize = 60 * 1000  # in ms
+
+	def __init__(self, worker_count=None, bucket_size=DefaultBucketSize, log=print):
+		self.worker_count = max(1, worker_count if worker_count is not None else os.cpu_count() or 1)
+		self.bucket_size = bucket_size
+		self.log = log
+
+	# protocol_version is needed for a .tmcpr file without metaData.json beside it
+	def analyze(self, file_name, protocol_version=None):
+		if protocol_version is None:
+			protocol_version = read_meta_data(file_name).get('protocol')
+			if protocol_version is None:
+				raise ValueError('Protocol version of "{}" is unknown'.format(file_name))
+		table = protocol.get_table(protocol_version)
+		result = ChunkStats()
+		entity_types = {}  # entity id -> entity type, of the entities alive at the end of the merged chunks
+		chunk_count = 0
+
+		def merge(stats):
+			for entity_id, (count, size) in stats.unresolved.items():
+				_add(result.entities, entity_types.get(entity_id, '?'), count, size)
+			entity_types.update(stats.spawned)
+			for entity_id in stats.destroyed:
+				if entity_id not in stats.spawned:
+					entity_types.pop(entity_id, None)
+			for histogram, chunk_histogram in ((result.packets, stats.packets), (result.entities, stats.entities), (result.buckets, stats.buckets)):
+				for key, (count, size) in chunk_histogram.items():
+					_add(histogram, key, count, size)
+			result.count += stats.count
+			result.size += stats.size
+			if stats.count > 0:
+				result.last_time = stats.last_time
+
+		mp_context = multiprocessing.get_context('spawn')
+		with RecordingReader.open(file_name) as reader, \
+				concurrent.futures.ProcessPoolExecutor(max_workers=self.worker_count, mp_context=mp_context) as executor:
+			futures = collections.deque()
+			for data in split_recording(reader.file, reader.index_entries, self.ChunkSize):
+				futures.append(executor.submit(scan_chunk, data, protocol_version, self.bucket_size))
+				chunk_count += 1
+				while len(futures) >= self.worker_count * 2:  # bounds the memory used by the chunks in flight
+					merge(futures.popleft().result())
+			while len(futures) > 0:
+				merge(futures.popleft().result())
+		self.log('Scanned {} chunks of "{}" with {} workers'.format(chunk_count, file_name, self.worker_count))
+
+		def entries(histogram, key_name, get_key=lambda key: key):
+			return [
+				{key_name: get_key(key), 'count': count, 'bytes': size}
+				for key, (count, size) in sorted(histogram.items(), key=lambda item: item[1][1], reverse=True)
+			]
+		return {
+			'file': os.path.basename(os.path.abspath(file_name)),
+			'protocol': protocol_version,
+			'packets': result.count,
+			'bytes': result.size,
+			'duration': result.last_time,
+			'bucket_size': self.bucket_size,
+			'packet_types': entries(result.packets, 'name', lambda packet_id: table.get_name(packet_id) if packet_id >= 0 else 'empty'),
+			'entity_types': entries(result.entities, 'type'),
+			'time_buckets': [
+				{'start': bucket * self.bucket_size, 'count': count, 'bytes': size}
+				for bucket, (count, size) in sorted(result.buckets.items())
+			],
+		}
+
+
+# The report is saved as a csv file of category, key, count, bytes rows if the file name ends with .csv, as json otherwise
+def save_report(report, file_name):
+	if file_name.lower().endswith('.csv'):
+		with open(file_name, 'w', newline='', encoding='utf8') as f:
+			writer = csv.writer(f)
+			writer.writerow(['category', 'key', 'count', 'bytes'])
+			writer.writerow(['total', report['file'], report['packets'], report['bytes']])
+			for category, key_name in (('packet_types', 'name'), ('entity_types', 'type'), ('time_buckets', 'start')):
+				for entry in report[category]:
+					writer.writerow([category, entry[key_name], entry['count'], entry['bytes']])
+	else:
+		with open(file_name, 'w', encoding='utf8') as f:
+			json.dump(report, f, indent=4)
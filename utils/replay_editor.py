@@ -0,0 +1,447 @@
+# coding: utf8
+
+import json
+import os
+import shutil
+import zipfile
+import zlib
+
+from . import constant, protocol
+from .replay_file import RecordHeader, RecordingReader, RecordingIndexer, IndexFileName
+from .SARC.packet import Packet as SARCPacket, read_varint
+
+
+class Stage:
+	"""
+	A step of the editing pipeline, every record goes through the stages of the chain one by one in a single pass over recording.tmcpr
+	A record is a tuple of (time stamp, packet id, packet data)
+	"""
+	name = None  # in the command line
+	description = ''
+
+	def __init__(self):
+		self.protocol_table = None
+		self.packet_ids = None  # the stage only sees records of these packets if it's not None, others are passed on as they are
+
+	def setup(self, protocol_table, meta_data):
+		self.protocol_table = protocol_table
+
+	# Returns the records to pass on in place of the given one
+	def process(self, record):
+		return [record]
+
+	# Called after the last record
+	def finish(self, meta_data):
+		pass
+
+	def report(self):
+		return None
+
+
+class SetDayTime(Stage):
+	name = 'daytime'
+	description = 'Replace the empty packets left by PCRC 0.3-alpha and below with a Time Update packet that freezes the daytime. Arguments: <daytime>'
+
+	def __init__(self, day_time):
+		super().__init__()
+		self.day_time = int(day_time)
+		self.time_update_id = None
+		self.time_update_data = None
+		self.count = 0
+
+	def setup(self, protocol_table, meta_data):
+		super().setup(protocol_table, meta_data)
+		self.time_update_id = protocol_table.ids['Time Update']
+		packet = SARCPacket()
+		packet.write_varint(self.time_update_id)
+		packet.write_long(0)  # World Age
+		packet.write_long(-self.day_time)  # If negative sun will stop moving at the Math.abs of the time
+		self.time_update_data = bytes(packet.flush())
+		self.packet_ids = frozenset([-1])
+
+	def process(self, record):
+		self.count += 1
+		return [(record[0], self.time_update_id, self.time_update_data)]
+
+	def report(self):
+		return 'Filled {} empty packets with time update packets'.format(self.count)
+
+
+class ClearWeather(Stage):
+	name = 'clear_weather'
+	description = 'Remove the weather changes of Change Game State packets'
+
+	def __init__(self):
+		super().__init__()
+		self.count = 0
+
+	def setup(self, protocol_table, meta_data):
+		super().setup(protocol_table, meta_data)
+		self.packet_ids = protocol_table.compile_ids(['Change Game State'])
+
+	def process(self, record):
+		packet_id, offset = read_varint(record[2])
+		if record[2][offset] in (1, 2, 7, 8):
+			self.count += 1
+			return []
+		return [record]
+
+	def report(self):
+		return 'Removed {} weather packets'.format(self.count)
+
+
+class FixTimeStamp(Stage):
+	name = 'fix_time_stamp'
+	description = 'Remove the time gaps not less than <threshold> ms, e.g. the missing afk time in PCRC 0.5-alpha and below. Arguments: [threshold]'
+	DefaultThreshold = 10000
+
+	def __init__(self, threshold=DefaultThreshold):
+		super().__init__()
+		self.threshold = int(threshold)
+		self.last_time = None
+		self.delta = 0
+		self.gap_count = 0
+
+	def process(self, record):
+		time_stamp = record[0]
+		if self.last_time is not None and time_stamp - self.last_time >= self.threshold:
+			self.delta += time_stamp - self.last_time
+			self.gap_count += 1
+		self.last_time = time_stamp
+		if self.delta == 0:
+			return [record]
+		return [(time_stamp - self.delta, record[1], record[2])]
+
+	def finish(self, meta_data):
+		if 'duration' in meta_data:
+			meta_data['duration'] = max(0, meta_data['duration'] - self.delta)
+
+	def report(self):
+		return 'Removed {} time gaps, {}ms in total'.format(self.gap_count, self.delta)
+
+
+class KeepPlayers(Stage):
+	name = 'keep_players'
+	description = 'Remove the remove player actions of Player Info packets, so players don\'t get missing after PCRC afks in PCRC 0.5-alpha and below'
+
+	def __init__(self):
+		super().__init__()
+		self.count = 0
+
+	def setup(self, protocol_table, meta_data):
+		super().setup(protocol_table, meta_data)
+		self.packet_ids = protocol_table.compile_ids(['Player Info', 'Player List Item'])
+
+	def process(self, record):
+		packet_id, offset = read_varint(record[2])
+		action, offset = read_varint(record[2], offset)
+		if action == 4:
+			self.count += 1
+			return []
+		return [record]
+
+	def report(self):
+		return 'Removed {} remove player packets'.format(self.count)
+
+
+class RemoveEntityType(Stage):
+	name = 'remove_entity_type'
+	description = 'Remove the mobs with the given entity type id and their packets, e.g. 56 for zombie pigmen in 1.14.4. Arguments: <entity type id>'
+
+	def __init__(self, entity_type):
+		super().__init__()
+		self.entity_type = int(entity_type)
+		self.blocked_ids = set()
+		self.count = 0
+
+	def setup(self, protocol_table, meta_data):
+		super().setup(protocol_table, meta_data)
+		self.spawn_mob_ids = protocol_table.compile_ids(['Spawn Mob', 'Spawn Living Entity'])
+		self.destroy_entities_ids = protocol_table.compile_ids(['Destroy Entities'])
+		self.packet_ids = self.spawn_mob_ids | self.destroy_entities_ids | protocol_table.entity_packet_ids
+
+	def process(self, record):
+		packet = SARCPacket()
+		packet.receive(record[2])
+		packet_id = packet.read_varint()
+		bad = False
+		if packet_id in self.spawn_mob_ids:
+			entity_id = packet.read_varint()
+			packet.read_uuid()
+			if packet.read_varint() == self.entity_type:
+				self.blocked_ids.add(entity_id)
+				bad = True
+		elif packet_id in self.destroy_entities_ids:
+			entity_ids = [packet.read_varint() for i in range(packet.read_varint())]
+			bad = len(entity_ids) > 0 and all(entity_id in self.blocked_ids for entity_id in entity_ids)
+			self.blocked_ids.difference_update(entity_ids)
+		else:
+			bad = self.protocol_table.read_entity_id(packet_id, packet.received, packet.offset)[0] in self.blocked_ids
+		if bad:
+			self.count += 1
+			return []
+		return [record]
+
+	def report(self):
+		return 'Removed {} packets of entity type {}'.format(self.count, self.entity_type)
+
+
+class RemoveNonPlayerEntities(Stage):
+	name = 'remove_non_player_entities'
+	description = 'Remove all entities except players and their packets'
+
+	def __init__(self):
+		super().__init__()
+		self.player_ids = set()
+		self.count = 0
+
+	def setup(self, protocol_table, meta_data):
+		super().setup(protocol_table, meta_data)
+		self.spawn_player_ids = protocol_table.compile_ids(['Spawn Player'])
+		self.spawn_entity_ids = protocol_table.compile_ids(['Spawn Mob', 'Spawn Living Entity', 'Spawn Object', 'Spawn Entity'])
+		self.destroy_entities_ids = protocol_table.compile_ids(['Destroy Entities'])
+		self.packet_ids = self.spawn_player_ids | self.spawn_entity_ids | self.destroy_entities_ids | protocol_table.entity_packet_ids
+
+	def process(self, record):
+		packet = SARCPacket()
+		packet.receive(record[2])
+		packet_id = packet.read_varint()
+		bad = False
+		if packet_id in self.spawn_player_ids:
+			self.player_ids.add(packet.read_varint())
+		elif packet_id in self.spawn_entity_ids:
+			bad = True
+		elif packet_id in self.destroy_entities_ids:
+			entity_ids = [packet.read_varint() for i in range(packet.read_varint())]
+			bad = not any(entity_id in self.player_ids for entity_id in entity_ids)
+			self.player_ids.difference_update(entity_ids)
+		else:
+			bad = self.protocol_table.read_entity_id(packet_id, packet.received, packet.offset)[0] not in self.player_ids
+		if bad:
+			self.count += 1
+			return []
+		return [record]
+
+	def report(self):
+		return 'Removed {} non-player entity packets'.format(self.count)
+
+
+class RemovePacket(Stage):
+	name = 'remove_packet'
+	description = 'Remove all packets with the given name, see https://wiki.vg/ for the names. Arguments: <packet name>'
+
+	def __init__(self, packet_name):
+		super().__init__()
+		self.packet_name = packet_name
+		self.count = 0
+
+	def setup(self, protocol_table, meta_data):
+		super().setup(protocol_table, meta_data)
+		if self.packet_name not in protocol_table.ids:
+			raise ValueError('Unknown packet name "{}"'.format(self.packet_name))
+		self.packet_ids = protocol_table.compile_ids([self.packet_name])
+
+	def process(self, record):
+		self.count += 1
+		return []
+
+	def report(self):
+		return 'Removed {} {} packets'.format(self.count, self.packet_name)
+
+
+class TimeUpdateAfterRespawn(Stage):
+	name = 'time_update_after_respawn'
+	description = 'Repeat the last Time Update packet after every Respawn packet, to fix the missing time update after the dimension changes'
+
+	def __init__(self):
+		super().__init__()
+		self.time_update_data = None
+		self.count = 0
+
+	def setup(self, protocol_table, meta_data):
+		super().setup(protocol_table, meta_data)
+		self.time_update_id = protocol_table.ids['Time Update']
+		self.respawn_id = protocol_table.ids['Respawn']
+		self.packet_ids = frozenset([self.time_update_id, self.respawn_id])
+
+	def process(self, record):
+		if record[1] == self.time_update_id:
+			self.time_update_data = record[2]
+		elif self.time_update_data is not None:
+			self.count += 1
+			return [record, (record[0], self.time_update_id, self.time_update_data)]
+		return [record]
+
+	def report(self):
+		return 'Wrote {} time update packets after Respawn packet'.format(self.count)
+
+
+class Analyze(Stage):
+	name = 'analyze'
+	description = 'Report what types of packet take the most space, listing every packet into <file> if given. Arguments: [file]'
+
+	def __init__(self, listing_file_name=None):
+		super().__init__()
+		self.listing_file_name = listing_file_name
+		self.listing_file = None
+		self.sizes = {}
+		self.entity_types = {}  # entity id -> name
+		self.player_ids = set()
+		self.count = 0
+
+	def setup(self, protocol_table, meta_data):
+		super().setup(protocol_table, meta_data)
+		self.spawn_player_ids = protocol_table.compile_ids(['Spawn Player'])
+		self.spawn_entity_ids = protocol_table.compile_ids(['Spawn Mob', 'Spawn Living Entity', 'Spawn Object', 'Spawn Entity'])
+		self.spawn_mob_ids = protocol_table.compile_ids(['Spawn Mob', 'Spawn Living Entity'])
+		self.destroy_entities_ids = protocol_table.compile_ids(['Destroy Entities'])
+		self.object_type_is_byte = meta_data.get('protocol', 0) < 477  # Spawn Object of 1.12 - 1.13
+		if self.listing_file_name is not None:
+			self.listing_file = open(self.listing_file_name, 'w')
+
+	def process(self, record):
+		time_stamp, packet_id, data = record
+		packet_name = self.protocol_table.get_name(packet_id)
+		if self.listing_file is not None:
+			self.listing_file.write('#{}\t{}\t@ {}\n'.format(self.count, packet_name, time_stamp))
+		entity_type = None
+		if len(data) > 0:
+			packet = SARCPacket()
+			packet.receive(data)
+			packet.read_varint()
+			if packet_id in self.spawn_player_ids:
+				self.player_ids.add(packet.read_varint())
+			elif packet_id in self.spawn_entity_ids:
+				entity_id = packet.read_varint()
+				packet.read_uuid()
+				is_mob = packet_id in self.spawn_mob_ids
+				type_id = packet.read_byte() if not is_mob and self.object_type_is_byte else packet.read_varint()
+				entity_type = self.entity_types[entity_id] = ('Mob' if is_mob else 'Obj') + str(type_id)
+			elif packet_id in self.destroy_entities_ids:
+				for i in range(packet.read_varint()):
+					self.player_ids.discard(packet.read_varint())
+			elif packet_id in self.protocol_table.entity_packet_ids:
+				entity_id = self.protocol_table.read_entity_id(packet_id, packet.received, packet.offset)[0]
+				entity_type = 'Player' if entity_id in self.player_ids else self.entity_types.get(entity_id, '?')
+		if entity_type is not None:
+			packet_name += ' (' + entity_type + ')'
+		self.sizes[packet_name] = self.sizes.get(packet_name, 0) + RecordHeader.size + len(data)
+		self.count += 1
+		return [record]
+
+	def finish(self, meta_data):
+		if self.listing_file is not None:
+			self.listing_file.close()
+
+	def report(self):
+		lines = ['Analyzed {} packets'.format(self.count)]
+		for packet_name, size in sorted(self.sizes.items(), key=lambda item: item[1], reverse=True):
+			lines.append('{}: {}MB'.format(packet_name, round(size / constant.BytePerMB, 5)))
+		return '\n'.join(lines)
+
+
+Stages = {stage.name: stage for stage in [
+	SetDayTime, ClearWeather, FixTimeStamp, KeepPlayers, RemoveEntityType, RemoveNonPlayerEntities, RemovePacket, TimeUpdateAfterRespawn, Analyze
+]}
+
+
+# "name:arg1,arg2" -> stage
+def parse_stage(text):
+	name, _, args = text.partition(':')
+	if name not in Stages:
+		raise ValueError('Unknown stage "{}"'.format(name))
+	return Stages[name](*(args.split(',') if args != '' else []))
+
+
+# Copies a member of zin into zout with the same name, time stamp, attributes and compression type
+def copy_zip_member(zin, info, zout, chunk_size=1024 * 1024):
+	new_info = zipfile.ZipInfo(info.filename, info.date_time)
+	new_info.compress_type = info.compress_type
+	new_info.external_attr = info.external_attr
+	new_info.file_size = info.file_size  # lets zout.open() tell if the member needs zip64
+	with zin.open(info) as src, zout.open(new_info, 'w') as dst:
+		shutil.copyfileobj(src, dst, chunk_size)
+
+
+class ReplayEditor:
+	"""
+	Applies a chain of stages to a .mcpr file, reading and writing recording.tmcpr once whatever the amount of stages
+	The new recording.tmcpr is written into the output .mcpr directly, with its crc32 and index computed on the fly
+	Nothing is extracted to the disk, so editing needs free space for the output file only
+	"""
+	ChunkSize = 1024 * 1024
+	ProgressInterval = 1000000  # in packet
+
+	def __init__(self, stages, log=print):
+		self.stages = stages
+		self.log = log
+
+	def __run_stages(self, record):
+		records = [record]
+		for stage in self.stages:
+			packet_ids = stage.packet_ids
+			if len(records) == 1:  # the usual case
+				if packet_ids is None or records[0][1] in packet_ids:
+					records = stage.process(records[0])
+			else:
+				new_records = []
+				for record in records:
+					if packet_ids is None or record[1] in packet_ids:
+						new_records.extend(stage.process(record))
+					else:
+						new_records.append(record)
+				records = new_records
+			if len(records) == 0:
+				break
+		return records
+
+	# output_file_name can be input_file_name, the input file is replaced after the new one is complete
+	def edit(self, input_file_name, output_file_name, compression_level=6):
+		with zipfile.ZipFile(input_file_name) as zin:
+			meta_data = json.loads(zin.read('metaData.json'))
+			protocol_table = protocol.get_table(meta_data['protocol'])
+			for stage in self.stages:
+				stage.setup(protocol_table, meta_data)
+
+			temp_file_name = output_file_name + '.part'
+			indexer = RecordingIndexer()
+			input_count = output_count = 0
+			with RecordingReader.open(input_file_name) as reader, \
+					zipfile.ZipFile(temp_file_name, 'w', zipfile.ZIP_DEFLATED, compresslevel=compression_level) as zout:
+				# members untouched by the stages are copied as they are
+				for info in zin.infolist():
+					if info.filename not in ('recording.tmcpr', 'recording.tmcpr.crc32', 'metaData.json', IndexFileName):
+						copy_zip_member(zin, info, zout)
+				with zout.open('recording.tmcpr', 'w', force_zip64=True) as dst:
+					buffer = bytearray()
+					offset = 0
+					crc32 = 0
+					for time_stamp, data in reader:
+						packet_id = read_varint(data)[0] if len(data) > 0 else -1
+						for time_stamp, packet_id, data in self.__run_stages((time_stamp, packet_id, data)):
+							indexer.on_record(time_stamp, offset + len(buffer))
+							buffer += RecordHeader.pack(time_stamp, len(data))
+							buffer += data
+							output_count += 1
+						if len(buffer) >= self.ChunkSize:
+							crc32 = zlib.crc32(buffer, crc32)
+							dst.write(buffer)
+							offset += len(buffer)
+							buffer = bytearray()
+						input_count += 1
+						if input_count % self.ProgressInterval == 0:
+							self.log('Processed {} packets, {}MB written'.format(input_count, round((offset + len(buffer)) / constant.BytePerMB, 2)))
+					crc32 = zlib.crc32(buffer, crc32)
+					dst.write(buffer)
+				for stage in self.stages:
+					stage.finish(meta_data)
+				zout.writestr('metaData.json', json.dumps(meta_data))
+				zout.writestr('recording.tmcpr.crc32', str(crc32 & 0xffffffff))
+				zout.writestr(IndexFileName, indexer.pop_entries())
+		os.replace(temp_file_name, output_file_name)
+
+		self.log('Packets: {} -> {}'.format(input_count, output_count))
+		for stage in self.stages:
+			report = stage.report()
+			if report is not None:
+				self.log(report)
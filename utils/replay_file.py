@@ -1,14 +1,232 @@
+import bisect
 import json
 import os
 import shutil
-import time
+import struct
 import zipfile
+import zlib
 
-from . import utils
+from . import constant
+from .file_writer import FileWriter
+
+# time stamp and packet length in front of every packet in recording.tmcpr
+RecordHeader = struct.Struct('>ii')
+# recording.tmcpr.index: a sparse index of (time stamp, byte offset, packet ordinal) of records in recording.tmcpr
+# An entry is written only after the record it points at, so they are also record boundaries to recover a recording from
+IndexFileName = 'recording.tmcpr.index'
+IndexEntry = struct.Struct('>iqi')
+
+
+# Yields (time stamp, packet data) of every record in the content of a recording.tmcpr, packet data are views of data
+def read_records(data):
+	view = memoryview(data)
+	offset = 0
+	while offset + RecordHeader.size <= len(view):
+		time_stamp, packet_length = RecordHeader.unpack_from(view, offset)
+		offset += RecordHeader.size
+		yield time_stamp, view[offset:offset + packet_length]
+		offset += packet_length
+
+
+# a trailing partial entry is ignored
+def parse_index(data):
+	return [IndexEntry.unpack_from(data, offset) for offset in range(0, len(data) - IndexEntry.size + 1, IndexEntry.size)]
+
+
+def read_index(path):
+	try:
+		with open(os.path.join(path, IndexFileName), 'rb') as f:
+			return parse_index(f.read())
+	except FileNotFoundError:
+		return []
+
+
+class RecordingIndexer:
+	"""
+	Picks the records to put into the index while they are being written, one at least every time_interval ms or byte_interval bytes
+	"""
+	def __init__(self, time_interval=constant.RecordingIndexTimeInterval, byte_interval=constant.RecordingIndexByteInterval):
+		self.time_interval = time_interval
+		self.byte_interval = byte_interval
+		self.record_count = 0
+		self.last_entry = None  # (time stamp, offset)
+		self.entries = bytearray()  # not written yet
+
+	# offset is where the record starts in recording.tmcpr
+	def on_record(self, time_stamp, offset):
+		if self.last_entry is None or time_stamp - self.last_entry[0] >= self.time_interval or offset - self.last_entry[1] >= self.byte_interval:
+			self.entries += IndexEntry.pack(time_stamp, offset, self.record_count)
+			self.last_entry = (time_stamp, offset)
+		self.record_count += 1
+
+	def pop_entries(self):
+		entries = bytes(self.entries)
+		self.entries.clear()
+		return entries
+
+
+class RecordingReader:
+	"""
+	Reads the records of a recording.tmcpr file object one by one
+	seek() finds the nearest index entry with a binary search, then skips the few records after it by their headers only
+	Seeking is fast in a .tmcpr file or a stored .mcpr, in a deflated .mcpr the data before the position has to be inflated still
+	"""
+	def __init__(self, file, index_entries=()):
+		self.file = file
+		self.index_entries = list(index_entries)
+		self.index_times = [entry[0] for entry in self.index_entries]
+		self.index_ordinals = [entry[2] for entry in self.index_entries]
+		self.ordinal = 0  # of the next record
+
+	# file_name can be a .mcpr file, a recording directory or a .tmcpr file, whose index is the .index file beside it
+	@staticmethod
+	def open(file_name):
+		if zipfile.is_zipfile(file_name):
+			zipf = zipfile.ZipFile(file_name)
+			index_data = zipf.read(IndexFileName) if IndexFileName in zipf.namelist() else b''
+			reader = RecordingReader(zipf.open('recording.tmcpr'), parse_index(index_data))
+			reader.zipf = zipf
+			return reader
+		if os.path.isdir(file_name):
+			file_name = os.path.join(file_name, 'recording.tmcpr')
+		index_entries = []
+		if os.path.isfile(file_name + '.index'):
+			with open(file_name + '.index', 'rb') as f:
+				index_entries = parse_index(f.read())
+		return RecordingReader(open(file_name, 'rb'), index_entries)
+
+	def close(self):
+		self.file.close()
+		if hasattr(self, 'zipf'):
+			self.zipf.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
+
+	# Returns (time stamp, packet data) of the next record, or None at the end
+	def read(self):
+		header = self.file.read(RecordHeader.size)
+		if len(header) < RecordHeader.size:
+			return None
+		time_stamp, packet_length = RecordHeader.unpack(header)
+		data = self.file.read(packet_length)
+		if len(data) < packet_length:
+			return None
+		self.ordinal += 1
+		return time_stamp, data
+
+	def __iter__(self):
+		while True:
+			record = self.read()
+			if record is None:
+				break
+			yield record
+
+	def __jump(self, entry_index):
+		if entry_index < 0:
+			self.file.seek(0)
+			self.ordinal = 0
+		else:
+			time_stamp, offset, ordinal = self.index_entries[entry_index]
+			self.file.seek(offset)
+			self.ordinal = ordinal
+
+	# skips the records until the condition on (time stamp, ordinal) of the next one holds
+	def __skip_until(self, condition):
+		while True:
+			position = self.file.tell()
+			header = self.file.read(RecordHeader.size)
+			if len(header) < RecordHeader.size:
+				break
+			time_stamp, packet_length = RecordHeader.unpack(header)
+			if condition(time_stamp, self.ordinal):
+				self.file.seek(position)
+				break
+			self.file.seek(packet_length, os.SEEK_CUR)
+			self.ordinal += 1
+
+	# Moves to the first record whose time stamp is not less than time_stamp
+	def seek(self, time_stamp):
+		self.__jump(bisect.bisect_left(self.index_times, time_stamp) - 1)
+		self.__skip_until(lambda t, n: t >= time_stamp)
+
+	# Moves to the record with the given packet ordinal, starting from 0
+	def seek_ordinal(self, ordinal):
+		self.__jump(bisect.bisect_right(self.index_ordinals, ordinal) - 1)
+		self.__skip_until(lambda t, n: n >= ordinal)
+
+
+# Cuts the trailing partial record off the recording.tmcpr of an interrupted recording
+# Returns (the size of the complete records, the amount of bytes cut, the time stamp of the last complete record)
+def repair_recording(path):
+	tmcpr = os.path.join(path, 'recording.tmcpr')
+	size = os.path.getsize(tmcpr)
+	index_entries = read_index(path)
+	offset, duration = 0, 0
+	for entry_time, entry_offset, entry_ordinal in index_entries:
+		if entry_offset >= size:
+			break
+		offset, duration = entry_offset, entry_time
+	# records after the last index entry are checked one by one
+	with open(tmcpr, 'r+b') as f:
+		f.seek(offset)
+		while True:
+			header = f.read(RecordHeader.size)
+			if len(header) < RecordHeader.size:
+				break
+			time_stamp, packet_length = RecordHeader.unpack(header)
+			# unwritten space might be zeros after a power loss
+			if packet_length <= 0 or time_stamp < duration or offset + RecordHeader.size + packet_length > size:
+				break
+			f.seek(packet_length, os.SEEK_CUR)
+			offset += RecordHeader.size + packet_length
+			duration = time_stamp
+		if offset < size:
+			f.truncate(offset)
+	with open(os.path.join(path, IndexFileName), 'wb') as f:
+		for entry in index_entries:
+			if entry[1] < offset:
+				f.write(IndexEntry.pack(*entry))
+	return offset, size - offset, duration
+
+
+# Packages the segment directory path into the .mcpr file file_name in a single pass over recording.tmcpr, then removes path
+# The zip file is written beside file_name first, so an incomplete .mcpr never shows up
+# crc32 of recording.tmcpr is computed while packaging if it's not given
+# report(bytes done, bytes total) is called after each chunk of recording.tmcpr is packaged
+def package_segment(path, file_name, compression_level=6, crc32=None, report=None, chunk_size=1024 * 1024):
+	tmcpr = os.path.join(path, 'recording.tmcpr')
+	total = os.path.getsize(tmcpr)
+	temp_file_name = file_name + '.part'
+	compression = zipfile.ZIP_DEFLATED if compression_level > 0 else zipfile.ZIP_STORED
+	with zipfile.ZipFile(temp_file_name, 'w', compression, compresslevel=compression_level) as zipf:
+		for name in ('markers.json', 'mods.json', 'metaData.json', IndexFileName):
+			if name == IndexFileName and not os.path.isfile(os.path.join(path, name)):
+				continue
+			zipf.write(os.path.join(path, name), arcname=name)
+		done = 0
+		computed_crc32 = 0
+		with open(tmcpr, 'rb') as src, zipf.open('recording.tmcpr', 'w', force_zip64=total * 1.05 > zipfile.ZIP64_LIMIT) as dst:
+			while True:
+				data = src.read(chunk_size)
+				if len(data) == 0:
+					break
+				dst.write(data)
+				if crc32 is None:
+					computed_crc32 = zlib.crc32(data, computed_crc32)
+				done += len(data)
+				if report is not None:
+					report(done, total)
+		zipf.writestr('recording.tmcpr.crc32', str((crc32 if crc32 is not None else computed_crc32) & 0xffffffff))
+	os.replace(temp_file_name, file_name)
+	shutil.rmtree(path)
 
 
 class ReplayFile:
-	def __init__(self, path='./'):
+	def __init__(self, logger, path='./', queue_size=4, fsync_interval=0):
 		self.path = path
 		self.mods = []
 		self.meta_data = {}
@@ -18,32 +236,26 @@ class ReplayFile:
 		if not os.path.exists(path):
 			os.makedirs(path)
 		self.file_size = 0
-		open('{}recording.tmcpr'.format(self.path), 'w').close()
+		self.writer = FileWriter('{}recording.tmcpr'.format(self.path), logger, queue_size, fsync_interval, index_file_name=os.path.join(self.path, IndexFileName))
+		self.indexer = RecordingIndexer()
+		self.writer.start()
 		self.write_markers()
 		self.write_mods()
 		self.write_meta_data()
 
-	def create(self, file_name):
-		tmcpr = '{}recording.tmcpr'.format(self.path)
-		if not os.path.isfile(tmcpr):
-			open(tmcpr, 'w').close()
-		zipf = zipfile.ZipFile(file_name, 'w', zipfile.ZIP_DEFLATED)
-
-		def add(zipf, name, data=None):
-			file_name = '{}{}'.format(self.path, name)
-			if data is not None:
-				with open(file_name, 'w') as f:
-					f.write(data)
-			zipf.write(file_name, arcname=name)
-			time.sleep(0.01)
-
-		add(zipf, 'markers.json')
-		add(zipf, 'mods.json')
-		add(zipf, 'metaData.json')
-		add(zipf, 'recording.tmcpr.crc32', str(utils.crc32_file(tmcpr)))
-		add(zipf, 'recording.tmcpr')
-		zipf.close()
-		shutil.rmtree(self.path)
+	# Writes all pending data and closes recording.tmcpr
+	def close(self):
+		self.writer.close()
+
+	# Closes the recording and deletes its directory, for a recording that is not worth packaging
+	def discard(self):
+		self.close()
+		shutil.rmtree(self.path, ignore_errors=True)
+
+	# Packages the recording into file_name in this process, see package_segment
+	def create(self, file_name, compression_level=6):
+		self.close()
+		package_segment(self.path, file_name, compression_level, self.writer.crc32)
 
 	def add_marker(self, time_stamp, pos, name=None):
 		marker = {
@@ -75,22 +287,24 @@ class ReplayFile:
 		self.meta_data = meta_data
 		self.write_meta_data()
 
+	# data will be written in the writer thread, so it should not be modified by the caller afterwards
+	# data should only contain whole records, which are passed to indexer.on_record beforehand
 	def write(self, data):
-		with open('{}recording.tmcpr'.format(self.path), 'ab+') as replay_recording:
-			replay_recording.write(data)
 		self.file_size += len(data)
+		self.writer.write(data, self.indexer.pop_entries())
+
+	# the json files are written in the writer thread, data is serialized right away so the caller can keep modifying it
+	def write_json(self, file_name, data):
+		self.writer.replace_file(os.path.join(self.path, file_name), json.dumps(data).encode('utf8'))
 
 	def write_markers(self):
-		with open('{}markers.json'.format(self.path), 'w') as markers_file:
-			markers_file.write(json.dumps(self.markers))
+		self.write_json('markers.json', self.markers)
 
 	def write_mods(self):
-		with open('{}mods.json'.format(self.path), 'w') as mods_file:
-			mods_file.write(json.dumps({"requiredMods": self.mods}))
+		self.write_json('mods.json', {"requiredMods": self.mods})
 
 	def write_meta_data(self):
-		with open('{}metaData.json'.format(self.path), 'w') as meta_data_file:
-			meta_data_file.write(json.dumps(self.meta_data))
+		self.write_json('metaData.json', self.meta_data)
 
 	def size(self):
 		return self.file_size
@@ -0,0 +1,253 @@
+# coding: utf8
+
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+import time
+import traceback
+
+from . import utils, constant
+from .file_writer import replace_file
+from .replay_file import package_segment, repair_recording
+
+_progress_queue = None
+
+
+def _init_worker(progress_queue):
+	global _progress_queue
+	_progress_queue = progress_queue
+
+
+# runs in a worker process
+def _run_job(path, file_path, compression_level, crc32):
+	def report(done, total):
+		_progress_queue.put((file_path, done, total))
+	package_segment(path, file_path, compression_level, crc32, report)
+	return os.path.getsize(file_path)
+
+
+class PackagingJob:
+	"""
+	A segment directory waiting to be packaged into file_path
+	It's saved into the segment directory, so the segment can still be packaged after PCRC crashes or exits halfway
+	"""
+	FileName = 'package_job.json'
+
+	def __init__(self, path, file_path, compression_level, crc32=None, replay_file=None, callback=None):
+		self.path = path
+		self.file_path = file_path
+		self.compression_level = compression_level
+		self.crc32 = crc32
+		self.replay_file = replay_file  # None for recovered jobs, whose recording.tmcpr is closed already
+		self.callback = callback
+
+	# While the recording is still open the job is saved in its writer thread, so the recorder isn't blocked by the disk
+	def save(self):
+		data = {'file_path': self.file_path, 'compression_level': self.compression_level, 'crc32': self.crc32}
+		if self.replay_file is not None and not self.replay_file.writer.closed:
+			self.replay_file.write_json(PackagingJob.FileName, data)
+		else:
+			replace_file(os.path.join(self.path, PackagingJob.FileName), json.dumps(data).encode('utf8'))
+
+	@staticmethod
+	def load(path):
+		with open(os.path.join(path, PackagingJob.FileName)) as f:
+			data = json.load(f)
+		return PackagingJob(path, data['file_path'], data['compression_level'], data['crc32'])
+
+
+class ReplayPackager:
+	"""
+	Packages closed replay segments into .mcpr files in a process pool, so deflating doesn't compete with recording for the GIL
+	Several worker threads share the queue, e.g. for recorders of different servers, each of them drives one job in the pool at a time
+	"""
+	ProgressInterval = 10  # in second, how often the progress of a job is logged
+
+	def __init__(self, logger, worker_count=1):
+		self.logger = logger
+		self.queue = queue.Queue()
+		self.pending_file_paths = set()
+		self.condition = threading.Condition()
+		self.mp_context = multiprocessing.get_context('spawn')  # forking a process with running threads is not safe
+		self.progress_queue = self.mp_context.Queue()
+		self.progress = {}  # file path -> (bytes done, bytes total)
+		self.executor = None
+		self.workers = []
+		for i in range(max(1, worker_count)):
+			worker = threading.Thread(target=self.run, name='Packager-{}'.format(i + 1), daemon=True)
+			self.workers.append(worker)
+
+	def start(self):
+		for worker in self.workers:
+			worker.start()
+
+	@property
+	def worker_count(self):
+		return len(self.workers)
+
+	@property
+	def pending_count(self):
+		return len(self.pending_file_paths)
+
+	def is_pending(self, file_path):
+		return file_path in self.pending_file_paths
+
+	# callback(file_name) is invoked in the packager thread after the .mcpr file is created
+	def submit(self, replay_file, file_path, compression_level, callback=None):
+		job = PackagingJob(replay_file.path, file_path, compression_level, replay_file=replay_file, callback=callback)
+		self.add_job(job, save=True)
+		self.logger.log('Segment "{}" queued for packaging, {} segment(s) pending'.format(os.path.basename(file_path), self.pending_count))
+
+	def add_job(self, job, save=False):
+		with self.condition:
+			self.pending_file_paths.add(job.file_path)
+		if save:
+			job.save()  # only once the job is pending, or a recovery scan in between would queue it twice
+		self.queue.put(job)
+
+	# Queues the segments left by a crashed or exited PCRC, returns the amount of them
+	# Both the segments waiting to be packaged and the interrupted recordings are recovered
+	def recover(self, folder=constant.RecordingFilePath, compression_level=6):
+		if not os.path.isdir(folder):
+			return 0
+		count = 0
+		for name in sorted(os.listdir(folder)):
+			path = os.path.join(folder, name)
+			if not os.path.isfile(os.path.join(path, 'recording.tmcpr')):
+				continue
+			try:
+				if os.path.isfile(os.path.join(path, PackagingJob.FileName)):
+					job = PackagingJob.load(path)
+					if self.is_pending(job.file_path):
+						continue
+					if job.crc32 is None:  # crashed before recording.tmcpr got closed
+						self.repair_recording(path)
+				else:
+					job = self.recover_recording(path, name, compression_level)
+					if job is None:
+						continue
+			except Exception as e:
+				self.logger.warn('Fail to recover the segment in "{}": {}'.format(path, e))
+				continue
+			self.logger.log('Recovered unfinished segment "{}"'.format(os.path.basename(job.file_path)))
+			self.add_job(job)
+			count += 1
+		return count
+
+	def repair_recording(self, path):
+		size, cut_size, duration = repair_recording(path)
+		if cut_size > 0:
+			self.logger.log('Cut {} bytes of incomplete record off the recording in "{}"'.format(cut_size, path))
+		return size, duration
+
+	# Turns a recording whose recorder is gone into a packaging job
+	def recover_recording(self, path, name, compression_level):
+		meta_data_file = os.path.join(path, 'metaData.json')
+		if not os.path.isfile(meta_data_file) or time.time() - os.path.getmtime(meta_data_file) < constant.StaleRecordingTime:
+			return None  # still being recorded, maybe by another PCRC
+		with open(meta_data_file) as f:
+			meta_data = json.load(f)
+		if 'protocol' not in meta_data:
+			self.logger.warn('Recording in "{}" has no meta data, skipped'.format(path))
+			return None
+		size, duration = self.repair_recording(path)
+		if size < constant.MinimumLegalFileSize:
+			self.logger.warn('Recording in "{}" is too small ({}KB), removed'.format(path, utils.convert_file_size_KB(size)))
+			shutil.rmtree(path, ignore_errors=True)
+			return None
+		meta_data['duration'] = max(meta_data.get('duration', 0), duration)
+		with open(meta_data_file + '.tmp', 'w') as f:
+			json.dump(meta_data, f)
+		os.replace(meta_data_file + '.tmp', meta_data_file)
+
+		if not os.path.exists(constant.RecordingStorageFolder):
+			os.makedirs(constant.RecordingStorageFolder)
+		file_path = '{}PCRC_{}.mcpr'.format(constant.RecordingStorageFolder, name)
+		counter = 2
+		while os.path.isfile(file_path) or self.is_pending(file_path):
+			file_path = '{}PCRC_{}_{}.mcpr'.format(constant.RecordingStorageFolder, name, counter)
+			counter += 1
+		job = PackagingJob(path, file_path, compression_level)
+		job.save()
+		return job
+
+	# Waits until the given segments are packaged, or every submitted segment if file_paths is None
+	def wait(self, file_paths=None):
+		with self.condition:
+			if file_paths is None:
+				self.condition.wait_for(lambda: len(self.pending_file_paths) == 0)
+			else:
+				self.condition.wait_for(lambda: self.pending_file_paths.isdisjoint(file_paths))
+
+	def get_executor(self):
+		with self.condition:
+			if self.executor is None:
+				self.executor = concurrent.futures.ProcessPoolExecutor(
+					max_workers=self.worker_count, mp_context=self.mp_context,
+					initializer=_init_worker, initargs=(self.progress_queue, )
+				)
+			return self.executor
+
+	def collect_progress(self):
+		with self.condition:
+			try:
+				while True:
+					file_path, done, total = self.progress_queue.get_nowait()
+					if file_path in self.pending_file_paths:
+						self.progress[file_path] = (done, total)
+			except queue.Empty:
+				pass
+
+	def get_progress(self, file_path):
+		self.collect_progress()
+		done, total = self.progress.get(file_path, (0, 0))
+		return done / total if total > 0 else 0.0
+
+	def format_progress(self):
+		return ', '.join('{} {:.0%}'.format(os.path.basename(file_path), self.get_progress(file_path)) for file_path in sorted(self.pending_file_paths))
+
+	def package(self, job):
+		file_name = os.path.basename(job.file_path)
+		if job.replay_file is not None:
+			job.replay_file.close()
+			job.crc32 = job.replay_file.writer.crc32
+			job.save()
+		self.logger.log('Creating "{}"'.format(file_name))
+		start_time = time.time()
+		future = self.get_executor().submit(_run_job, job.path, job.file_path, job.compression_level, job.crc32)
+		while True:
+			try:
+				file_size = future.result(timeout=ReplayPackager.ProgressInterval)
+				break
+			except concurrent.futures.TimeoutError:
+				self.logger.log('Creating "{}": {:.0%}'.format(file_name, self.get_progress(job.file_path)))
+		self.logger.log('Size of replay file "{}": {}MB, created in {:.1f}s'.format(
+			file_name, utils.convert_file_size_MB(file_size), time.time() - start_time
+		))
+		if job.callback is not None:
+			job.callback(file_name)
+
+	def run(self):
+		while True:
+			job = self.queue.get()
+			try:
+				self.package(job)
+			except concurrent.futures.process.BrokenProcessPool:
+				self.logger.error('Packaging process of "{}" crashed, it will be packaged again on the next start'.format(job.file_path))
+				with self.condition:
+					executor, self.executor = self.executor, None
+				if executor is not None:
+					executor.shutdown(wait=False)
+			except:
+				self.logger.error('Fail to create "{}", it will be packaged again on the next start'.format(job.file_path))
+				self.logger.error(traceback.format_exc())
+			finally:
+				with self.condition:
+					self.pending_file_paths.discard(job.file_path)
+					self.progress.pop(job.file_path, None)
+					self.condition.notify_all()
+				self.queue.task_done()
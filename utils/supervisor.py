@@ -0,0 +1,152 @@
+# coding: utf8
+
+import copy
+import json
+import os
+import time
+import traceback
+
+from . import utils
+from .logger import Logger
+from .recorder import Recorder
+from .replay_packager import ReplayPackager
+from .translation import Translation
+from .pycraft.exceptions import YggdrasilError
+
+
+class ServerProfile:
+	def __init__(self, name, config_file):
+		self.name = name
+		self.config_file = config_file
+		self.recorder = None
+
+	def is_working(self):
+		return self.recorder is not None and self.recorder.is_working()
+
+	def is_stopped(self):
+		return self.recorder is None or self.recorder.is_stopped()
+
+
+class Supervisor:
+	"""
+	Records several servers from one process, one Recorder per server profile
+	The recorders share the translations, the protocol tables and the packaging workers
+
+	Example of a profile file:
+	{
+		"packaging_workers": 2,
+		"servers": [
+			{"name": "survival", "config": "config_survival.json"},
+			{"name": "creative", "config": "config_creative.json"}
+		]
+	}
+	Config paths are relative to the profile file, missing config files are created with the default options
+	"""
+	DefaultPackagingWorkers = 2
+
+	def __init__(self, profile_file, translation_folder):
+		self.logger = Logger(name='PCRC-Supervisor')
+		with open(profile_file, encoding='utf8') as f:
+			data = json.load(f)
+		base_path = os.path.dirname(os.path.abspath(profile_file))
+		self.profiles = {}
+		for entry in data.get('servers', []):
+			name = entry['name']
+			if name in self.profiles:
+				raise ValueError('Duplicated server name "{}"'.format(name))
+			if not name.replace('_', '').replace('-', '').isalnum():
+				raise ValueError('Illegal server name "{}", only letters, digits, "_" and "-" are allowed'.format(name))
+			self.profiles[name] = ServerProfile(name, os.path.join(base_path, entry['config']))
+		if len(self.profiles) == 0:
+			raise ValueError('No server found in "{}"'.format(profile_file))
+		self.translations = Translation(translation_folder)
+		packager_logger = copy.deepcopy(self.logger)
+		packager_logger.thread = 'Packager'
+		self.packager = ReplayPackager(packager_logger, data.get('packaging_workers', Supervisor.DefaultPackagingWorkers))
+		self.packager.start()
+		self.logger.log('Loaded {} server profiles: {}'.format(len(self.profiles), ', '.join(self.profiles.keys())))
+
+	# name None stands for every server
+	def get_profiles(self, name=None):
+		if name is None:
+			return list(self.profiles.values())
+		if name not in self.profiles:
+			self.logger.warn('Unknown server "{}", available servers: {}'.format(name, ', '.join(self.profiles.keys())))
+			return []
+		return [self.profiles[name]]
+
+	def get_recorder(self, name):
+		profile = self.profiles.get(name)
+		return profile.recorder if profile is not None else None
+
+	def start(self, name=None):
+		count = self.packager.recover()
+		if count > 0:
+			self.logger.log('Packaging {} segment(s) left by crashed or exited recorders'.format(count))
+		for profile in self.get_profiles(name):
+			if not profile.is_stopped():
+				self.logger.warn('Recorder of "{}" is running, ignore'.format(profile.name))
+				continue
+			self.logger.log('Creating new PCRC recorder for "{}"'.format(profile.name))
+			try:
+				profile.recorder = Recorder(profile.config_file, translations=self.translations, packager=self.packager, name=profile.name)
+				ret = profile.recorder.start()
+			except YggdrasilError as e:
+				self.logger.error('Fail to log in for "{}": {}'.format(profile.name, e))
+			except Exception:
+				self.logger.error('Fail to start recorder of "{}"'.format(profile.name))
+				self.logger.error(traceback.format_exc())
+			else:
+				self.logger.log('Recorder of "{}" started, success = {}'.format(profile.name, ret))
+
+	# the recorders are stopped together, then waited for
+	def stop(self, name=None):
+		profiles = []
+		for profile in self.get_profiles(name):
+			if profile.is_working():
+				profile.recorder.stop(by_user=True)
+				profiles.append(profile)
+			elif name is not None:
+				self.logger.warn('Recorder of "{}" is not running, ignore'.format(profile.name))
+		self.wait_stopped(profiles)
+		for profile in profiles:
+			self.logger.log('Recorder of "{}" stopped'.format(profile.name))
+
+	def restart(self, name=None):
+		self.stop(name)
+		self.start(name)
+
+	def wait_stopped(self, profiles=None):
+		if profiles is None:
+			profiles = self.get_profiles()
+		while not all(profile.is_stopped() for profile in profiles):
+			time.sleep(0.1)
+
+	def is_working(self):
+		return any(profile.is_working() for profile in self.profiles.values())
+
+	def format_status(self):
+		lines = []
+		total_packets = 0
+		total_size = 0
+		for profile in self.profiles.values():
+			recorder = profile.recorder
+			if recorder is None or recorder.replay_file is None:
+				state = 'stopped' if profile.is_stopped() else 'connecting'
+				lines.append('[{}] {}'.format(profile.name, state))
+				continue
+			size = recorder.replay_file.size() + len(recorder.file_buffer)
+			total_packets += recorder.packet_counter
+			total_size += size
+			lines.append('[{}] working: {}, online: {}, recorded/passed: {}/{}, packets: {}, size: {}MB, file name: {}'.format(
+				profile.name, recorder.is_working(), recorder.is_online(),
+				utils.convert_millis(recorder.timeRecorded()), utils.convert_millis(recorder.timePassed()),
+				recorder.packet_counter, utils.convert_file_size_MB(size), recorder.file_name
+			))
+		lines.append('Recording {}/{} servers, {} packets, {}MB in total; {} segment(s) pending for {} packaging workers'.format(
+			sum(1 for profile in self.profiles.values() if profile.is_working()), len(self.profiles),
+			total_packets, utils.convert_file_size_MB(total_size), self.packager.pending_count, self.packager.worker_count
+		))
+		if self.packager.pending_count > 0:
+			lines.append('Packaging: {}'.format(self.packager.format_progress()))
+		return lines
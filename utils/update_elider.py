@@ -0,0 +1,66 @@
+# coding: utf8
+
+from . import utils
+
+
+class UpdateElider:
+	"""
+	Keeps the last value of the updates that set a state on the client, by entity id + packet id and by player uuid + Player Info action
+	An update with the same value as the last one of its key changes nothing the client shows, so it doesn't need to be recorded
+	"""
+	def __init__(self, max_entities):
+		self.max_entities = max_entities
+		self.entities = {}  # entity id -> {packet id -> last packet}
+		self.players = {}  # uuid -> {action -> last entry}
+		self.elided = {}  # report name -> [packet count, bytes]
+
+	# Returns if the packet is the same as the last one of the entity with this packet id, remembers it otherwise
+	def check_entity(self, entity_id, packet_id, data):
+		values = self.entities.get(entity_id)
+		if values is None:
+			if len(self.entities) >= self.max_entities:  # in case the server leaks entity ids
+				del self.entities[next(iter(self.entities))]
+			values = self.entities[entity_id] = {}
+		elif values.get(packet_id) == data:
+			return True
+		values[packet_id] = bytes(data)
+		return False
+
+	# Returns if the Player Info entry is the same as the last one of the player with this action, remembers it otherwise
+	def check_player(self, uuid, action, entry):
+		values = self.players.setdefault(uuid, {})
+		if values.get(action) == entry:
+			return True
+		values[action] = bytes(entry)
+		return False
+
+	def forget_entity(self, entity_id, packet_id=None):
+		if packet_id is None:
+			self.entities.pop(entity_id, None)
+		elif entity_id in self.entities:
+			self.entities[entity_id].pop(packet_id, None)
+
+	def forget_players(self):
+		self.players.clear()
+
+	def clear(self):
+		self.entities.clear()
+		self.players.clear()
+
+	def add_elided(self, name, size, count=1):
+		entry = self.elided.setdefault(name, [0, 0])
+		entry[0] += count
+		entry[1] += size
+
+	@property
+	def elided_count(self):
+		return sum(count for count, size in self.elided.values())
+
+	@property
+	def elided_bytes(self):
+		return sum(size for count, size in self.elided.values())
+
+	def format_report(self):
+		return ', '.join('{}: {} updates, {}MB'.format(name, count, utils.convert_file_size_MB(size)) for name, (count, size) in sorted(
+			self.elided.items(), key=lambda item: item[1][1], reverse=True
+		))
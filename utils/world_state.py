@@ -0,0 +1,466 @@
+# coding: utf8
+
+import collections
+import struct
+
+from . import utils
+from .protocol import PacketType
+from .SARC.packet import Packet as SARCPacket, read_varint
+
+# Only the latest one of these packets matters for a client that joins now
+LATEST_PACKETS = [
+	'Join Game',
+	'Respawn',
+	'Server Difficulty',
+	'Player Abilities (clientbound)',
+	'Spawn Position',
+	'Update View Position',
+	'Update View Distance',
+	'Tags',
+	'World Border',
+	'Initialize World Border',
+	'Player List Header And Footer',
+	'Time Update',
+	'Player Position And Look (clientbound)',
+]
+CHUNK_PACKETS = ['Chunk Data', 'Chunk Data and Update Light']
+LIGHT_PACKETS = ['Update Light']
+BLOCK_CHANGE_PACKETS = ['Block Change', 'Multi Block Change']
+PLAYER_INFO_PACKETS = ['Player Info', 'Player List Item']  # 1.14+, 1.12
+GLOBAL_ENTITY_PACKETS = ['Spawn Global Entity', 'Spawn Weather Entity']  # 1.12 - 1.14, 1.15
+ENTITY_MOVE_PACKETS = ['Entity Relative Move', 'Entity Position']  # 1.12 - 1.13, 1.14+
+ENTITY_MOVE_LOOK_PACKETS = ['Entity Look And Relative Move', 'Entity Position and Rotation']
+ENTITY_LOOK_PACKETS = ['Entity Look', 'Entity Rotation']
+LATEST_ENTITY_PACKETS = ['Entity Head Look', 'Entity Properties']
+# reason of Change Game State -> the state it sets, only the latest reason of a state is kept
+GAME_STATES = {1: 'rain', 2: 'rain', 3: 'game mode', 7: 'rain level', 8: 'thunder level', 11: 'respawn screen'}
+
+
+# Returns the chunk position of a Chunk Data packet and if it's a full chunk, packet is at the field after the packet id
+def read_chunk_data_position(packet, protocol):
+	pos = (packet.read_int(), packet.read_int())
+	return pos, protocol >= 755 or packet.read_bool()  # 1.17 dropped the "full chunk" field
+
+
+# Returns the x, y, z of a block position field
+def read_block_position(packet, protocol):
+	position = packet.read_long()
+	x = position >> 38
+	if protocol >= 477:  # 1.14 changed the bit layout of block positions
+		y = position & 0xFFF
+		z = (position >> 12) & 0x3FFFFFF
+	else:
+		y = (position >> 26) & 0xFFF
+		z = position & 0x3FFFFFF
+	if y >= 1 << 11:
+		y -= 1 << 12
+	if z >= 1 << 25:
+		z -= 1 << 26
+	return x, y, z
+
+
+# Returns the chunk position of the blocks changed by a Block Change or Multi Block Change packet
+def read_block_change_chunk(packet, protocol, multi):
+	if not multi:
+		x, y, z = read_block_position(packet, protocol)
+		return x >> 4, z >> 4
+	if protocol >= 751:  # 1.16.2+ uses the chunk section position
+		position = packet.read_long()
+		z = (position >> 20) & 0x3FFFFF
+		if z >= 1 << 21:
+			z -= 1 << 22
+		return position >> 42, z
+	return packet.read_int(), packet.read_int()
+
+
+class CachedChunk:
+	__slots__ = ('data', 'updates', 'size')
+
+	def __init__(self, data):
+		self.data = data
+		self.updates = []  # block changes and partial Chunk Data packets received after data
+		self.size = len(data)
+
+
+class CachedEntity:
+	__slots__ = ('entity_id', 'spawn_data', 'uuid', 'x', 'y', 'z', 'yaw', 'pitch', 'on_ground', 'moved', 'packets', 'metadata', 'size')
+
+	def __init__(self, entity_id, spawn_data, uuid, x, y, z, yaw, pitch):
+		self.entity_id = entity_id
+		self.spawn_data = spawn_data
+		self.uuid = uuid  # None for non-player entities
+		self.x, self.y, self.z = x, y, z
+		self.yaw, self.pitch = yaw, pitch  # as angle bytes
+		self.on_ground = True
+		self.moved = False  # if the position or look changed since the spawn packet
+		self.packets = {}  # key -> the latest data of packets like Entity Head Look
+		self.metadata = []  # the latest Entity Metadata packets
+		self.size = len(spawn_data)
+
+	def update_size(self):
+		self.size = len(self.spawn_data) + sum(map(len, self.packets.values())) + sum(map(len, self.metadata))
+
+
+class WorldState:
+	"""
+	A light copy of what the client currently knows about the world, kept as the recorded raw packets
+	It's used to seed a new replay segment so Replay Mod can render it without the packets sent before the segment starts
+
+	Chunks and entities, which take nearly all of the memory, are kept within byte_budget
+	The least recently updated chunks are evicted first, then the least recently updated non-player entities
+	"""
+	MaxMetadataPackets = 8  # Entity Metadata packets are partial updates, only the latest ones of an entity are kept
+
+	def __init__(self, protocol_table, byte_budget=64 * 1024 * 1024):
+		self.protocol_table = protocol_table
+		self.byte_budget = byte_budget
+		self.object_type_is_byte = protocol_table.protocol < 477
+
+		self.latest_packet_ids = protocol_table.compile_ids(LATEST_PACKETS)
+		self.chunk_packet_ids = protocol_table.compile_ids(CHUNK_PACKETS)
+		self.light_packet_ids = protocol_table.compile_ids(LIGHT_PACKETS)
+		self.block_change_packet_ids = protocol_table.compile_ids(BLOCK_CHANGE_PACKETS)
+		self.block_change_id = protocol_table.ids.get('Block Change')
+		self.unload_chunk_packet_ids = protocol_table.compile_ids(['Unload Chunk'])
+		self.player_info_packet_ids = protocol_table.compile_ids(PLAYER_INFO_PACKETS)
+		self.experience_orb_id = protocol_table.ids.get('Spawn Experience Orb')
+		self.painting_id = protocol_table.ids.get('Spawn Painting')
+		self.global_entity_packet_ids = protocol_table.compile_ids(GLOBAL_ENTITY_PACKETS)
+		self.spawn_packet_ids = frozenset(
+			packet_id for packet_id, packet_type in enumerate(protocol_table.types)
+			if packet_type in (PacketType.SpawnPlayer, PacketType.SpawnObject, PacketType.SpawnMob)
+		) | protocol_table.compile_ids(['Spawn Experience Orb', 'Spawn Painting']) | self.global_entity_packet_ids
+		self.destroy_entities_packet_ids = protocol_table.compile_ids(['Destroy Entities'])
+		self.change_game_state_packet_ids = protocol_table.compile_ids(['Change Game State'])
+		self.teleport_id = protocol_table.ids.get('Entity Teleport')
+		self.metadata_id = protocol_table.ids.get('Entity Metadata')
+		self.equipment_id = protocol_table.ids.get('Entity Equipment')
+		self.move_packet_ids = protocol_table.compile_ids(ENTITY_MOVE_PACKETS)
+		self.move_look_packet_ids = protocol_table.compile_ids(ENTITY_MOVE_LOOK_PACKETS)
+		self.look_packet_ids = protocol_table.compile_ids(ENTITY_LOOK_PACKETS)
+		self.latest_entity_packet_ids = protocol_table.compile_ids(LATEST_ENTITY_PACKETS)
+		self.entity_packet_ids = self.move_packet_ids | self.move_look_packet_ids | self.look_packet_ids | self.latest_entity_packet_ids | \
+			protocol_table.compile_ids(['Entity Teleport', 'Entity Metadata', 'Entity Equipment'])
+		self.join_game_id = protocol_table.ids.get('Join Game')
+		self.respawn_id = protocol_table.ids.get('Respawn')
+		self.tracked_packet_ids = self.latest_packet_ids | self.chunk_packet_ids | self.light_packet_ids | self.block_change_packet_ids | \
+			self.unload_chunk_packet_ids | self.player_info_packet_ids | self.spawn_packet_ids | self.destroy_entities_packet_ids | \
+			self.change_game_state_packet_ids | self.entity_packet_ids
+
+		self.latest_packets = {}  # packet id -> data
+		self.game_states = {}  # state -> data of Change Game State
+		self.chunks = collections.OrderedDict()  # (x, z) -> CachedChunk, least recently updated first
+		self.lights = {}  # (x, z) -> data
+		self.player_infos = {}  # uuid -> data of the Player Info packet that added the player
+		self.player_info_updates = collections.OrderedDict()  # (uuid, action) -> data of the latest Player Info packet updating the player, oldest first
+		self.entities = collections.OrderedDict()  # entity id -> CachedEntity, least recently updated first
+		self.size = 0  # bytes of the cached chunks, lights and entities
+		self.evicted_chunk_count = 0
+		self.evicted_entity_count = 0
+		self.bad_packet_count = 0
+
+	# data is a recorded raw packet, it's kept as it is so it must not be modified afterwards
+	def update(self, packet_id, data):
+		if packet_id not in self.tracked_packet_ids:
+			return
+		try:
+			self.__update(packet_id, data)
+		except (struct.error, IndexError, IOError):
+			self.bad_packet_count += 1  # the packet is still recorded, the state just misses it
+
+	def __update(self, packet_id, data):
+		packet = SARCPacket()
+		packet.receive(data)
+		packet.read_varint()
+		if packet_id in self.entity_packet_ids:
+			self.__update_entity(packet_id, packet, data)
+		elif packet_id in self.block_change_packet_ids:
+			self.__add_chunk_update(read_block_change_chunk(packet, self.protocol_table.protocol, packet_id != self.block_change_id), data)
+		elif packet_id in self.chunk_packet_ids:
+			pos, full = read_chunk_data_position(packet, self.protocol_table.protocol)
+			if not full:
+				self.__add_chunk_update(pos, data)
+			else:
+				self.__remove_chunk(pos, keep_light=True)
+				self.chunks[pos] = CachedChunk(data)
+				self.size += len(data)
+				self.__trim()
+		elif packet_id in self.light_packet_ids:
+			pos = (packet.read_varint(), packet.read_varint())
+			old_data = self.lights.get(pos)
+			self.size += len(data) - (len(old_data) if old_data is not None else 0)
+			self.lights[pos] = data
+		elif packet_id in self.unload_chunk_packet_ids:
+			self.__remove_chunk((packet.read_int(), packet.read_int()))
+		elif packet_id in self.player_info_packet_ids:
+			action = packet.read_varint()
+			if action == 0:  # add player, it's the only action that carries everything of the players
+				uuids = self.__read_player_info_uuids(packet, action)
+				for uuid in uuids:
+					self.player_infos[uuid] = data
+					self.__forget_player_info_updates(uuid)
+			elif action == 4:  # remove player
+				for uuid in self.__read_player_info_uuids(packet, action):
+					self.player_infos.pop(uuid, None)
+					self.__forget_player_info_updates(uuid)
+			elif action in (1, 2, 3):  # game mode, latency or display name, replayed after the Player Info packets that added the players
+				for uuid in self.__read_player_info_uuids(packet, action):
+					if uuid in self.player_infos:
+						self.player_info_updates.pop((uuid, action), None)
+						self.player_info_updates[(uuid, action)] = data
+		elif packet_id in self.spawn_packet_ids:
+			self.__spawn_entity(packet_id, packet, data)
+		elif packet_id in self.destroy_entities_packet_ids:
+			for i in range(packet.read_varint()):
+				entity = self.entities.pop(packet.read_varint(), None)
+				if entity is not None:
+					self.size -= entity.size
+		elif packet_id in self.change_game_state_packet_ids:
+			state = GAME_STATES.get(packet.read_ubyte())
+			if state is not None:
+				self.game_states[state] = data
+		else:
+			if packet_id in (self.join_game_id, self.respawn_id):
+				# the client starts with an empty world after these
+				self.chunks.clear()
+				self.lights.clear()
+				self.entities.clear()
+				self.game_states.clear()
+				self.size = 0
+			if packet_id == self.join_game_id:
+				self.latest_packets.clear()
+				self.player_infos.clear()
+				self.player_info_updates.clear()
+			self.latest_packets[packet_id] = data
+
+	def __forget_player_info_updates(self, uuid):
+		for action in (1, 2, 3):
+			self.player_info_updates.pop((uuid, action), None)
+
+	# The chunk is re-sent with the same content, which is not recorded, so it's as recently updated as a recorded one
+	def touch_chunk(self, pos):
+		if pos in self.chunks:
+			self.chunks.move_to_end(pos)
+
+	def __add_chunk_update(self, pos, data):
+		chunk = self.chunks.get(pos)
+		if chunk is None:
+			return  # the chunk is evicted or not loaded
+		chunk.updates.append(data)
+		chunk.size += len(data)
+		self.size += len(data)
+		self.chunks.move_to_end(pos)
+		self.__trim()
+
+	def __remove_chunk(self, pos, keep_light=False):
+		chunk = self.chunks.pop(pos, None)
+		if chunk is not None:
+			self.size -= chunk.size
+		if not keep_light:
+			light = self.lights.pop(pos, None)
+			if light is not None:
+				self.size -= len(light)
+
+	def __spawn_entity(self, packet_id, packet, data):
+		packet_type = self.protocol_table.get_type(packet_id)
+		entity_id = packet.read_varint()
+		uuid = None
+		yaw = pitch = 0
+		if packet_id == self.experience_orb_id:
+			x, y, z = packet.read_double(), packet.read_double(), packet.read_double()
+		elif packet_id in self.global_entity_packet_ids:
+			packet.read_byte()  # type
+			x, y, z = packet.read_double(), packet.read_double(), packet.read_double()
+		elif packet_id == self.painting_id:
+			packet.read_uuid()
+			if self.protocol_table.protocol < 393:  # 1.13 replaced the title with a motive id
+				packet.read_utf()
+			else:
+				packet.read_varint()
+			x, y, z = read_block_position(packet, self.protocol_table.protocol)
+		else:
+			uuid = packet.read_uuid()
+			if packet_type == PacketType.SpawnObject and self.object_type_is_byte:
+				packet.read_byte()
+			elif packet_type != PacketType.SpawnPlayer:
+				packet.read_varint()  # entity type
+			x, y, z = packet.read_double(), packet.read_double(), packet.read_double()
+			if packet_type == PacketType.SpawnObject:
+				pitch, yaw = packet.read_ubyte(), packet.read_ubyte()
+			else:
+				yaw, pitch = packet.read_ubyte(), packet.read_ubyte()
+		old_entity = self.entities.pop(entity_id, None)
+		if old_entity is not None:
+			self.size -= old_entity.size
+		entity = CachedEntity(entity_id, data, uuid if packet_type == PacketType.SpawnPlayer else None, x, y, z, yaw, pitch)
+		self.entities[entity_id] = entity
+		self.size += entity.size
+		self.__trim()
+
+	def __update_entity(self, packet_id, packet, data):
+		entity = self.entities.get(packet.read_varint())
+		if entity is None:
+			return
+		self.entities.move_to_end(entity.entity_id)
+		if packet_id == self.teleport_id:
+			entity.x, entity.y, entity.z = packet.read_double(), packet.read_double(), packet.read_double()
+			entity.yaw, entity.pitch = packet.read_ubyte(), packet.read_ubyte()
+			entity.on_ground = packet.read_bool()
+			entity.moved = True
+			return
+		if packet_id in self.move_packet_ids or packet_id in self.move_look_packet_ids:
+			# deltas are in 1/4096 block
+			entity.x += packet.read_short() / 4096
+			entity.y += packet.read_short() / 4096
+			entity.z += packet.read_short() / 4096
+			if packet_id in self.move_look_packet_ids:
+				entity.yaw, entity.pitch = packet.read_ubyte(), packet.read_ubyte()
+			entity.on_ground = packet.read_bool()
+			entity.moved = True
+			return
+		if packet_id in self.look_packet_ids:
+			entity.yaw, entity.pitch = packet.read_ubyte(), packet.read_ubyte()
+			entity.on_ground = packet.read_bool()
+			entity.moved = True
+			return
+
+		old_size = entity.size
+		if packet_id == self.metadata_id:
+			entity.metadata.append(data)
+			if len(entity.metadata) > WorldState.MaxMetadataPackets:
+				entity.metadata.pop(0)
+		elif packet_id == self.equipment_id:
+			entity.packets[(packet_id, data[packet.offset])] = data  # by the slot, or the first slot in 1.16+
+		else:
+			entity.packets[packet_id] = data
+		entity.update_size()
+		self.size += entity.size - old_size
+		self.__trim()
+
+	def set_byte_budget(self, byte_budget):
+		self.byte_budget = byte_budget
+		self.__trim()
+
+	# Evicts the least recently updated chunks, then non-player entities, until the cache fits in the byte budget
+	def __trim(self):
+		if self.size <= self.byte_budget:
+			return
+		while self.size > self.byte_budget and len(self.chunks) > 0:
+			pos = next(iter(self.chunks))
+			self.__remove_chunk(pos)
+			self.evicted_chunk_count += 1
+		if self.size > self.byte_budget:
+			for entity in list(self.entities.values()):
+				if self.size <= self.byte_budget:
+					break
+				if entity.uuid is None:
+					del self.entities[entity.entity_id]
+					self.size -= entity.size
+					self.evicted_entity_count += 1
+
+	# only the uuids are read, the rest of the player entries are skipped if needed
+	def __read_player_info_uuids(self, packet, action):
+		count = packet.read_varint()
+		if action == 4:
+			return [packet.read_uuid() for i in range(count)]
+		uuids = []
+		for i in range(count):
+			uuids.append(packet.read_uuid())
+			if action in (1, 2):  # game mode, latency
+				packet.read_varint()
+				continue
+			if action == 3:  # display name
+				if packet.read_bool():
+					packet.read_utf()
+				continue
+			packet.read_utf()  # name
+			for j in range(packet.read_varint()):  # properties
+				packet.read_utf()
+				packet.read_utf()
+				if packet.read_bool():
+					packet.read_utf()
+			packet.read_varint()  # game mode
+			packet.read_varint()  # ping
+			if packet.read_bool():
+				packet.read_utf()  # display name
+		return uuids
+
+	def player_uuids(self):
+		return [entity.uuid for entity in self.entities.values() if entity.uuid is not None]
+
+	def __teleport_packet(self, entity):
+		packet = SARCPacket()
+		packet.write_varint(self.teleport_id)
+		packet.write_varint(entity.entity_id)
+		packet.write_double(entity.x)
+		packet.write_double(entity.y)
+		packet.write_double(entity.z)
+		packet.write_ubyte(entity.yaw)
+		packet.write_ubyte(entity.pitch)
+		packet.write_bool(entity.on_ground)
+		return packet.flush()
+
+	# The raw packets that bring a client to the current state, to write at the beginning of a new segment, in the order the client expects them
+	def seed_packets(self):
+		packets = []
+		for packet_id in (self.join_game_id, self.respawn_id):
+			if packet_id in self.latest_packets:
+				packets.append(self.latest_packets[packet_id])
+		for packet_id, data in self.latest_packets.items():
+			if packet_id not in (self.join_game_id, self.respawn_id):
+				packets.append(data)
+		packets.extend(self.game_states.values())
+
+		# a Player Info packet might add players that have left, remove them right after it
+		player_info_packets = {}
+		for data in self.player_infos.values():
+			player_info_packets[id(data)] = data
+		for data in player_info_packets.values():
+			packets.append(data)
+		left_uuids = []
+		for data in player_info_packets.values():
+			packet = SARCPacket()
+			packet.receive(data)
+			packet.read_varint()
+			for uuid in self.__read_player_info_uuids(packet, packet.read_varint()):
+				if uuid not in self.player_infos:
+					left_uuids.append(uuid)
+		# the later game mode, latency and display name changes, in the order they came
+		update_packets = {}
+		for data in self.player_info_updates.values():
+			update_packets[id(data)] = data
+		packets.extend(update_packets.values())
+		if len(left_uuids) > 0:
+			packet = SARCPacket()
+			packet.write_varint(read_varint(next(iter(player_info_packets.values())))[0])
+			packet.write_varint(4)
+			packet.write_varint(len(left_uuids))
+			for uuid in left_uuids:
+				packet.write_uuid(uuid)
+			packets.append(packet.flush())
+
+		for pos, chunk in self.chunks.items():
+			if pos in self.lights:
+				packets.append(self.lights[pos])
+			packets.append(chunk.data)
+			packets.extend(chunk.updates)
+		for entity in self.entities.values():
+			packets.append(entity.spawn_data)
+			if entity.moved and self.teleport_id is not None:
+				packets.append(self.__teleport_packet(entity))
+			packets.extend(entity.packets.values())
+			packets.extend(entity.metadata)
+		return packets
+
+	def format_counts(self):
+		text = '{} chunks, {} player infos, {} entities ({} players), {}KB cached'.format(
+			len(self.chunks), len(self.player_infos), len(self.entities), sum(1 for entity in self.entities.values() if entity.uuid is not None),
+			utils.convert_file_size_KB(self.size)
+		)
+		if self.evicted_chunk_count > 0 or self.evicted_entity_count > 0:
+			text += ', {} chunks and {} entities evicted for the {}MB budget'.format(
+				self.evicted_chunk_count, self.evicted_entity_count, utils.convert_file_size_MB(self.byte_budget)
+			)
+		if self.bad_packet_count > 0:
+			text += ', {} unreadable packets skipped'.format(self.bad_packet_count)
+		return text